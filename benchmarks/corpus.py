@@ -0,0 +1,196 @@
+"""
+Deterministic benchmark corpus generators.
+
+Every generator takes a scale factor and returns the document text. The same scale always produces byte-identical
+output, so timings taken on different revisions are comparable.
+"""
+
+import random
+
+SEED = 20240101
+
+
+def kubernetes_multidoc(scale=1):
+    rng = random.Random(SEED)
+    docs = []
+    for i in range(1000 * scale):
+        name = "service-{}".format(i)
+        labels = "".join(
+            "        {}: {}\n".format(key, rng.choice(["frontend", "backend", "batch", "cache"]))
+            for key in ("app.kubernetes.io/component", "tier", "team")
+        )
+        env = "".join(
+            '            - name: VAR_{}\n              value: "{}"\n'.format(j, rng.randrange(10**6)) for j in range(8)
+        )
+        docs.append(
+            "apiVersion: apps/v1\n"
+            "kind: Deployment\n"
+            "metadata:\n"
+            "  name: {name}\n"
+            "  namespace: ns-{ns}\n"
+            "  labels:\n"
+            "    app: {name}\n"
+            "spec:\n"
+            "  replicas: {replicas}\n"
+            "  selector:\n"
+            "    matchLabels:\n"
+            "      app: {name}\n"
+            "  template:\n"
+            "    metadata:\n"
+            "      labels:\n"
+            "{labels}"
+            "    spec:\n"
+            "      containers:\n"
+            "        - name: main\n"
+            "          image: registry.example.com/{name}:1.{minor}.{patch}\n"
+            "          ports:\n"
+            "            - containerPort: {port}\n"
+            "          resources:\n"
+            "            limits: {{cpu: 500m, memory: 512Mi}}\n"
+            "          env:\n"
+            "{env}".format(
+                name=name,
+                ns=i % 7,
+                replicas=rng.randrange(1, 10),
+                labels=labels,
+                minor=rng.randrange(30),
+                patch=rng.randrange(100),
+                port=8000 + i % 1000,
+                env=env,
+            )
+        )
+    return "---\n" + "---\n".join(docs)
+
+
+def deep_nesting(scale=1):
+    depth = 100
+    lines = []
+    for tree in range(20 * scale):
+        for level in range(depth):
+            lines.append("{}level{}_{}:\n".format("  " * level, level, tree))
+        lines.append("{}leaf: {}\n".format("  " * depth, tree))
+    return "".join(lines)
+
+
+def ci_aliases(scale=1):
+    rng = random.Random(SEED + 1)
+    parts = [
+        ".defaults: &defaults\n"
+        "  image: python:3.12\n"
+        "  retry: 2\n"
+        "  tags: [docker, linux]\n"
+        "  variables: &vars\n"
+        "    PIP_CACHE_DIR: .cache/pip\n"
+        "    LANG: C.UTF-8\n"
+        ".artifacts: &artifacts\n"
+        "  artifacts:\n"
+        "    paths: [dist/, reports/]\n"
+        "    expire_in: 1 week\n"
+    ]
+    for i in range(1500 * scale):
+        parts.append(
+            "job-{i}:\n"
+            "  <<: [*defaults, *artifacts]\n"
+            "  stage: {stage}\n"
+            "  variables:\n"
+            "    <<: *vars\n"
+            '    SHARD: "{i}"\n'
+            "  script:\n"
+            "    - make test SHARD={i}\n"
+            "    - echo {token}\n".format(i=i, stage=rng.choice(["build", "test", "deploy"]), token=rng.random())
+        )
+    return "".join(parts)
+
+
+def commented_values(scale=1):
+    rng = random.Random(SEED + 2)
+    parts = ["# Default values for the chart.\n# This is a YAML-formatted file.\n"]
+    for i in range(1000 * scale):
+        parts.append(
+            "# -- Settings for component {i}\n"
+            "component{i}:\n"
+            "  # -- Enable the component\n"
+            "  enabled: {enabled}  # toggled by ops\n"
+            "  replicaCount: {replicas}\n"
+            "  image:\n"
+            "    repository: example/component{i}  # upstream image\n"
+            '    tag: "v{major}.{minor}"\n'
+            "  # -- Extra annotations\n"
+            "  annotations: {{}}\n".format(
+                i=i,
+                enabled=rng.choice(["true", "false"]),
+                replicas=rng.randrange(5),
+                major=rng.randrange(4),
+                minor=rng.randrange(20),
+            )
+        )
+    return "".join(parts)
+
+
+def repeated_scalars(scale=1):
+    rng = random.Random(SEED + 5)
+    values = ["true", "false", "yes", "no", "null", "enabled", "us-east-1", "eu-west-1", "v1.2.3", "1.0", "0x1F"]
+    rows = []
+    for i in range(20000 * scale):
+        rows.append(
+            "- {{id: {i}, region: {}, status: {}, tier: {}, flag: {}, version: {}, port: {}}}\n".format(
+                *(rng.choice(values) for _ in range(6)), i=i
+            )
+        )
+    return "".join(rows)
+
+
+def xml_feed(scale=1):
+    rng = random.Random(SEED + 3)
+    items = []
+    for i in range(5000 * scale):
+        items.append(
+            '  <item id="{i}" lang="{lang}">\n'
+            "    <title>Item {i} &amp; friends</title>\n"
+            "    <link>https://example.com/items/{i}</link>\n"
+            '    <price currency="EUR">{price:.2f}</price>\n'
+            "    <category>{category}</category>\n"
+            "    <description>{description}</description>\n"
+            "  </item>\n".format(
+                i=i,
+                lang=rng.choice(["en", "de", "fr"]),
+                price=rng.random() * 100,
+                category=rng.choice(["books", "music", "garden", "tools"]),
+                description=" ".join(rng.choice(["lorem", "ipsum", "dolor", "sit", "amet"]) for _ in range(20)),
+            )
+        )
+    return '<?xml version="1.0" encoding="utf-8"?>\n<feed>\n' + "".join(items) + "</feed>\n"
+
+
+def toml_lockfile(scale=1):
+    rng = random.Random(SEED + 4)
+    parts = ["# This file is automatically generated.\nversion = 3\n"]
+    for i in range(2000 * scale):
+        parts.append(
+            "\n[[package]]\n"
+            'name = "package-{i}"\n'
+            'version = "{major}.{minor}.{patch}"\n'
+            'source = "registry+https://github.com/rust-lang/crates.io-index"\n'
+            'checksum = "{checksum:064x}"\n'
+            'dependencies = [\n "package-{dep1}",\n "package-{dep2}",\n]\n'.format(
+                i=i,
+                major=rng.randrange(3),
+                minor=rng.randrange(40),
+                patch=rng.randrange(20),
+                checksum=rng.getrandbits(256),
+                dep1=rng.randrange(max(i, 1)),
+                dep2=rng.randrange(max(i, 1)),
+            )
+        )
+    return "".join(parts)
+
+
+corpora = {
+    "k8s.yml": kubernetes_multidoc,
+    "deep.yml": deep_nesting,
+    "ci-aliases.yml": ci_aliases,
+    "values-comments.yml": commented_values,
+    "scalars.yml": repeated_scalars,
+    "feed.xml": xml_feed,
+    "lock.toml": toml_lockfile,
+}
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+Time the converters that walk nested documents at increasing nesting depths.
+
+Each case builds a document nested ``depth`` levels deep in memory and times one conversion in-process: loading YAML
+with the loaders returned by ``get_loader`` (the composed-node path used for annotations and pruning), dumping YAML with
+``dump_all``, and converting tomlkit documents with ``tomlkit_to_json`` and ``tomlkit_from_json``. The median time over
+``--repeat`` runs and the time per nesting level are reported; a case that fails (for example with RecursionError in a
+library that still recurses) reports the exception instead. Use ``--json FILE`` to save results and ``--compare FILE``
+to print speedups relative to a saved run.
+
+Some limits are outside of yq: "yaml load" composes nodes with libyaml's C composer, which recurses on the C stack and
+can crash the interpreter somewhere beyond 10000 levels, and "toml from json" is bounded by tomlkit, which renames the
+whole subtree (recursively) every time a table is inserted.
+"""
+
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tomlkit  # noqa
+
+from yq.dumper import dump_all, get_dumper  # noqa
+from yq.loader import get_loader  # noqa
+from yq.toml_support import tomlkit_from_json, tomlkit_to_json  # noqa
+
+
+def nested_list(depth):
+    # Dumped as "- - - x", so that the text grows linearly with depth
+    doc = ["x"]
+    for _ in range(depth - 1):
+        doc = [doc]
+    return doc
+
+
+def nested_dict(depth):
+    # Dumped with one indented line per level, so that the text grows with the square of the depth
+    doc = {"x": 1}
+    for _ in range(depth - 1):
+        doc = {"a": doc, "b": 1}
+    return doc
+
+
+def block_sequence(depth):
+    # One line per level, so that the text grows linearly with depth
+    return "- " * depth + "x\n"
+
+
+def nested_tables(depth):
+    doc = tomlkit.document()
+    table = doc
+    for _ in range(depth):
+        inner = tomlkit.table()
+        table.append("a", inner)
+        table = inner
+    table.append("x", 1)
+    return doc
+
+
+def nested_arrays(depth):
+    array = tomlkit.array()
+    outer = array
+    for _ in range(depth - 1):
+        inner = tomlkit.array()
+        array.append(inner)
+        array = inner
+    doc = tomlkit.document()
+    doc.append("a", outer)
+    return doc
+
+
+def load_yaml(text, use_annotations):
+    loader = get_loader(use_annotations=use_annotations)(text)
+    try:
+        return loader.construct_document(loader.get_single_node())
+    finally:
+        loader.dispose()
+
+
+def dump_yaml(doc, use_annotations):
+    dump_all([doc], io.StringIO(), Dumper=get_dumper(use_annotations=use_annotations), use_annotations=use_annotations)
+
+
+# name, setup(depth) returning the input, conversion
+cases = [
+    ("yaml load", block_sequence, lambda text: load_yaml(text, False)),
+    ("yaml load -Y", block_sequence, lambda text: load_yaml(text, True)),
+    ("yaml dump lists", nested_list, lambda doc: dump_yaml(doc, False)),
+    ("yaml dump dicts", nested_dict, lambda doc: dump_yaml(doc, False)),
+    ("yaml dump lists -Y", nested_list, lambda doc: dump_yaml(doc, True)),
+    ("toml to json tables", nested_tables, tomlkit_to_json),
+    ("toml to json arrays", nested_arrays, tomlkit_to_json),
+    ("toml from json", nested_dict, tomlkit_from_json),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depths", default="10,100,1000,10000", help="comma-separated nesting depths")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case (the median is reported)")
+    parser.add_argument("--filter", help="only run cases whose name contains this string")
+    parser.add_argument("--json", help="write results to this file as JSON")
+    parser.add_argument("--compare", help="print speedups relative to results previously saved with --json")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = {(result["case"], result["depth"]): result for result in json.load(fh)["results"]}
+
+    results = []
+    print("{:<24} {:>8} {:>12} {:>14} {:>9}".format("case", "depth", "median s", "us per level", "speedup"))
+    for name, setup, convert in cases:
+        if args.filter and args.filter not in name:
+            continue
+        for depth in [int(depth) for depth in args.depths.split(",")]:
+            data = setup(depth)
+            timings, error = [], None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                try:
+                    convert(data)
+                except Exception as e:
+                    error = type(e).__name__
+                    break
+                timings.append(time.perf_counter() - start)
+            result = dict(case=name, depth=depth, seconds=statistics.median(timings) if timings else None, error=error)
+            results.append(result)
+            if error:
+                print("{:<24} {:>8} {:>12}".format(name, depth, error))
+                continue
+            speedup = ""
+            previous = baseline.get((name, depth))
+            if previous and previous["seconds"]:
+                speedup = "{:.2f}x".format(previous["seconds"] / result["seconds"])
+            print(
+                "{:<24} {:>8} {:>12.4f} {:>14.2f} {:>9}".format(
+                    name, depth, result["seconds"], result["seconds"] / depth * 1e6, speedup
+                )
+            )
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(dict(python=sys.version, recursion_limit=sys.getrecursionlimit(), results=results), fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
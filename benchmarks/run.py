@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Time yq, xq and tomlq on the generated corpora in every output mode.
+
+Each case runs in a fresh interpreter (``python -m yq ...``) with output sent to /dev/null. The median wall time over
+``--repeat`` runs, the resulting input throughput and the peak RSS of the yq process are reported. Use ``--json FILE``
+to save results and ``--compare FILE`` to print speedups relative to a saved run.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from corpus import corpora  # noqa
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+modules = {"yq": "yq", "xq": "yq.xq", "tomlq": "yq.tomlq"}
+
+cases = [
+    ("yq", "k8s.yml", ["."]),
+    ("yq", "k8s.yml", ["-y", "."]),
+    ("yq", "k8s.yml", ["-Y", "."]),
+    ("yq", "k8s.yml", ["-i", "-y", "."]),
+    ("yq", "k8s.yml", ["--jq-workers", "4", "."]),
+    ("yq", "deep.yml", ["."]),
+    ("yq", "deep.yml", ["-y", "."]),
+    ("yq", "ci-aliases.yml", ["."]),
+    ("yq", "ci-aliases.yml", ["-y", "."]),
+    ("yq", "ci-aliases.yml", ["-Y", "."]),
+    ("yq", "values-comments.yml", ["."]),
+    ("yq", "values-comments.yml", ["-y", "."]),
+    ("yq", "values-comments.yml", ["-Y", "."]),
+    ("yq", "values-comments.yml", ["-i", "-Y", "."]),
+    ("yq", "scalars.yml", ["."]),
+    ("yq", "scalars.yml", ["-y", "."]),
+    ("xq", "feed.xml", ["."]),
+    ("xq", "feed.xml", ["-c", "."]),
+    ("xq", "feed.xml", ["-y", "."]),
+    ("xq", "feed.xml", ["-x", "."]),
+    ("xq", "feed.xml", ["-i", "-x", "."]),
+    ("tomlq", "lock.toml", ["."]),
+    ("tomlq", "lock.toml", ["-y", "--convert"]),
+    ("tomlq", "lock.toml", ["-t", "."]),
+    ("tomlq", "lock.toml", ["-T", "."]),
+    ("tomlq", "lock.toml", ["-i", "-T", "."]),
+    ("tomlq", "lock.toml", ["-T", '.package[0].version = "0"']),
+]
+
+
+def case_name(program, corpus, args):
+    return " ".join([program] + args + [corpus])
+
+
+def write_corpus(directory, scale):
+    paths = {}
+    for name, generator in corpora.items():
+        paths[name] = os.path.join(directory, name)
+        with open(paths[name], "w") as fh:
+            fh.write(generator(scale))
+    return paths
+
+
+def run_once(program, path, args, workdir):
+    if "-i" in args:
+        target = os.path.join(workdir, "in-place-" + os.path.basename(path))
+        shutil.copyfile(path, target)
+        path = target
+    env = dict(os.environ, PYTHONPATH=repo_root)
+    with open(os.devnull, "w") as devnull:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-m", modules[program]] + args + [path], stdout=devnull, env=env)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    if proc.returncode != 0:
+        raise Exception("{} exited with status {}".format(case_name(program, path, args), proc.returncode))
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = rusage.ru_maxrss if sys.platform == "darwin" else rusage.ru_maxrss * 1024
+    return elapsed, peak_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1, help="corpus size multiplier")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case (the median is reported)")
+    parser.add_argument("--filter", help="only run cases whose name contains this string")
+    parser.add_argument("--json", help="write results to this file as JSON")
+    parser.add_argument("--compare", help="print speedups relative to results previously saved with --json")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = {result["case"]: result for result in json.load(fh)["results"]}
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = write_corpus(workdir, args.scale)
+        print(
+            "{:<44} {:>9} {:>9} {:>9} {:>10} {:>9}".format(
+                "case", "input MB", "median s", "MB/s", "peak RSS", "speedup"
+            )
+        )
+        for program, corpus, mode_args in cases:
+            name = case_name(program, corpus, mode_args)
+            if args.filter and args.filter not in name:
+                continue
+            timings, peaks = [], []
+            for _ in range(args.repeat):
+                elapsed, peak_rss = run_once(program, paths[corpus], mode_args, workdir)
+                timings.append(elapsed)
+                peaks.append(peak_rss)
+            input_bytes = os.path.getsize(paths[corpus])
+            result = dict(
+                case=name,
+                input_bytes=input_bytes,
+                seconds=statistics.median(timings),
+                throughput=input_bytes / statistics.median(timings),
+                peak_rss=max(peaks),
+            )
+            results.append(result)
+            speedup = ""
+            if name in baseline:
+                speedup = "{:.2f}x".format(baseline[name]["seconds"] / result["seconds"])
+            print(
+                "{:<44} {:>9.2f} {:>9.3f} {:>9.2f} {:>8.1f}MB {:>9}".format(
+                    name,
+                    input_bytes / 2**20,
+                    result["seconds"],
+                    result["throughput"] / 2**20,
+                    result["peak_rss"] / 2**20,
+                    speedup,
+                )
+            )
+            sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(dict(scale=args.scale, python=sys.version, results=results), fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,10 @@ import sys
 import tempfile
 import unittest
 
+import yaml
+
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from yq import cli, yq  # noqa
+from yq import cli, yq, yq_multi  # noqa
 
 USING_PYPY = True if platform.python_implementation() == "PyPy" else False
 
@@ -71,7 +73,7 @@ class TestYq(unittest.TestCase):
                 cli(["--help"], input_format=input_format)
             except SystemExit as e:
                 self.assertEqual(e.code, 0)
-        self.assertEqual(self.run_yq("{}", ["."]), "")
+        self.assertEqual(self.run_yq("{}", ["."]), "{}\n")
         self.assertEqual(self.run_yq("foo:\n bar: 1\n baz: {bat: 3}", [".foo.baz.bat"]), "")
         self.assertEqual(self.run_yq("[1, 2, 3]", ["--yaml-output", "-M", "."]), "- 1\n- 2\n- 3\n")
         self.assertEqual(self.run_yq("foo:\n bar: 1\n baz: {bat: 3}", ["-y", ".foo.baz.bat"]), "3\n...\n")
@@ -100,6 +102,523 @@ class TestYq(unittest.TestCase):
                 "yq 1.2.3\njq version could not be determined: jq not found\n",
             )
 
+    def test_yq_async(self):
+        import asyncio
+
+        from yq.aio import YqError, yq_async, yq_gather
+
+        outputs = [io.StringIO() for _ in range(8)]
+        jobs = [
+            dict(
+                input_streams=[io.StringIO("a: {}\nb: [1, 2]\n".format(i))],
+                output_stream=outputs[i],
+                output_format="yaml" if i % 2 else "json",
+                jq_args=["-c", ".b[1] + .a"],
+            )
+            for i in range(len(outputs))
+        ]
+        self.assertEqual(asyncio.run(yq_gather(jobs, concurrency=3)), [os.EX_OK] * len(outputs))
+        for i, output in enumerate(outputs):
+            self.assertEqual(output.getvalue(), "{}\n...\n".format(i + 2) if i % 2 else "{}\n".format(i + 2))
+
+        large_doc = "".join("- {{a: {}, b: cdefghijklmnopqrstuvwxyz}}\n".format(i) for i in range(20000))
+        with io.StringIO() as output:
+            asyncio.run(yq_async(input_streams=[io.StringIO(large_doc)], output_stream=output, jq_args=["length"]))
+            self.assertEqual(output.getvalue(), "20000\n")
+
+        with self.assertRaisesRegex(YqError, "unsafe YAML entity expansion"):
+            asyncio.run(yq_async(input_streams=[io.StringIO(bomb_yaml)], output_stream=io.StringIO(), jq_args=["."]))
+
+        # The input options of yq.yq() are accepted too
+        with io.StringIO() as output:
+            input_stream = io.StringIO("a: [1, 2]\n")
+            input_stream.name = "a.yml"
+            jq_args = ["-c", "[.filename, .document]"]
+            job = yq_async(
+                input_streams=[input_stream],
+                output_stream=output,
+                yaml_item_depth=2,
+                with_filename=True,
+                jq_args=jq_args,
+            )
+            asyncio.run(job)
+            self.assertEqual(output.getvalue(), '["a.yml",1]\n["a.yml",2]\n')
+        with io.StringIO() as output:
+            input_stream = io.StringIO("a = 1  # a\n\n[t]\nb = 'x'\n")
+            job = yq_async(
+                input_streams=[input_stream],
+                output_stream=output,
+                input_format="toml",
+                output_format="annotated_toml",
+                jq_args=['.t.b = "y"'],
+            )
+            asyncio.run(job)
+            self.assertEqual(output.getvalue(), "a = 1  # a\n\n[t]\nb = 'y'\n")
+
+    def test_profile(self):
+        import json
+        from unittest import mock
+
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            self.assertEqual(self.run_yq("a: é\n---\na: 2\n", ["--profile", "-y", ".a"]), "é\n--- 2\n...\n")
+        report = json.loads(stderr.getvalue())
+        for phase in "jq_start", "encode", "yaml_construct", "json_encode", "jq", "json_decode", "dump":
+            self.assertIn(phase, report["phases"])
+        self.assertEqual(report["counters"]["input_documents"], 2)
+        self.assertEqual(report["counters"]["output_documents"], 2)
+        # Sizes are counted in bytes
+        self.assertEqual(report["counters"]["input_bytes"], len("a: é\n---\na: 2\n".encode()))
+        self.assertEqual(report["counters"]["json_bytes_to_jq"], len('{"yq_pruned": "\\u00e9"}\n{"yq_pruned": 2}\n'))
+        self.assertEqual(report["counters"]["json_bytes_from_jq"], len('"é"\n2\n'.encode()))
+        self.assertEqual(report["counters"]["output_bytes"], len("é\n--- 2\n...\n".encode()))
+        self.assertEqual(report["loader_class"], "CSafeLoader" if hasattr(yaml, "CSafeLoader") else "SafeLoader")
+        self.assertEqual(report["dumper_class"], "OrderedDumper")
+        self.assertEqual(report["jq_returncode"], 0)
+
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr, mock.patch.dict(os.environ, YQ_PROFILE="1"):
+            self.run_yq("<a>b</a>", [".a"], input_format="xml")
+        self.assertIn("jq_wait", json.loads(stderr.getvalue())["phases"])
+
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            self.run_yq("a: 1\n", ["--profile-memory", "-y", ".a"])
+        memory = json.loads(stderr.getvalue())["memory"]
+        self.assertIn("peak_rss", memory)
+        if sys.version_info >= (3, 9):
+            self.assertIn(memory["largest_allocation_phase"], json.loads(stderr.getvalue())["phases"])
+
+    @unittest.skipIf(sys.platform != "linux", "RLIMIT_AS is only enforced on Linux")
+    def test_max_memory(self):
+        from yq.limits import MemoryLimit
+
+        self.assertEqual(self.run_yq("a: 1\n", ["--max-memory", "1G", "-y", "."]), "a: 1\n")
+        doc = "- " + "\n- ".join("{}{}".format("x" * 200, i) for i in range(400000)) + "\n"
+        err = "yq: Error: exceeded the memory limit of 10485760 bytes set with --max-memory"
+        self.assertEqual(self.run_yq(doc, ["--max-memory", "10M", "length"], expect_exit_codes={err}), "")
+        err = "yq: Error: jq was terminated by signal 6, likely after exceeding the memory limit of 10485760 bytes"
+        self.assertEqual(self.run_yq("", ["--max-memory", "10M", "-n", "[range(1e7)]"], expect_exit_codes={err}), "")
+        # The limit does not make allocations fail, so other threads are not affected
+        memory_limit = MemoryLimit(2**20)
+        memory_limit.apply()
+        try:
+            data = bytearray(2 * 2**20)
+            with self.assertRaises(MemoryError):
+                memory_limit.writer(io.StringIO()).write("x")
+        finally:
+            memory_limit.release()
+        del data
+
+    def test_yq_multi(self):
+        outputs = [
+            dict(jq_args=["-c", ".a"], output_stream=io.StringIO()),
+            dict(jq_args=[".b"], output_stream=io.StringIO(), output_format="yaml"),
+            dict(jq_args=["."], output_stream=io.StringIO(), output_format="annotated_yaml"),
+        ]
+        exit_codes = []
+        yq_multi(
+            input_streams=[io.StringIO("a: [1, 2]\nb: !x ab cd  # c\n")],
+            outputs=outputs,
+            exit_func=exit_codes.append,
+        )
+        self.assertEqual(exit_codes, [0])
+        self.assertEqual(
+            [output["output_stream"].getvalue() for output in outputs],
+            ["[1,2]\n", "ab cd\n...\n", "a: [1, 2]\nb: !x 'ab cd' # c\n"],
+        )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "b.yml")
+            self.assertEqual(self.run_yq("a: 1\nb: [2]\n", ["-y", "--filter-to", ".b", output_path, ".a"]), "1\n...\n")
+            with open(output_path) as fh:
+                self.assertEqual(fh.read(), "- 2\n")
+            err = "yq: --filter-to requires a filter argument and cannot be used with -i/--in-place"
+            self.run_yq("a: 1\n", ["-y", "-i", "--filter-to", ".b", output_path, ".a"], expect_exit_codes={err})
+
+    def test_cache_dir(self):
+        from unittest import mock
+
+        from yq.cache import is_cacheable
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            results_dir = os.path.join(cache_dir, "results")
+            args = ["--cache-dir", cache_dir]
+            self.assertEqual(self.run_yq("a: [1, 2]\n", args + ["-y", ".a"]), "- 1\n- 2\n")
+            self.assertEqual(self.run_yq("a: [1, 2]\n", args + ["-c", ".a"]), "[1,2]\n")
+            self.assertEqual(len(os.listdir(results_dir)), 2)
+            for entry in os.listdir(results_dir):
+                with open(os.path.join(results_dir, entry), "a") as fh:
+                    fh.write("cached\n")
+            self.assertEqual(self.run_yq("a: [1, 2]\n", args + ["-y", ".a"]), "- 1\n- 2\ncached\n")
+            self.assertEqual(self.run_yq("a: [1, 2]\n", args + ["-c", ".a"]), "[1,2]\ncached\n")
+            self.assertEqual(self.run_yq("a: [1, 3]\n", args + ["-y", ".a"]), "- 1\n- 3\n")
+            self.assertEqual(self.run_yq("a: [1, 2]\n", args + ["-y", "-w", "1", ".a"]), "- 1\n- 2\n")
+            self.assertEqual(self.run_yq("a: 1\n", args + ["-y", "$ENV | .a"]), "null\n...\n")
+            self.run_yq("a: 1\n", args + ["-y", "error"], expect_exit_codes={5})
+            self.assertEqual(len(os.listdir(results_dir)), 4)
+            self.assertEqual(self.run_yq("a: 1\n", args + ["--cache-size", "1", "-y", ".a"]), "1\n...\n")
+            self.assertEqual(os.listdir(results_dir), [])
+            # Files with the same contents are tagged with their own names
+            for name in "x.yml", "y.yml":
+                path = os.path.join(cache_dir, name)
+                with open(path, "w") as fh:
+                    fh.write("a: 1\n")
+                self.assertEqual(self.run_yq("", args + ["--with-filename", "-y", ".filename", path]), path + "\n...\n")
+            # Modules, time zones and the definitions in ~/.jq are not part of the program
+            for filter in ['include "m"; .', 'import "m" as m; .', ".a | localtime", '.a | strptime("%s")']:
+                self.assertFalse(is_cacheable([filter]), filter)
+            self.assertTrue(is_cacheable([".include"]))
+            with mock.patch.dict(os.environ, HOME=cache_dir):
+                for defs in "def f: 1;", "def f: 2;":
+                    with open(os.path.join(cache_dir, ".jq"), "w") as fh:
+                        fh.write(defs)
+                    self.assertEqual(self.run_yq("a: 1\n", args + ["-y", "f"]), defs[-2] + "\n...\n")
+            # A missing jq is reported like when it is started
+            err = "yq: Error starting jq: FileNotFoundError: jq not found. Is jq installed and available on PATH?"
+            with mock.patch("yq.get_jq_version", side_effect=FileNotFoundError("jq not found")):
+                self.assertEqual(self.run_yq("a: 1\n", args + [".a"], expect_exit_codes={err}), "")
+
+    def test_document_cache(self):
+        from unittest import mock
+
+        from yq.cache import DocumentCache
+
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch.object(DocumentCache, "racy_interval", -1):
+            cache_dir, doc_path = os.path.join(tmp_dir, "cache"), os.path.join(tmp_dir, "doc.yml")
+            documents_dir = os.path.join(cache_dir, "documents")
+            args = ["--cache-dir", cache_dir, "-y"]
+
+            def write_doc(contents):
+                with open(doc_path, "w") as fh:
+                    fh.write(contents)
+
+            def cached_documents():
+                return [os.path.join(documents_dir, entry) for entry in sorted(os.listdir(documents_dir))]
+
+            # Filters that are a simple path are pruned instead, so these tests use other filters
+            write_doc("a: 1\n")
+            self.assertEqual(self.run_yq("", args + [".a * 1", doc_path]), "1\n...\n")
+            self.assertEqual(len(cached_documents()), 1)
+            # A hit reads the cached JSON instead of parsing the file (use a different filter to skip the result cache)
+            with open(cached_documents()[0], "w") as fh:
+                fh.write('{"a": 2}\n')
+            self.assertEqual(self.run_yq("", args + [".a + 0", doc_path]), "2\n...\n")
+
+            # Same size, restored mtime: the change time still differs
+            mtime = os.stat(doc_path).st_mtime_ns
+            write_doc("a: 3\n")
+            os.utime(doc_path, ns=(mtime, mtime))
+            self.assertEqual(self.run_yq("", args + [".a + 1", doc_path]), "4\n...\n")
+            # Replaced by a new file (new inode)
+            with open(doc_path + ".new", "w") as fh:
+                fh.write("a: 5\n")
+            os.replace(doc_path + ".new", doc_path)
+            self.assertEqual(self.run_yq("", args + [".a + 2", doc_path]), "7\n...\n")
+            # Loader options are part of the key
+            entries = len(cached_documents())
+            self.assertEqual(self.run_yq("", args + ["--no-expand-aliases", ".a + 3", doc_path]), "8\n...\n")
+            self.assertEqual(len(cached_documents()), entries + 1)
+            # Standard input is not cached
+            self.assertEqual(self.run_yq("a: 6\n", args + [".a * 1"]), "6\n...\n")
+            self.assertEqual(len(cached_documents()), entries + 1)
+            # Eviction applies to the whole cache directory
+            self.assertEqual(self.run_yq("", args + ["--cache-size", "1", ".a + 4", doc_path]), "9\n...\n")
+            self.assertEqual(cached_documents(), [])
+
+        with tempfile.TemporaryDirectory() as cache_dir, tempfile.NamedTemporaryFile("w", suffix=".yml") as doc:
+            doc.write("a: 1\n")
+            doc.flush()
+            # Files changed within racy_interval are not cached
+            self.assertEqual(self.run_yq("", ["--cache-dir", cache_dir, "-y", ".a * 1", doc.name]), "1\n...\n")
+            self.assertEqual(os.listdir(os.path.join(cache_dir, "documents")), [])
+
+    def test_path_pruning(self):
+        from yq.prune import prune_jq_args
+
+        doc = "spec:\n  template: {a: [1, 2]}\n  other: x\nitems: [a, b, {c: d}]\n"
+        self.assertEqual(self.run_yq(doc, ["-y", ".spec.template"]), "a:\n  - 1\n  - 2\n")
+        self.assertEqual(self.run_yq(doc, ["-y", ".items[2] | keys"]), "- c\n")
+        self.assertEqual(self.run_yq(doc, ["-y", '.["spec"].missing.x']), "null\n...\n")
+        self.assertEqual(self.run_yq(doc, ["-y", ".items[7]"]), "null\n...\n")
+        # Paths that cannot be followed in the node graph fall back to jq
+        self.assertEqual(self.run_yq("a: &x {b: 1}\nc:\n  <<: *x\n", ["-y", ".c.b"]), "1\n...\n")
+        self.assertEqual(self.run_yq("1: a\n", ["-y", '.["1"]']), "a\n...\n")
+        self.run_yq(doc, ["-c", ".items.a"], expect_exit_codes={5})
+        self.run_yq(doc, ["-c", ".spec[0]"], expect_exit_codes={5})
+        self.assertEqual(prune_jq_args(["-c", ".a.b[1]", "--arg", "x", "y"])[0], ["a", "b", 1])
+        for jq_args in [["."], [".a[]"], [".a?"], [".a, .b"], [".a |= 1"], [".a | input"], ["-s", ".a"], ["-n", ".a"]]:
+            self.assertIsNone(prune_jq_args(jq_args))
+
+    def test_yaml_stream(self):
+        doc = "a: &x {b: [1, 2], c: {}}\nd: *x\n3: []\n---\nplain\n"
+        self.assertEqual(
+            self.run_yq(doc, ["-y", "--yaml-stream", "select(length == 2)"]),
+            "- - a\n  - b\n  - 0\n- 1\n---\n- - a\n  - b\n  - 1\n- 2\n---\n- - a\n  - c\n- {}\n---\n"
+            "- - d\n  - b\n  - 0\n- 1\n---\n- - d\n  - b\n  - 1\n- 2\n---\n- - d\n  - c\n- {}\n---\n"
+            "- - '3'\n- []\n---\n- []\n- plain\n",
+        )
+        self.assertEqual(
+            self.run_yq(doc, ["-y", "--yaml-stream", "fromstream(., inputs)"]),
+            self.run_yq(doc, ["-y", "."]),
+        )
+        jq_filter = ". as $e | fromstream(1 | truncate_stream($e, inputs))"
+        self.assertEqual(self.run_yq("[[1], [2]]", ["-y", "--yaml-stream", jq_filter]), "- 1\n---\n- 2\n")
+        err = "yq: Error streaming YAML: merge keys are not supported with --yaml-stream"
+        self.run_yq("a: &x {b: 1}\nc:\n  <<: *x\n", ["--yaml-stream", "."], expect_exit_codes={err})
+        err = "yq: Error: detected unsafe YAML entity expansion"
+        self.run_yq(bomb_yaml, ["-y", "--yaml-stream", "empty"], expect_exit_codes={err})
+
+    def test_yaml_item_depth(self):
+        doc = "defaults: &d {x: 1}\nitems:\n  - a: 1\n  - <<: *d\n    y: 2\n  - [1, 2]\nplain: z\n"
+        self.assertEqual(
+            self.run_yq(doc, ["-y", "--yaml-item-depth", "2", "."]), "1\n---\na: 1\n---\nx: 1\ny: 2\n---\n- 1\n- 2\n"
+        )
+        self.assertEqual(self.run_yq(doc, ["-y", "--yaml-item-depth", "1", "length"]), "1\n--- 3\n--- 1\n...\n")
+        self.assertEqual(self.run_yq("- a\n---\n- b\n", ["-y", "--yaml-item-depth", "1", "."]), "a\n--- b\n...\n")
+        err = "yq: Error streaming YAML: found undefined alias x"
+        self.run_yq("[*x]", ["--yaml-item-depth", "1", "."], expect_exit_codes={err})
+        # Merged items would have to be emitted before the keys that override them are read
+        err = "yq: Error streaming YAML: merge keys above the item depth are not supported with --yaml-item-depth"
+        doc = "d: &d {image: py, n: 2}\njobs: {a: {<<: *d, script: x}}\n"
+        self.assertEqual(self.run_yq(doc, ["-y", "--yaml-item-depth", "2", "objects | .image"]), "py\n...\n")
+        self.run_yq(doc, ["-y", "--yaml-item-depth", "3", "."], expect_exit_codes={err})
+        self.run_yq("a: &a {b: {<<: {c: 1}}}\nd: *a\n", ["-y", "--yaml-item-depth", "3", "."], expect_exit_codes={err})
+
+    def test_directory_input(self):
+        from unittest import mock
+
+        from yq.inputs import InputDirectory, encode_directory
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "sub", "skip"))
+            for path, contents in [
+                ("a.yml", "a: 1\n"),
+                ("README", "text"),
+                ("sub/b.toml", "b = 2\n"),
+                ("sub/c.json", '{"c": 3}'),
+                ("sub/skip/d.yaml", "d: 4\n"),
+            ]:
+                with open(os.path.join(tmp_dir, path), "w") as fh:
+                    fh.write(contents)
+            self.assertEqual(self.run_yq("", ["-y", "-c", "keys[0]", tmp_dir]), "a\n--- c\n--- d\n...\n")
+            args = ["-y", "--exclude", "skip", "--include", "*.toml", "--include", "*.yml", "--with-filename"]
+            self.assertEqual(
+                self.run_yq("", args + ["--arg", "d", tmp_dir, "{(.filename | ltrimstr($d)): .document}", tmp_dir]),
+                "/a.yml:\n  a: 1\n---\n/sub/b.toml:\n  b: 2\n",
+            )
+            self.assertEqual(self.run_yq("e: 5\n", ["-y", "--with-filename", ".filename"]), "null\n...\n")
+            self.run_yq("", ["-i", "-y", ".x = 0", tmp_dir])
+            with open(os.path.join(tmp_dir, "sub", "skip", "d.yaml")) as fh:
+                self.assertEqual(fh.read(), "d: 4\nx: 0\n")
+            with open(os.path.join(tmp_dir, "sub", "c.json")) as fh:
+                self.assertEqual(fh.read(), '{"c": 3}')
+
+        # Files are only found as tasks are submitted to a bounded window of worker tasks
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i in range(100):
+                with open(os.path.join(tmp_dir, "{:03}.yml".format(i)), "w") as fh:
+                    fh.write("a: {}\n".format(i))
+            files_found, find_files = [], InputDirectory.files
+
+            def files(directory, *args):
+                for path, file_format in find_files(directory, *args):
+                    files_found.append(path)
+                    yield path, file_format
+
+            with mock.patch("os.cpu_count", return_value=2), mock.patch("yq.inputs.files_per_task", 3), mock.patch(
+                "yq.inputs.InputDirectory.files", files
+            ):
+                encoded = encode_directory(InputDirectory(tmp_dir), "yaml", (), (), {})
+                self.assertEqual(next(encoded), (os.path.join(tmp_dir, "000.yml"), '{"a": 0}\n'))
+                self.assertLess(len(files_found), 20)
+                self.assertEqual(len(list(encoded)), 99)
+
+    def test_json_input(self):
+        doc = '{"a": [1, 2.5, "2001-01-01", "on"], "b": null}\n'
+        for input_format in "auto", "json", "yaml":
+            self.assertEqual(
+                self.run_yq(doc, ["-y", "--input-format", input_format, "."]),
+                "a:\n  - 1\n  - 2.5\n  - '2001-01-01'\n  - 'on'\nb: null\n",
+            )
+        # Unlike the YAML parser, the JSON parser accepts a sequence of JSON values
+        self.assertEqual(self.run_yq("[1] [2]\n", ["-y", "."]), "- 1\n---\n- 2\n")
+        self.assertEqual(self.run_yq('{"a": {"b": 1}}', ["-y", ".a.b"]), "1\n...\n")
+        self.run_yq('{"a": 3}', ["-y", ".a.b"], expect_exit_codes={5})
+        # YAML that looks like JSON at first is still parsed as YAML
+        self.assertEqual(self.run_yq("{a: 1}\n", ["-y", "."]), "a: 1\n")
+        self.assertEqual(self.run_yq("[1]\n---\n[2]\n", ["-y", "."]), "- 1\n---\n- 2\n")
+        # The json module reads NaN and Infinity as numbers, but the YAML parser reads them as strings
+        self.assertEqual(
+            self.run_yq('{"a": NaN, "b": Infinity, "c": -Infinity}', ["-y", "."]),
+            "a: NaN\nb: Infinity\nc: -Infinity\n",
+        )
+        self.assertEqual(self.run_yq('{"a": NaN}', ["-y", ".a|type"]), "string\n...\n")
+        self.assertEqual(self.run_yq('"s"', ["-y", "--input-format", "json", "."]), "s\n...\n")
+        err = "yq: Error running jq: JSONDecodeError: Expecting value: line 1 column 1 (char 0)."
+        self.run_yq("a: 1", ["-y", "--input-format", "json", "."], expect_exit_codes={err})
+        # Documents must be separated by whitespace, or by YAML document markers
+        self.assertEqual(self.run_yq('{\n  "a": 1\n}\n{\n  "b": 2\n}\n', ["-y", "-c", "."]), "a: 1\n---\nb: 2\n")
+        self.assertEqual(self.run_yq('{"a": 1}\n---\n{b: 2}\n', ["-y", "-c", "."]), "a: 1\n---\nb: 2\n")
+        err = "yq: Error running jq: JSONDecodeError: Extra data: line 2 column 9 (char 17)."
+        self.run_yq('{"a": 1}\n{"b": 2}{"c": 3}', ["-y", "--input-format", "json", "."], expect_exit_codes={err})
+        err = "yq: Error running jq: JSONDecodeError: Expecting value: line 2 column 1 (char 9)."
+        self.run_yq('{"a": 1}\nb: 2\n', ["-y", "."], expect_exit_codes={err})
+        # Unpaired surrogates are left to the YAML parser, which rejects them
+        self.assertEqual(self.run_yq('["\\ud83d\\ude00"]', ["-y", "."]), "- \U0001f600\n")
+        err = "yq: Error running jq: ScannerError: while parsing a quoted scalar\n"
+        err += '  in "<file>", line 1, column 2\nfound invalid Unicode character escape code\n'
+        err += '  in "<file>", line 1, column 5.'
+        self.run_yq('["\\ud800"]', ["-y", "."], expect_exit_codes={err})
+
+    def test_json_document_reader(self):
+        from yq.json_input import JSONDocumentReader
+
+        # Each document is decoded as soon as the lines it is on have been read
+        lines = iter(["{\n", '  "a": [\n', "    1\n", "  ]\n", "}\n", "[2] 3\n"])
+        stream = io.StringIO()
+        stream.readline = lambda: next(lines, "")  # type: ignore
+        docs = iter(JSONDocumentReader(stream))
+        self.assertEqual(next(docs), {"a": [1]})
+        self.assertEqual(next(lines), "[2] 3\n")
+        self.assertEqual(list(docs), [])
+
+    def test_parallel_dump(self):
+        from unittest import mock
+
+        from yq import write_docs
+        from yq.dump_pool import dump_in_pool
+
+        doc = "items: [" + ", ".join("{{a: {0}, b: [x, 'y z'], c: {{d: {0}}}}}, {0}".format(i) for i in range(40))
+        doc += "]\n"
+        xml_err = "yq: Error converting JSON to XML: cannot represent non-object types at top level. "
+        xml_err += "Use --xml-root=name to envelope your output with a root element."
+        for args in (
+            ["-y", ".items[]"],
+            ["-y", "--explicit-start", "--explicit-end", ".items[]"],
+            ["-Y", ".items[]"],
+            ["-t", ".items[] | objects"],
+            ["-x", ".items[]"],
+        ):
+            with mock.patch("os.cpu_count", return_value=1):
+                expected = self.run_yq(doc, args, expect_exit_codes={os.EX_OK, xml_err})
+            with mock.patch("os.cpu_count", return_value=4), mock.patch("yq.min_pool_docs", 8), mock.patch(
+                "yq.dump_pool.docs_per_task", 3
+            ):
+                self.assertEqual(self.run_yq(doc, args, expect_exit_codes={os.EX_OK, xml_err}), expected)
+        # Worker processes are not forked from other threads, such as those of yq_multi
+        output = io.StringIO()
+        with mock.patch("os.cpu_count", return_value=4), mock.patch("yq.min_pool_docs", 8), mock.patch(
+            "yq.dump_in_pool", side_effect=AssertionError
+        ):
+            yq_multi(
+                input_streams=[io.StringIO(doc)],
+                outputs=[{"jq_args": [".items[]"], "output_stream": output, "output_format": "yaml"}],
+                exit_func=lambda code=None: None,
+            )
+        self.assertEqual(output.getvalue(), self.run_yq(doc, ["-y", ".items[]"]))
+        # Documents that may be spliced into their TOML source are dumped in this process
+        toml_doc, args = "a = 1  # a\n", ["-T", "range(20) as $i | .a = $i"]
+        expected = "".join("a = {}  # a\n".format(i) for i in range(20))
+        with mock.patch("os.cpu_count", return_value=4), mock.patch("yq.min_pool_docs", 8), mock.patch(
+            "yq.dump_in_pool", side_effect=AssertionError
+        ):
+            self.assertEqual(self.run_yq(toml_doc, args, input_format="toml"), expected)
+        # Documents are only read as chunks are submitted to a bounded window of worker tasks
+        docs_read = []
+
+        def read_docs():
+            for i in range(1000):
+                docs_read.append(i)
+                yield i
+
+        class FirstWriteRecorder(io.StringIO):
+            def write(self, data):
+                self.docs_read_before = getattr(self, "docs_read_before", len(docs_read))
+                return super().write(data)
+
+        output = FirstWriteRecorder()
+        with mock.patch("os.cpu_count", return_value=2), mock.patch("yq.dump_pool.docs_per_task", 3):
+            dump_in_pool(read_docs(), output, {"output_format": "yaml"})
+        expected = io.StringIO()
+        write_docs(iter(range(1000)), expected, output_format="yaml")
+        self.assertEqual(output.getvalue(), expected.getvalue())
+        self.assertLess(output.docs_read_before, 30)
+
+    def test_jq_workers(self):
+        from unittest import mock
+
+        doc = "".join("---\na: {0}\nb: [x, {0}]\n".format(i) for i in range(50))
+        for args in ["-y", ".b"], ["-Y", "."], ["-y", "--arg", "v", "w", ".c // $v"]:
+            expected = self.run_yq(doc, args)
+            for workers in "2", "60":
+                self.assertEqual(self.run_yq(doc, ["--jq-workers", workers] + args), expected)
+        self.assertEqual(self.run_yq(doc, ["--jq-workers", "3", "-c", ".b[1]"]), "".join(map("{}\n".format, range(50))))
+        self.assertEqual(self.run_yq(doc, ["--jq-workers", "3", "-j", ".b[0]"]), "x" * 50)
+        # The exit status is that of the last input, as with a single jq process
+        self.run_yq("--- x\n" + doc, ["--jq-workers", "3", ".a + 1"], expect_exit_codes={os.EX_OK})
+        self.run_yq(doc + "--- x\n", ["--jq-workers", "3", ".a + 1"], expect_exit_codes={5})
+
+        # Errors give the line of the input in the whole input, and are interleaved with the output in shard order
+        class StdoutWriter:
+            def write(self, data):
+                return sys.stdout.write(data)
+
+            def flush(self):
+                pass
+
+        with mock.patch("sys.stderr", StdoutWriter()):
+            output = self.run_yq('1\n--- "x"\n--- 2\n--- "y"\n', ["--jq-workers", "2", ". + 1"], expect_exit_codes={5})
+        lines = output.splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertTrue(lines[0].startswith("jq: error (at <stdin>:2): "), lines[0])
+        self.assertEqual(lines[1], "2")
+        self.assertTrue(lines[2].startswith("jq: error (at <stdin>:4): "), lines[2])
+        self.assertEqual(lines[3], "3")
+        err = "yq: --jq-workers cannot be used with "
+        reasons = [
+            "jq options that change how inputs are read (such as -s, -n or -f)",
+            "-e/--exit-status",
+            "filters that use input, inputs, input_line_number, $__loc__, halt or halt_error",
+        ]
+        for args, reason in zip([["-s", "."], ["-e", ".a"], ["[., input]"]], reasons):
+            self.run_yq(doc, ["--jq-workers", "2"] + args, expect_exit_codes={err + reason})
+        # Every jq process reads files given to --slurpfile and --rawfile, which a pipe only allows once
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path, fifo_path = os.path.join(tmp_dir, "v.json"), os.path.join(tmp_dir, "fifo")
+            with open(path, "w") as fh:
+                fh.write("[1]")
+            args = ["-y", "--slurpfile", "v", path, ".a + $v[0][0]"]
+            self.assertEqual(self.run_yq(doc, ["--jq-workers", "3"] + args), self.run_yq(doc, args))
+            os.mkfifo(fifo_path)
+            reason = "--slurpfile or --rawfile reading from a pipe or process substitution"
+            for args in ["--rawfile", "v", fifo_path, "."], [".", "--slurpfile", "v", fifo_path]:
+                self.run_yq(doc, ["--jq-workers", "2"] + args, expect_exit_codes={err + reason})
+
+    def test_passthrough(self):
+        import json
+        from unittest import mock
+
+        test_doc = os.path.join(os.path.dirname(__file__), "doc.yml")
+        self.assertEqual(self.run_yq("", ["--convert", "-y", test_doc]), self.run_yq("", ["-y", ".", test_doc]))
+        self.assertEqual(self.run_yq("a: [1, b]\n", ["--convert", "-c"]), '{"a":[1,"b"]}\n')
+        # The filter . is not taken for the current directory
+        self.assertEqual(self.run_yq("a: [1, b]\n", ["--convert", "-c", "."]), '{"a":[1,"b"]}\n')
+        self.assertEqual(self.run_yq("", ["--convert", "-y", ".", test_doc]), self.run_yq("", ["-y", ".", test_doc]))
+        self.assertEqual(self.run_yq('{"a": "\\u007f\\u0001é"}', ["."]), '{\n  "a": "\\u007f\\u0001é"\n}\n')
+        self.assertEqual(self.run_yq("1: 2001-02-03\nnull: [x]\n", ["-cM", "."]), '{"1":"2001-02-03","null":["x"]}\n')
+        self.assertEqual(self.run_yq("a: 1\n", ["-y", "--compact-output", "."]), "a: 1\n")
+        for doc, args, passthrough in [
+            ("a: 1\n", ["-y", "."], True),
+            ("a: 1\n", ["."], True),
+            ("a: 1\n--- 1.5\n", ["-y", "."], False),
+            ("a: 1\n--- {}\n".format(2**53 + 1), ["-y", "."], False),
+            ("a: 1\n", ["-y", ".a"], None),
+            ("a: 1\n", ["-y", "-S", "."], None),
+        ]:
+            with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                self.run_yq(doc, ["--profile"] + args)
+            report = json.loads(stderr.getvalue())
+            self.assertEqual(report.get("passthrough"), passthrough)
+            self.assertEqual("jq" in report["phases"] or "jq_wait" in report["phases"], passthrough is not True)
+
     def test_yq_err(self):
         err = (
             "yq: Error running jq: ScannerError: while scanning for the next token\nfound character '%' that "
@@ -188,17 +707,17 @@ class TestYq(unittest.TestCase):
             self.assertEqual(self.run_yq("", ["-y", ".a", self.fd_path(tf), self.fd_path(tf2)]), "b\n--- 1\n...\n")
 
     def test_datetimes(self):
-        self.assertEqual(self.run_yq("- 2016-12-20T22:07:36Z\n", ["."]), "")
+        self.assertEqual(self.run_yq("- 2016-12-20T22:07:36Z\n", ["."]), '[\n  "2016-12-20T22:07:36Z"\n]\n')
         self.assertEqual(self.run_yq("- 2016-12-20T22:07:36Z\n", ["-y", "."]), "- '2016-12-20T22:07:36Z'\n")
         self.assertEqual(
             self.run_yq("- 2016-12-20T22:07:36Z\n", ["-y", "--yml-out-ver=1.2", "."]), "- 2016-12-20T22:07:36Z\n"
         )
-        self.assertEqual(self.run_yq("2016-12-20", ["."]), "")
+        self.assertEqual(self.run_yq("2016-12-20", ["."]), '"2016-12-20"\n')
         self.assertEqual(self.run_yq("2016-12-20", ["-y", "."]), "'2016-12-20'\n")
         self.assertEqual(self.run_yq("2016-12-20", ["-y", "--yml-out-ver=1.2", "."]), "2016-12-20\n...\n")
 
     def test_unrecognized_tags(self):
-        self.assertEqual(self.run_yq("!!foo bar\n", ["."]), "")
+        self.assertEqual(self.run_yq("!!foo bar\n", ["."]), '"bar"\n')
         self.assertEqual(self.run_yq("!!foo bar\n", ["-y", "."]), "bar\n...\n")
         self.assertEqual(self.run_yq("x: !foo bar\n", ["-y", "."]), "x: bar\n")
         self.assertEqual(self.run_yq("x: !!foo bar\n", ["-y", "."]), "x: bar\n")
@@ -239,34 +758,49 @@ class TestYq(unittest.TestCase):
         self.assertIn(CommentPreservingLoader, get_loader(use_annotations=True).__mro__)
 
     def test_in_place_yaml(self):
+        from unittest import mock
+
         with tempfile.NamedTemporaryFile() as tf, tempfile.NamedTemporaryFile() as tf2:
             tf.write(b"- foo\n- bar\n")
-            tf.seek(0)
+            tf.flush()
             tf2.write(b"- foo\n- bar\n")
-            tf2.seek(0)
+            tf2.flush()
+            os.chmod(tf.name, 0o640)
             self.run_yq("", ["-i", "-y", ".[0]", tf.name, tf2.name])
-            self.assertEqual(tf.read(), b"foo\n...\n")
-            self.assertEqual(tf2.read(), b"foo\n...\n")
+            # The edited files are replaced, so they have to be reopened
+            for name in tf.name, tf2.name:
+                with open(name, "rb") as fh:
+                    self.assertEqual(fh.read(), b"foo\n...\n")
+            self.assertEqual(os.stat(tf.name).st_mode & 0o777, 0o640)
 
             # Files do not get overwritten on error
             self.run_yq("", ["-i", "-y", tf.name, tf2.name], expect_exit_codes=[3])
-            tf.seek(0)
-            tf2.seek(0)
-            self.assertEqual(tf.read(), b"foo\n...\n")
-            self.assertEqual(tf2.read(), b"foo\n...\n")
+            for name in tf.name, tf2.name:
+                with open(name, "rb") as fh:
+                    self.assertEqual(fh.read(), b"foo\n...\n")
+
+            # Unchanged files are not rewritten
+            os.utime(tf.name, ns=(0, 0))
+            with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                self.run_yq("", ["-i", "-y", ".", tf.name])
+            self.assertEqual(stderr.getvalue(), "yq: {}: unchanged\n".format(tf.name))
+            self.assertEqual(os.stat(tf.name).st_mtime_ns, 0)
+            self.assertEqual([entry for entry in os.listdir(os.path.dirname(tf.name)) if entry.endswith(".yq")], [])
 
     def test_in_place_toml(self):
         with tempfile.NamedTemporaryFile() as tf:
             tf.write(b'[GLOBAL]\nversion="1.0.0"\n')
             tf.seek(0)
             self.run_yq("", ["-i", "-t", '.GLOBAL.version="1.0.1"', tf.name], input_format="toml")
-            self.assertEqual(tf.read(), b'[GLOBAL]\nversion = "1.0.1"\n')
+            with open(tf.name, "rb") as fh:
+                self.assertEqual(fh.read(), b'[GLOBAL]\nversion = "1.0.1"\n')
 
         with tempfile.NamedTemporaryFile() as tf:
             tf.write(b'# top\nversion = "1.0.0" # keep\n')
             tf.seek(0)
             self.run_yq("", ["-i", "-T", '.version="1.0.1"', tf.name], input_format="toml")
-            self.assertEqual(tf.read(), b'# top\nversion = "1.0.1" # keep\n')
+            with open(tf.name, "rb") as fh:
+                self.assertEqual(fh.read(), b'# top\nversion = "1.0.1" # keep\n')
 
     def test_explicit_doc_markers(self):
         test_doc = os.path.join(os.path.dirname(__file__), "doc.yml")
@@ -275,9 +809,9 @@ class TestYq(unittest.TestCase):
         self.assertTrue(self.run_yq("", ["-y", "--explicit-end", ".", test_doc]).endswith("...\n"))
 
     def test_xq(self):
-        self.assertEqual(self.run_yq("<foo/>", ["."], input_format="xml"), "")
+        self.assertEqual(self.run_yq("<foo/>", ["."], input_format="xml"), '{\n  "foo": null\n}\n')
         self.assertEqual(self.run_yq("<foo/>", ["--xml-item-depth=2", "."], input_format="xml"), "")
-        self.assertEqual(self.run_yq("<foo/>", ["--xml-dtd", "."], input_format="xml"), "")
+        self.assertEqual(self.run_yq("<foo/>", ["--xml-dtd", "."], input_format="xml"), '{\n  "foo": null\n}\n')
         self.assertEqual(self.run_yq("<foo/>", ["-x", ".foo.x=1"], input_format="xml"), "<foo>\n  <x>1</x>\n</foo>\n")
         self.assertEqual(self.run_yq("<foo/>", ["-x", "."], input_format="xml"), "<foo></foo>\n")
         self.assertEqual(
@@ -285,7 +819,9 @@ class TestYq(unittest.TestCase):
         )
         self.assertTrue(self.run_yq("<foo/>", ["-x", "--xml-dtd", "."], input_format="xml").startswith("<?xml"))
         self.assertTrue(self.run_yq("<foo/>", ["-x", "--xml-root=R", "."], input_format="xml").startswith("<R>"))
-        self.assertEqual(self.run_yq("<foo/>", ["--xml-force-list=foo", "."], input_format="xml"), "")
+        self.assertEqual(
+            self.run_yq("<foo/>", ["-c", "--xml-force-list=foo", "."], input_format="xml"), '{"foo":[null]}\n'
+        )
 
         self.assertEqual(self.run_yq("<a><b/></a>", ["-y", "."], input_format="xml"), "a:\n  b: null\n")
         self.assertEqual(
@@ -337,9 +873,11 @@ class TestYq(unittest.TestCase):
             )
 
     def test_tomlq(self):
-        self.assertEqual(self.run_yq("[foo]\nbar = 1", ["."], input_format="toml"), "")
+        self.assertEqual(self.run_yq("[foo]\nbar = 1", ["-c", "."], input_format="toml"), '{"foo":{"bar":1}}\n')
         self.assertEqual(self.run_yq("[foo]\nbar = 1", ["-t", ".foo"], input_format="toml"), "bar = 1\n")
-        self.assertEqual(self.run_yq("[foo]\nbar = 2020-02-20", ["."], input_format="toml"), "")
+        self.assertEqual(
+            self.run_yq("[foo]\nbar = 2020-02-20", ["-c", "."], input_format="toml"), '{"foo":{"bar":"2020-02-20"}}\n'
+        )
 
     def test_tomlq_roundtrip(self):
         toml_doc = (
@@ -380,6 +918,70 @@ class TestYq(unittest.TestCase):
         )
         self.assertEqual(self.run_yq(toml_doc, ["-T", ".foo"], input_format="toml"), "bar = 2 # bar\nbaz = 'x'\n")
 
+    def test_tomlq_splice(self):
+        toml_doc = (
+            "[a.b]\n"
+            "x   =   1   # x\n"
+            "\n"
+            "[[pkg]]\n"
+            'name = "p"\n'
+            'version = "1.0"  # pinned\n'
+            "\n"
+            "[[pkg]]\n"
+            'name = "q"\n'
+            "version = '2.0'\n"
+            "\n"
+            "[a.c]\n"
+            "y = [1,\n"
+            "  2]\n"
+        )
+        self.assertEqual(self.run_yq(toml_doc, ["-T", "."], input_format="toml"), toml_doc)
+        self.assertEqual(
+            self.run_yq(toml_doc, ["-T", '.pkg[1].version = "2.1" | .a.b.x = 2'], input_format="toml"),
+            toml_doc.replace("version = '2.0'", "version = '2.1'").replace("x   =   1", "x   =   2"),
+        )
+        self.assertEqual(
+            self.run_yq(toml_doc, ["-T", ".a.c.y[1] = 3"], input_format="toml"),
+            toml_doc.replace("  2]", "  3]"),
+        )
+        # Documents whose keys change are rebuilt, which moves out-of-order tables
+        self.assertEqual(
+            self.run_yq(toml_doc, ["-T", ".a.b.z = 1"], input_format="toml"),
+            "[a.b]\n"
+            "x   =   1   # x\n"
+            "z = 1\n"
+            "\n"
+            "[a.c]\n"
+            "y = [1,\n"
+            "  2]\n"
+            "[[pkg]]\n"
+            'name = "p"\n'
+            'version = "1.0"  # pinned\n'
+            "\n"
+            "[[pkg]]\n"
+            'name = "q"\n'
+            "version = '2.0'\n"
+            "\n",
+        )
+
+    def test_tomlq_splice_without_spans(self):
+        from unittest import mock
+
+        from tomlkit.parser import Parser
+
+        from yq.toml_support import SpanParser
+
+        # Documents are rebuilt if the internals of tomlkit's parser that SpanParser relies on change
+        toml_doc = "a = 1  # a\n\n[t]\nb = 'x'\n"
+        for patch in (
+            mock.patch.object(SpanParser, "_parse_value", Parser._parse_value),
+            mock.patch.object(SpanParser, "_parse_value", side_effect=AttributeError),
+        ):
+            with patch:
+                self.assertEqual(
+                    self.run_yq(toml_doc, ["-T", '.t.b = "y"'], input_format="toml"), "a = 1  # a\n\n[t]\nb = 'y'\n"
+                )
+
     def test_abbrev_opt_collisions(self):
         with tempfile.TemporaryFile() as tf, tempfile.TemporaryFile() as tf2:
             self.assertEqual(
@@ -389,13 +991,22 @@ class TestYq(unittest.TestCase):
 
     def test_entity_expansion_defense(self):
         self.run_yq(bomb_yaml, ["."], expect_exit_codes=["yq: Error: detected unsafe YAML entity expansion"])
+        self.run_yq(bomb_yaml, ["-Y", "."], expect_exit_codes=["yq: Error: detected unsafe YAML entity expansion"])
+        doc = "a: &a {b: [1, {c: 2.5}], d: null}\ne: &e [*a, *a, x]\nf: [*e, *e, *a, {g: *a}]\n"
+        a = {"b": [1, {"c": 2.5}], "d": None}
+        expected = {"a": a, "e": [a, a, "x"], "f": [[a, a, "x"], [a, a, "x"], a, {"g": a}]}
+        for args in ["-y", "."], ["-Y", "."]:
+            self.assertEqual(yaml.safe_load(self.run_yq(doc, args)), expected)
 
     def test_yaml_type_tags(self):
         bin_yaml = "example: !!binary Zm9vYmFyCg=="
-        self.assertEqual(self.run_yq(bin_yaml, ["."]), "")
+        self.assertEqual(self.run_yq(bin_yaml, ["."]), '{\n  "example": "Zm9vYmFyCg=="\n}\n')
         self.assertEqual(self.run_yq(bin_yaml, ["-y", "."]), "example: Zm9vYmFyCg==\n")
         set_yaml = "example: !!set { Boston Red Sox, Detroit Tigers, New York Yankees }"
-        self.assertEqual(self.run_yq(set_yaml, ["."]), "")
+        self.assertEqual(
+            self.run_yq(set_yaml, ["-c", "."]),
+            '{"example":{"Boston Red Sox":null,"Detroit Tigers":null,"New York Yankees":null}}\n',
+        )
         self.assertEqual(
             self.run_yq(set_yaml, ["-y", "."]),
             "example:\n  Boston Red Sox: null\n  Detroit Tigers: null\n  New York Yankees: null\n",
@@ -405,12 +1016,17 @@ class TestYq(unittest.TestCase):
         self.assertEqual(
             self.run_yq("a: &b\n  c: d\ne:\n  <<: *b\n  g: h", ["-y", "."]), "a:\n  c: d\ne:\n  c: d\n  g: h\n"
         )
+        doc = "a: &a {x: 1, y: 2}\nb: &b {y: 3, z: 4}\nc:\n  <<: [*a, *b]\n  z: 5\nd: {<<: *a, x: 6}\n"
+        for args in ["-y", "[.c, .d]"], ["-Y", "[.c, .d]"]:
+            self.assertEqual(self.run_yq(doc, args), "- y: 2\n  z: 5\n  x: 1\n- x: 6\n  y: 2\n")
+        doc = "a: &a\n  # x\n  x: 1\n  y: 'q' # y\nb:\n  <<: *a\n  z: 2\n"
+        self.assertEqual(self.run_yq(doc, ["-Y", ".b"]), "x: 1\ny: 'q'\nz: 2\n")
 
     def test_yaml_floats(self):
         self.assertEqual(self.run_yq("test: 0.0004", ["-y", "."]), "test: 0.0004\n")
 
     def test_yaml_1_2(self):
-        self.assertEqual(self.run_yq("11:12:13", ["."]), "")
+        self.assertEqual(self.run_yq("11:12:13", ["."]), '"11:12:13"\n')
         self.assertEqual(self.run_yq("11:12:13", ["-y", "."]), "'11:12:13'\n")
 
         self.assertEqual(self.run_yq("on: 12:34:56", ["-y", "."]), "'on': '12:34:56'\n")
@@ -473,6 +1089,142 @@ class TestYq(unittest.TestCase):
         self.assertEqual(self.run_yq("octal: 0o10", ["-y", "--yml-out-ver=1.2", "."]), "octal: 8\n")
         self.assertEqual(self.run_yq("'08'", ["-y", "--yml-out-ver=1.2", "."]), "'08'\n")
 
+    def test_scalar_classifier(self):
+        from yq.loader import core_resolvers, get_scalar_classifier, set_yaml_grammar
+
+        values = ["", "~", "null", "nul", "yes", "On", "true", "tRue", "0", "-012", "0o17", "0x1F", "0b101", "1_000"]
+        values += ["1:30", "1:30.5", "1.5", "-.inf", ".NaN", "1e5", "2001-12-14", "2001-12-14 21:59:43.10", "=", "<<"]
+        values += ["<", "abc", "1.", "1\n", "-", "1.2.3", "x" * 200]
+        for grammar_version in core_resolvers:
+            for expand_merge_keys in True, False:
+
+                class Resolver(yaml.resolver.BaseResolver):
+                    pass
+
+                set_yaml_grammar(Resolver, grammar_version=grammar_version, expand_merge_keys=expand_merge_keys)
+                classifier = get_scalar_classifier(grammar_version, expand_merge_keys)
+                resolver, scalar = Resolver(), yaml.nodes.ScalarNode
+                for value in values:
+                    expected = yaml.resolver.BaseResolver.resolve(resolver, scalar, value, (True, False))
+                    self.assertEqual(resolver.resolve(scalar, value, (True, False)), expected)
+                    self.assertEqual(classifier.classify_cached(value) or Resolver.DEFAULT_SCALAR_TAG, expected)
+
+    def test_scalar_analysis(self):
+        from yq.dumper import analyze_scalar
+
+        emitter = yaml.emitter.Emitter(io.StringIO())
+        values = ["", " ", "a ", "-", "- a", "-a", ":", ": a", "a:b", "a: b", "a:", "?", "? a", "a?", "a #b", "#"]
+        values += ["---", "...a", "a\n", "\na", "a \nb", "a\n b", "a\x85b", "\x00", "\ufeff", "\U0001f600", "\ud800"]
+        values += ["'a'", '"', "[a]", "a{b}", "é", "a\tb", "x" * 200 + "\n" + "y: z " * 40]
+        for allow_unicode in True, False:
+            emitter.allow_unicode = allow_unicode
+            for value in values:
+                expected = yaml.emitter.Emitter.analyze_scalar(emitter, value)
+                self.assertEqual(vars(analyze_scalar(value, allow_unicode)), vars(expected), repr(value))
+
+    def test_event_dumper(self):
+        from yq.dumper import dump_all, get_dumper
+        from yq.loader import get_loader
+
+        doc = "# c\na: !foo 'x'  # i\nb: |\n  l\nc: [1, {d: \"q\"}]\nf:\n  # b\n  - !bar [1.5, yes, null, '']\ng: {}\n"
+        annotated_docs = list(yaml.load_all(doc, Loader=get_loader(use_annotations=True)))
+        docs = [{"a": [1, {"b": None, "": "multi\nline"}], "1": [True, 1e20, "null", " x", "---"]}, [], "yes"]
+        for use_annotations, test_docs in (True, annotated_docs), (False, annotated_docs), (False, docs):
+            for indentless in True, False:
+                for explicit in True, False:
+                    dumper = get_dumper(use_annotations=use_annotations, indentless=indentless)
+                    kwargs = dict(default_flow_style=False, explicit_start=explicit, explicit_end=explicit)
+                    expected, actual = io.StringIO(), io.StringIO()
+                    yaml.dump_all(test_docs, expected, Dumper=dumper, **kwargs)
+                    dump_all(test_docs, actual, Dumper=dumper, use_annotations=use_annotations, **kwargs)
+                    self.assertEqual(actual.getvalue(), expected.getvalue())
+
+    def test_event_constructor(self):
+        from yq.constructor import EventConstructor
+        from yq.loader import get_loader
+
+        docs = [
+            "a: &a {x: 1, y: [2.5, yes, null, 2020-01-01, 0x1f]}\nb: &b {y: 3, z: 4}\nc: {<<: [*a, *b], y: 5}\nd: *a\n",
+            "- &s foo\n- !!omap [a: 1, b: *s]\n- !custom {<<: {p: 1}, q: 2}\n- !!set {a, b}\n--- 1\n---\n",
+            "o: &o !!omap [x: 1, y: 2]\np: &p !!pairs [x: 1, x: 2]\nm: {<<: *o, z: 3}\nn: {<<: *p}\n",
+        ]
+        for kwargs in {}, dict(expand_aliases=False), dict(expand_merge_keys=False):
+            loader_class = get_loader(**kwargs)
+            for doc in docs:
+                expected = list(yaml.load_all(doc, Loader=loader_class))
+                constructor = EventConstructor(loader_class(doc))
+                actual = []
+                while constructor.check_document():
+                    actual.append(constructor.get_document()[0])
+                self.assertEqual(actual, expected)
+        for doc, err in ("a: &x [1, *x]", "recursive node"), ("a: {<<: 1}", "expected a mapping"), ("a: *x", "alias"):
+            with self.assertRaisesRegex(yaml.YAMLError, err):
+                constructor = EventConstructor(get_loader()(doc))
+                constructor.check_document()
+                constructor.get_document()
+
+    def test_xml_writer(self):
+        import xmltodict
+
+        from yq.xml_writer import XMLWriter
+
+        docs = [
+            {"a": {"@x": 1, "@y": None, "b": ["t", None, {"#text": "u&v", "@z": "'\"<"}], "c": [], "d": {"e": True}}},
+            {"#comment": ["c1", None], "r": {"@xmlns": {"": "urn:a", "p": "urn:p"}, "#comment": "c2", "s": 1.5}},
+            {"r": [1, 2]},
+        ]
+        for doc in docs:
+            for full_document in False, True:
+                for short_empty_elements in False, True:
+                    kwargs = dict(full_document=full_document, short_empty_elements=short_empty_elements)
+                    expected, actual = io.StringIO(), io.StringIO()
+                    try:
+                        xmltodict.unparse(doc, output=expected, pretty=True, indent="  ", **kwargs)
+                    except ValueError as e:
+                        with self.assertRaisesRegex(ValueError, str(e)):
+                            XMLWriter(actual, short_empty_elements).write(doc, full_document)
+                        continue
+                    XMLWriter(actual, short_empty_elements).write(doc, full_document)
+                    self.assertEqual(actual.getvalue(), expected.getvalue())
+        deep = {"e": None}
+        for i in range(sys.getrecursionlimit()):
+            deep = {"e": deep}
+        output = io.StringIO()
+        XMLWriter(output, short_empty_elements=True).write(deep)
+        self.assertEqual(output.getvalue().count("<e>"), sys.getrecursionlimit())
+
+    def test_deep_nesting(self):
+        import tomlkit
+
+        from yq.dumper import dump_all, get_dumper
+        from yq.loader import get_loader
+        from yq.toml_support import tomlkit_from_json, tomlkit_to_json
+
+        depth = sys.getrecursionlimit() * 2
+        text = "- " * depth + "x\n"
+        for use_annotations in False, True:
+            doc = yaml.load(text, Loader=get_loader(use_annotations=use_annotations))
+            output = io.StringIO()
+            dump_all([doc], output, Dumper=get_dumper(use_annotations=use_annotations), use_annotations=use_annotations)
+            self.assertEqual(output.getvalue(), text)
+            with self.assertRaisesRegex(yaml.YAMLError, "recursive node"):
+                yaml.load("a: &x [[1, *x]]", Loader=get_loader(use_annotations=use_annotations))
+        self.assertEqual(self.run_yq("[" * depth + "]" * depth, ["-y", "."]), "- " * (depth - 1) + "[]\n")
+
+        toml_doc = table = tomlkit.document()
+        for i in range(depth):
+            table.append("t", tomlkit.table())
+            table = table["t"]
+        table.append("x", 1)
+        value = tomlkit_to_json(toml_doc)
+        for i in range(depth):
+            value = value["t"]
+        self.assertEqual(value, {"x": 1})
+        edited = tomlkit_from_json(
+            {"a": [[[{"__tomlq_meta__": {}, "b": [1]}]]], "__tomlq_meta__": {"source": "a = [[[{b = [0]}]]]\n"}}
+        )
+        self.assertEqual(tomlkit.dumps(edited), "a = [[[{b = [1]}]]]\n")
+
 
 if __name__ == "__main__":
     unittest.main()
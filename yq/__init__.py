@@ -9,19 +9,38 @@ See https://github.com/kislyuk/yq for more information.
 
 import argparse
 import io
+import itertools
 import json
 import os
+import shutil
 import subprocess
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, time
+from typing import Union
 
 import argcomplete
 import yaml
 
-from .dumper import get_dumper
+from .alias_encoder import AliasEncoder, ExpansionLimitError
+from .cache import DocumentCache, ResultCache, TeeWriter, buffer_input, get_jq_defs_digest, get_jq_version, is_cacheable
+from .constructor import EventConstructor
+from .convert import DocumentSink, add_document, passthrough_options, write_json
+from .dump_pool import dump_in_pool, min_pool_docs
+from .dumper import dump_all, get_dumper
+from .in_place import InPlaceWriter
+from .inputs import FilenameTagger, InputDirectory, InputFileError, encode_directory
+from .jq_workers import ShardedJQ, color_jq_args, sharding_error
+from .json_input import JSONDocumentReader, read_json_input
+from .limits import MemoryLimit
 from .loader import get_loader
-from .parser import get_parser, jq_arg_spec
-from .toml_support import tomlkit_from_json, tomlkit_to_json
+from .parser import get_parser, input_file_or_directory, jq_arg_spec
+from .profile import Profiler, encoded_size, null_profiler
+from .prune import construct_pruned_document, prune_document, prune_jq_args
+from .stream import EventStreamer, ItemComposer, YAMLStreamError
+from .toml_support import TomlSource, splice_toml, tomlkit_from_json, tomlkit_to_json
+from .xml_writer import XMLWriter
 
 try:
     from .version import version as __version__
@@ -37,9 +56,10 @@ class JSONDateTimeEncoder(json.JSONEncoder):
 
 
 def decode_docs(jq_output, json_decoder):
-    while jq_output:
-        doc, pos = json_decoder.raw_decode(jq_output)
-        jq_output = jq_output[pos + 1 :]
+    pos = 0
+    while pos < len(jq_output):
+        doc, pos = json_decoder.raw_decode(jq_output, pos)
+        pos += 1
         yield doc
 
 
@@ -62,6 +82,18 @@ def tq_cli():
     cli(input_format="toml", program_name="tomlq")
 
 
+def expand_directories(input_streams, input_format, include, exclude):
+    # Files found in directories are yielded as paths, to be opened one at a time. JSON files are skipped, since they
+    # would be rewritten in the output format under their .json name.
+    for input_stream in input_streams:
+        if isinstance(input_stream, InputDirectory):
+            for path, file_format in input_stream.files(input_format, include, exclude):
+                if file_format == input_format and not path.lower().endswith(".json"):
+                    yield path
+        else:
+            yield input_stream
+
+
 def cli(args=None, input_format="yaml", program_name="yq"):
     parser = get_parser(program_name, __doc__)
     argcomplete.autocomplete(parser)
@@ -108,6 +140,17 @@ def cli(args=None, input_format="yaml", program_name="yq"):
             for value_group in values:
                 jq_args.append(arg)
                 jq_args.extend(value_group)
+    if args.convert:
+        # There is no filter argument, so the first positional argument is an input file, unless it is the filter that
+        # --convert stands for (rather than the current directory)
+        if args.jq_filter is not None and args.jq_filter != ".":
+            try:
+                args.input_streams.insert(0, input_file_or_directory(args.jq_filter))
+            except argparse.ArgumentTypeError as e:
+                parser.error(str(e))
+        args.jq_filter = "."
+    delattr(args, "convert")
+    jq_filter_arg_loc = None
     if args.jq_filter is not None:
         if "--from-file" in jq_args or "-f" in jq_args:
             args.input_streams.insert(0, argparse.FileType()(args.jq_filter))
@@ -130,14 +173,38 @@ def cli(args=None, input_format="yaml", program_name="yq"):
     elif not args.input_streams:
         args.input_streams = [sys.stdin]
 
+    filter_to = args.filter_to
+    delattr(args, "filter_to")
     yq_args = dict(input_format=input_format, program_name=program_name, jq_args=jq_args, **vars(args))
-    if in_place:
+    if filter_to:
+        if in_place or jq_filter_arg_loc is None:
+            msg = "{}: --filter-to requires a filter argument and cannot be used with -i/--in-place"
+            sys.exit(msg.format(program_name))
+        if args.profile or args.max_memory or args.jq_workers > 1:
+            msg = "{}: --filter-to cannot be used with --profile, --max-memory or --jq-workers"
+            sys.exit(msg.format(program_name))
+        for arg in "jq_args", "profile", "max_memory", "cache_dir", "cache_size", "jq_workers":
+            yq_args.pop(arg)
+        outputs = [dict(jq_args=jq_args, output_stream=sys.stdout)]
+        output_files = []
+        try:
+            for jq_filter, output_path in filter_to:
+                extra_jq_args = list(jq_args)
+                extra_jq_args[jq_filter_arg_loc] = jq_filter
+                output_files.append(open(output_path, "w"))
+                outputs.append(dict(jq_args=extra_jq_args, output_stream=output_files[-1]))
+            yq_multi(outputs=outputs, **yq_args)
+        finally:
+            for output_file in output_files:
+                output_file.close()
+    elif in_place:
         if args.output_format not in {"yaml", "annotated_yaml", "toml", "annotated_toml", "xml"}:
             sys.exit("{}: -i/--in-place can only be used with -y/-Y/-t/-T/-x".format(program_name))
         input_streams = yq_args.pop("input_streams")
         if len(input_streams) == 1 and input_streams[0].name == "<stdin>":
             msg = "{}: -i/--in-place can only be used with filename arguments, not on standard input"
             sys.exit(msg.format(program_name))
+        input_streams = list(expand_directories(input_streams, input_format, args.include, args.exclude))
         for i, input_stream in enumerate(input_streams):
 
             def exit_handler(arg=None):
@@ -147,38 +214,466 @@ def cli(args=None, input_format="yaml", program_name="yq"):
             if i < len(input_streams):
                 yq_args["exit_func"] = exit_handler
 
-            with io.StringIO() as out_fh:
-                yq(input_streams=[input_stream], output_stream=out_fh, **yq_args)
-                with open(input_stream.name, "w") as fh:
-                    fh.write(out_fh.getvalue())
+            if isinstance(input_stream, str):
+                input_stream = open(input_stream)
+            writer = InPlaceWriter(input_stream.name)
+            try:
+                yq(input_streams=[input_stream], output_stream=writer.temp_file, **yq_args)
+                if not writer.commit():
+                    print("{}: {}: unchanged".format(program_name, input_stream.name), file=sys.stderr)
+            finally:
+                writer.discard()
     else:
         yq(**yq_args)
 
 
-def load_yaml_docs(in_stream, out_stream, jq, loader_class, max_expansion_factor, exit_func, prog):
+def load_yaml_docs(
+    in_stream,
+    out_stream,
+    jq,
+    loader_class,
+    max_expansion_factor,
+    exit_func,
+    prog,
+    profiler=null_profiler,
+    prune_path=None,
+    yaml_input_format="auto",
+    construct_from_events=False,
+):
+    in_stream = profiler.reader(in_stream, "input_bytes")
+    if yaml_input_format != "yaml":
+        in_stream, json_prefix = read_json_input(in_stream, sniff=yaml_input_format == "auto")
+        if json_prefix is not None:
+            reader = JSONDocumentReader(in_stream, json_prefix)
+            try:
+                for doc in profiler.iterate("json_parse", reader):
+                    profiler.note("json_input", True)
+                    if prune_path is not None:
+                        doc = prune_document(doc, prune_path)
+                    with profiler.phase("json_encode"):
+                        if not add_document(out_stream, doc):
+                            json.dump(doc, out_stream, cls=JSONDateTimeEncoder)
+                            out_stream.write("\n")
+                    profiler.count("input_documents")
+            except (ValueError, RecursionError):
+                if yaml_input_format == "json" or not reader.continues_as_yaml():
+                    raise
+                # Not JSON after all, for example a YAML flow mapping, or nested too deeply for the json module. The
+                # input is parsed as YAML from the end of the last document that was decoded.
+                in_stream = reader.rest()
+            else:
+                return
+
     loader = loader_class(in_stream)
+    # Annotations and pruning need the composed nodes; otherwise documents are constructed directly from events
+    constructor = EventConstructor(loader) if construct_from_events and prune_path is None else None
+    encoder = AliasEncoder(JSONDateTimeEncoder())
 
     last_loader_pos = 0
     try:
-        while loader.check_node():
-            node = loader.get_node()
-            doc = loader.construct_document(node)
-            loader_pos = node.end_mark.index
+        while True:
+            if constructor:
+                with profiler.phase("yaml_construct"):
+                    if not constructor.check_document():
+                        break
+                    doc, end_mark = constructor.get_document()
+            else:
+                with profiler.phase("yaml_compose"):
+                    if not loader.check_node():
+                        break
+                    node = loader.get_node()
+                with profiler.phase("yaml_construct"):
+                    loader.has_aliases = False
+                    if prune_path is None:
+                        doc = loader.construct_document(node)
+                    else:
+                        doc = construct_pruned_document(loader, node, prune_path)
+                end_mark = node.end_mark
+            loader_pos = end_mark.index
             doc_len = loader_pos - last_loader_pos
             doc_bytes_written = 0
-            for chunk in JSONDateTimeEncoder().iterencode(doc):
-                doc_bytes_written += len(chunk)
-                if doc_bytes_written > doc_len * max_expansion_factor:
-                    if jq:
-                        jq.kill()
-                    exit_func("{}: Error: detected unsafe YAML entity expansion".format(prog))
-                out_stream.write(chunk)
-            out_stream.write("\n")
+            with profiler.phase("json_encode"):
+                has_aliases = (constructor or loader).has_aliases
+                # Documents with shared subtrees are encoded, which checks their expanded size
+                if has_aliases or not add_document(out_stream, doc):
+                    try:
+                        for chunk in encoder.iterencode(doc, doc_len * max_expansion_factor, has_aliases):
+                            doc_bytes_written += len(chunk)
+                            if doc_bytes_written > doc_len * max_expansion_factor:
+                                raise ExpansionLimitError()
+                            out_stream.write(chunk)
+                    except ExpansionLimitError:
+                        if jq:
+                            jq.kill()
+                        exit_func("{}: Error: detected unsafe YAML entity expansion".format(prog))
+                    out_stream.write("\n")
+            profiler.count("input_documents")
             last_loader_pos = loader_pos
     finally:
         loader.dispose()
 
 
+def load_yaml_events(
+    in_stream,
+    out_stream,
+    jq,
+    loader_class,
+    max_expansion_factor,
+    exit_func,
+    prog,
+    profiler=null_profiler,
+    item_depth=0,
+):
+    """
+    Sends jq the output of an EventStreamer, or of an ItemComposer if item_depth is set, as the parser produces events.
+    """
+    loader = loader_class(profiler.reader(in_stream, "input_bytes"))
+    encoder = JSONDateTimeEncoder(separators=(",", ":")) if not item_depth else JSONDateTimeEncoder()
+    counter = "input_documents" if item_depth else "stream_events"
+    chars_written, loader_pos = 0, 0
+
+    def emit(value):
+        nonlocal chars_written
+        for chunk in encoder.iterencode(value):
+            chars_written += len(chunk)
+            if chars_written > (loader_pos + 1) * max_expansion_factor:
+                if jq:
+                    jq.kill()
+                exit_func("{}: Error: detected unsafe YAML entity expansion".format(prog))
+            out_stream.write(chunk)
+        out_stream.write("\n")
+        profiler.count(counter)
+
+    streamer = ItemComposer(loader, item_depth, emit) if item_depth else EventStreamer(loader, emit)
+    try:
+        with profiler.phase("yaml_stream"):
+            while loader.check_event():
+                event = loader.get_event()
+                loader_pos = event.end_mark.index
+                streamer.feed(event)
+    except YAMLStreamError as e:
+        if jq:
+            jq.kill()
+        exit_func("{}: Error streaming YAML: {}".format(prog, e))
+    finally:
+        loader.dispose()
+
+
+def encode_docs(
+    input_streams,
+    out_stream,
+    jq=None,
+    input_format="yaml",
+    output_format="json",
+    program_name="yq",
+    xml_item_depth=0,
+    xml_force_list=frozenset(),
+    expand_merge_keys=True,
+    expand_aliases=True,
+    max_expansion_factor=1024,
+    exit_func=None,
+    profiler=null_profiler,
+    document_cache=None,
+    prune_path=None,
+    yaml_stream=False,
+    yaml_item_depth=0,
+    yaml_input_format="auto",
+    toml_sources=None,
+):
+    converting_output = True if output_format != "json" else False
+    use_annotations = True if output_format == "annotated_yaml" else False
+    use_toml_annotations = True if output_format == "annotated_toml" else False
+    if input_format == "yaml":
+        if (yaml_stream or yaml_item_depth) and use_annotations:
+            raise Exception("yaml_stream and yaml_item_depth are not supported with yq -Y")
+        if yaml_stream and yaml_item_depth:
+            raise Exception("yaml_stream and yaml_item_depth cannot be used together")
+        loader_class = get_loader(
+            use_annotations=use_annotations, expand_aliases=expand_aliases, expand_merge_keys=expand_merge_keys
+        )
+        profiler.note("loader_class", loader_class.__name__)
+        for input_stream in input_streams:
+            if yaml_stream or yaml_item_depth:
+                load_yaml_events(
+                    in_stream=input_stream,
+                    out_stream=out_stream,
+                    jq=jq,
+                    loader_class=loader_class,
+                    max_expansion_factor=max_expansion_factor,
+                    exit_func=exit_func,
+                    prog=program_name,
+                    profiler=profiler,
+                    item_depth=yaml_item_depth,
+                )
+                continue
+            cache_key, cache_writer = None, None
+            if document_cache:
+                cache_key = document_cache.key(
+                    input_stream,
+                    yq_version=__version__,
+                    loader_class=loader_class.__name__,
+                    use_annotations=use_annotations,
+                    expand_aliases=expand_aliases,
+                    expand_merge_keys=expand_merge_keys,
+                    max_expansion_factor=max_expansion_factor,
+                )
+            if cache_key:
+                cached_docs = document_cache.get(cache_key)
+                if cached_docs:
+                    with cached_docs, profiler.phase("document_cache_read"):
+                        shutil.copyfileobj(cached_docs, out_stream)
+                    profiler.count("document_cache_hits")
+                    continue
+                cache_writer = document_cache.writer(cache_key)
+            try:
+                load_yaml_docs(
+                    in_stream=input_stream,
+                    out_stream=TeeWriter(out_stream, cache_writer) if cache_writer else out_stream,
+                    jq=jq,
+                    loader_class=loader_class,
+                    max_expansion_factor=max_expansion_factor,
+                    exit_func=exit_func,
+                    prog=program_name,
+                    profiler=profiler,
+                    prune_path=prune_path,
+                    # -Y keeps the quoting style of strings, which only the YAML loader reports
+                    yaml_input_format="yaml" if use_annotations else yaml_input_format,
+                    construct_from_events=not use_annotations,
+                )
+                if cache_writer:
+                    cache_writer.commit()
+            finally:
+                if cache_writer:
+                    cache_writer.discard()
+    elif input_format == "xml":
+        import xmltodict
+
+        if converting_output and xml_item_depth != 0:
+            raise Exception("xml_item_depth is not supported with xq -x")
+
+        def emit_entry(path, entry):
+            with profiler.phase("json_encode"):
+                if not add_document(out_stream, entry):
+                    json.dump(entry, out_stream, cls=JSONDateTimeEncoder)
+                    out_stream.write("\n")
+            profiler.count("input_documents")
+            return True
+
+        for input_stream in input_streams:
+            with profiler.phase("xml_parse"):
+                xml_doc = xmltodict.parse(
+                    input_stream.buffer if isinstance(input_stream, io.TextIOWrapper) else input_stream.read(),
+                    disable_entities=True,
+                    force_list=xml_force_list,
+                    item_depth=xml_item_depth,
+                    item_callback=emit_entry,
+                )
+            if xml_doc:
+                emit_entry(None, xml_doc)
+    elif input_format == "toml":
+        if converting_output:
+            import tomlkit
+
+            for input_stream in input_streams:
+                with profiler.phase("toml_parse"):
+                    if use_toml_annotations:
+                        # The source is kept so that the values jq changes can be spliced into its text
+                        source = TomlSource(input_stream.read())
+                        if toml_sources is not None:
+                            toml_sources[source.key] = source
+                        toml_doc = source.data
+                    else:
+                        toml_doc = tomlkit_to_json(tomlkit.load(input_stream), use_annotations=False)
+                with profiler.phase("json_encode"):
+                    if not add_document(out_stream, toml_doc):
+                        json.dump(toml_doc, out_stream, cls=JSONDateTimeEncoder)
+                        out_stream.write("\n")
+                profiler.count("input_documents")
+        else:
+            toml_loader = get_toml_loader()
+            for input_stream in input_streams:
+                with profiler.phase("toml_parse"):
+                    toml_doc = toml_loader(input_stream.read())
+                with profiler.phase("json_encode"):
+                    if not add_document(out_stream, toml_doc):
+                        json.dump(toml_doc, out_stream, cls=JSONDateTimeEncoder)
+                        out_stream.write("\n")
+                profiler.count("input_documents")
+    else:
+        raise Exception("Unknown input format")
+
+
+def encode_inputs(input_streams, out_stream, include=(), exclude=(), with_filename=False, **encode_args):
+    """
+    Like encode_docs, but input_streams can also contain directories (see yq.inputs), and each document can be sent
+    to jq tagged with the name of its input file.
+    """
+    if not with_filename and not any(isinstance(input_stream, InputDirectory) for input_stream in input_streams):
+        return encode_docs(input_streams, out_stream, **encode_args)
+    jq, exit_func = encode_args.get("jq"), encode_args.get("exit_func") or sys.exit
+    worker_args = {
+        arg: value
+        for arg, value in encode_args.items()
+        if arg not in {"input_format", "jq", "exit_func", "profiler", "document_cache", "toml_sources"}
+    }
+    try:
+        for input_stream in input_streams:
+            if isinstance(input_stream, InputDirectory):
+                input_format = encode_args.get("input_format", "yaml")
+                for path, docs in encode_directory(input_stream, input_format, include, exclude, worker_args):
+                    (FilenameTagger(out_stream, path) if with_filename else out_stream).write(docs)
+            elif with_filename:
+                # Like jq's input_filename, the name of standard input is null
+                name = getattr(input_stream, "name", None)
+                tagger = FilenameTagger(out_stream, None if name == "<stdin>" else name)
+                encode_docs([input_stream], tagger, **encode_args)
+            else:
+                encode_docs([input_stream], out_stream, **encode_args)
+    except InputFileError as e:
+        if jq:
+            jq.kill()
+        exit_func(str(e))
+
+
+class ConversionError(Exception):
+    pass
+
+
+def write_docs(
+    docs,
+    output_stream,
+    output_format="yaml",
+    program_name="yq",
+    width=None,
+    indentless_lists=False,
+    xml_root=None,
+    xml_dtd=False,
+    xml_short_empty_elements=False,
+    explicit_start=False,
+    explicit_end=False,
+    yaml_output_grammar_version="1.1",
+    first_document=True,
+    end_stream=True,
+    toml_sources=None,
+):
+    """
+    Writes docs to output_stream in output_format. Raises ConversionError for documents that cannot be represented in
+    output_format. first_document and end_stream allow the YAML stream to be written in parts (see dump_all).
+    toml_sources maps the keys of the TOML inputs to their TomlSource, so that annotated TOML documents can be written
+    by editing their source text (see splice_toml).
+    """
+    if output_format == "yaml" or output_format == "annotated_yaml":
+        use_annotations = True if output_format == "annotated_yaml" else False
+        dumper_class = get_dumper(
+            use_annotations=use_annotations,
+            indentless=indentless_lists,
+            grammar_version=yaml_output_grammar_version,
+        )
+        dump_all(
+            docs,
+            stream=output_stream,
+            Dumper=dumper_class,
+            use_annotations=use_annotations,
+            first_document=first_document,
+            end_stream=end_stream,
+            width=sys.maxsize if width == 0 else width,
+            allow_unicode=True,
+            default_flow_style=False,
+            explicit_start=explicit_start,
+            explicit_end=explicit_end,
+        )
+    elif output_format == "xml":
+        xml_writer = XMLWriter(output_stream, short_empty_elements=xml_short_empty_elements)
+        for doc in docs:
+            if xml_root:
+                doc = {xml_root: doc}
+            elif not isinstance(doc, dict):
+                msg = (
+                    "{}: Error converting JSON to XML: cannot represent non-object types at top level. "
+                    "Use --xml-root=name to envelope your output with a root element."
+                )
+                raise ConversionError(msg.format(program_name))
+            full_document = True if xml_dtd else False
+            try:
+                xml_writer.write(doc, full_document=full_document)
+            except ValueError as e:
+                if "Document must have exactly one root" in str(e):
+                    raise Exception(str(e) + " Use --xml-root=name to envelope your output with a root element")
+                else:
+                    raise
+            output_stream.write("\n")
+    elif output_format == "toml" or output_format == "annotated_toml":
+        import tomlkit
+
+        for doc in docs:
+            if not isinstance(doc, dict):
+                msg = "{}: Error converting JSON to TOML: cannot represent non-object types at top level."
+                raise ConversionError(msg.format(program_name))
+            if output_format == "annotated_toml":
+                text = splice_toml(doc, toml_sources) if toml_sources else None
+                if text is not None:
+                    output_stream.write(text)
+                    continue
+                doc = tomlkit_from_json(doc)
+            tomlkit.dump(doc, output_stream)
+    else:
+        raise Exception("Unknown output format")
+
+
+def dump_docs(
+    docs,
+    output_stream,
+    output_format="yaml",
+    program_name="yq",
+    width=None,
+    indentless_lists=False,
+    xml_root=None,
+    xml_dtd=False,
+    xml_short_empty_elements=False,
+    explicit_start=False,
+    explicit_end=False,
+    yaml_output_grammar_version="1.1",
+    exit_func=None,
+    profiler=null_profiler,
+    toml_sources=None,
+):
+    docs = profiler.iterate("json_decode", docs, counter="output_documents")
+    dump_args = dict(
+        output_format=output_format,
+        program_name=program_name,
+        width=width,
+        indentless_lists=indentless_lists,
+        xml_root=xml_root,
+        xml_dtd=xml_dtd,
+        xml_short_empty_elements=xml_short_empty_elements,
+        explicit_start=explicit_start,
+        explicit_end=explicit_end,
+        yaml_output_grammar_version=yaml_output_grammar_version,
+    )
+    if output_format == "yaml" or output_format == "annotated_yaml":
+        dumper_class = get_dumper(
+            use_annotations=True if output_format == "annotated_yaml" else False,
+            indentless=indentless_lists,
+            grammar_version=yaml_output_grammar_version,
+        )
+        profiler.note("dumper_class", dumper_class.__name__)
+    # Many result documents are dumped in parallel; for a few, starting worker processes would take longer. Worker
+    # processes are only forked from the main thread, since forking while other threads run (as in yq_multi and
+    # yq.aio) can deadlock the child. The sources of TOML inputs are not sent to worker processes, so documents that
+    # may be spliced into them are dumped in this process.
+    use_pool = (os.cpu_count() or 1) > 1 and threading.current_thread() is threading.main_thread() and not toml_sources
+    first_docs = list(itertools.islice(docs, min_pool_docs if use_pool else 0))
+    docs = itertools.chain(first_docs, docs)
+    try:
+        if use_pool and len(first_docs) == min_pool_docs:
+            profiler.note("parallel_dump", True)
+            dump_in_pool(docs, output_stream, dump_args)
+        else:
+            write_docs(docs, output_stream, toml_sources=toml_sources, **dump_args)
+    except ConversionError as e:
+        exit_func(str(e))
+
+
 def yq(
     input_streams=None,
     output_stream=None,
@@ -197,9 +692,20 @@ def yq(
     expand_merge_keys=True,
     expand_aliases=True,
     max_expansion_factor=1024,
+    yaml_stream=False,
+    yaml_item_depth=0,
+    yaml_input_format="auto",
     yaml_output_grammar_version="1.1",
+    include=(),
+    exclude=(),
+    with_filename=False,
     jq_args=frozenset(),
     exit_func=None,
+    profile=False,
+    max_memory=None,
+    cache_dir=None,
+    cache_size=256 * 2**20,
+    jq_workers=1,
 ):
     if not input_streams:
         input_streams = [sys.stdin]
@@ -208,180 +714,391 @@ def yq(
     if not exit_func:
         exit_func = sys.exit
     converting_output = True if output_format != "json" else False
+    profiler = Profiler(trace_memory=profile == "memory") if profile else null_profiler
+    profiler.note("program", program_name)
+    profiler.note("input_format", input_format)
+    profiler.note("output_format", output_format)
+    if jq_workers > 1:
+        reason = sharding_error(list(jq_args))
+        if reason:
+            exit_func("{}: --jq-workers cannot be used with {}".format(program_name, reason))
+        if not converting_output:
+            jq_args = color_jq_args(jq_args, output_stream)
+        profiler.note("jq_workers", jq_workers)
 
-    try:
-        # Notes: universal_newlines is just a way to induce subprocess to make stdin a text buffer and encode it for us;
-        # close_fds must be false for command substitution to work (yq . t.yml --slurpfile t <(yq . t.yml))
-        jq = subprocess.Popen(
-            ["jq"] + list(jq_args),
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE if converting_output else None,
-            close_fds=False,
-            universal_newlines=True,
-        )
-    except OSError as e:
-        msg = "{}: Error starting jq: {}: {}. Is jq installed and available on PATH?"
-        exit_func(msg.format(program_name, type(e).__name__, e))
+    cache_writer, document_cache = None, None
+    if cache_dir:
+        try:
+            result_cache = ResultCache(cache_dir, max_size=cache_size)
+            document_cache = DocumentCache(cache_dir, max_size=cache_size)
+        except OSError as e:
+            exit_func("{}: Error using cache directory: {}".format(program_name, e))
+    has_directories = any(isinstance(input_stream, InputDirectory) for input_stream in input_streams)
+    if cache_dir and is_cacheable(jq_args) and not output_stream.isatty() and not has_directories:
+        with profiler.phase("cache_lookup"):
+            try:
+                jq_version = get_jq_version()
+            except OSError as e:
+                msg = "{}: Error starting jq: {}: {}. Is jq installed and available on PATH?"
+                exit_func(msg.format(program_name, type(e).__name__, e))
+            input_data, buffered_streams = [], []
+            # Documents tagged with --with-filename depend on the names of the inputs as well as on their contents
+            input_names = [getattr(input_stream, "name", None) for input_stream in input_streams if with_filename]
+            for input_stream in input_streams:
+                data, buffered_stream = buffer_input(input_stream)
+                input_stream.close()
+                input_data.append(data)
+                buffered_streams.append(buffered_stream)
+            input_streams = buffered_streams
+            cache_key = result_cache.key(
+                input_data,
+                yq_version=__version__,
+                jq_version=jq_version,
+                jq_defs=get_jq_defs_digest(),
+                jq_args=jq_args,
+                input_format=input_format,
+                output_format=output_format,
+                width=width,
+                indentless_lists=indentless_lists,
+                xml_root=xml_root,
+                xml_item_depth=xml_item_depth,
+                xml_dtd=xml_dtd,
+                xml_force_list=sorted(xml_force_list or []),
+                xml_short_empty_elements=xml_short_empty_elements,
+                explicit_start=explicit_start,
+                explicit_end=explicit_end,
+                expand_merge_keys=expand_merge_keys,
+                expand_aliases=expand_aliases,
+                max_expansion_factor=max_expansion_factor,
+                yaml_stream=yaml_stream,
+                yaml_item_depth=yaml_item_depth,
+                yaml_input_format=yaml_input_format,
+                yaml_output_grammar_version=yaml_output_grammar_version,
+                with_filename=with_filename,
+                input_names=input_names,
+            )
+            cached_output = result_cache.get(cache_key)
+        if cached_output:
+            profiler.note("result_cache", "hit")
+            with cached_output, profiler.phase("cache_read"):
+                shutil.copyfileobj(cached_output, profiler.writer(output_stream, "output_bytes"))
+            profiler.report()
+            return exit_func(os.EX_OK)
+        profiler.note("result_cache", "miss")
+        cache_writer = result_cache.writer(cache_key)
+        output_stream = TeeWriter(output_stream, cache_writer)
 
-    assert jq.stdin is not None  # this is to keep mypy happy
+    prune_path = None
+    prunable = not (yaml_stream or yaml_item_depth or with_filename or has_directories)
+    if input_format == "yaml" and output_format != "annotated_yaml" and prunable:
+        pruned = prune_jq_args(list(jq_args))
+        if pruned:
+            # Cached documents are not pruned
+            prune_path, jq_args, document_cache = pruned[0], pruned[1], None
+            profiler.note("prune_path", prune_path)
 
-    try:
-        if converting_output:
-            # TODO: enable true streaming in this branch (with asyncio, asyncproc, a multi-shot variant of
-            # subprocess.Popen._communicate, etc.)
-            # See https://stackoverflow.com/questions/375427/non-blocking-read-on-a-subprocess-pipe-in-python
-            use_annotations = True if output_format == "annotated_yaml" else False
-            use_toml_annotations = True if output_format == "annotated_toml" else False
-            json_buffer = io.StringIO()
-            for input_stream in input_streams:
-                if input_format == "yaml":
-                    loader_class = get_loader(
-                        use_annotations=use_annotations,
-                        expand_aliases=expand_aliases,
-                        expand_merge_keys=expand_merge_keys,
-                    )
-                    load_yaml_docs(
-                        in_stream=input_stream,
-                        out_stream=json_buffer,
-                        jq=None,
-                        loader_class=loader_class,
-                        max_expansion_factor=max_expansion_factor,
-                        exit_func=exit_func,
-                        prog=program_name,
-                    )
-                elif input_format == "xml":
-                    import xmltodict
+    # Documents passed through by the filter are written without starting jq (see yq.convert)
+    passthrough = None if yaml_stream or yaml_item_depth else passthrough_options(list(jq_args))
+    if passthrough is not None and not converting_output and "M" not in passthrough and output_stream.isatty():
+        # jq colors its output on a terminal
+        passthrough = None
+    compact = passthrough is not None and "c" in passthrough
+    if passthrough is not None:
+        # Cached documents are JSON text, which would have to be sent to jq
+        document_cache = None
+        profiler.note("passthrough", True)
 
-                    if xml_item_depth != 0:
-                        raise Exception("xml_item_depth is not supported with xq -x")
+    encode_args = dict(
+        input_format=input_format,
+        output_format=output_format,
+        program_name=program_name,
+        xml_item_depth=xml_item_depth,
+        xml_force_list=xml_force_list,
+        expand_merge_keys=expand_merge_keys,
+        expand_aliases=expand_aliases,
+        max_expansion_factor=max_expansion_factor,
+        exit_func=exit_func,
+        profiler=profiler,
+        document_cache=document_cache,
+        prune_path=prune_path,
+        yaml_stream=yaml_stream,
+        yaml_item_depth=yaml_item_depth,
+        yaml_input_format=yaml_input_format,
+        include=include,
+        exclude=exclude,
+        with_filename=with_filename,
+        toml_sources={} if output_format == "annotated_toml" else None,
+    )
+    memory_limit = None
+    if max_memory:
+        try:
+            memory_limit = MemoryLimit(max_memory)
+        except Exception as e:
+            exit_func("{}: Error: {}".format(program_name, e))
+        profiler.note("max_memory", max_memory)
+    memory_limit_msg = "{}: Error: exceeded the memory limit of {} bytes set with --max-memory"
 
-                    xml_doc = xmltodict.parse(
-                        input_stream.buffer if isinstance(input_stream, io.TextIOWrapper) else input_stream.read(),
-                        disable_entities=True,
-                        force_list=xml_force_list,
-                    )
-                    json.dump(xml_doc, json_buffer, cls=JSONDateTimeEncoder)
-                    json_buffer.write("\n")
-                elif input_format == "toml":
-                    import tomlkit
-
-                    toml_doc = tomlkit.load(input_stream)
-                    json.dump(
-                        tomlkit_to_json(toml_doc, use_annotations=use_toml_annotations),
-                        json_buffer,
-                        cls=JSONDateTimeEncoder,
-                    )
-                    json_buffer.write("\n")
-                else:
-                    raise Exception("Unknown input format")
-            jq_out, jq_err = jq.communicate(json_buffer.getvalue())
-            json_decoder = json.JSONDecoder()
-            if output_format == "yaml" or output_format == "annotated_yaml":
-                dumper_class = get_dumper(
-                    use_annotations=use_annotations,
-                    indentless=indentless_lists,
-                    grammar_version=yaml_output_grammar_version,
-                )
-                yaml.dump_all(
-                    decode_docs(jq_out, json_decoder),
-                    stream=output_stream,
-                    Dumper=dumper_class,
-                    width=sys.maxsize if width == 0 else width,
-                    allow_unicode=True,
-                    default_flow_style=False,
-                    explicit_start=explicit_start,
-                    explicit_end=explicit_end,
+    def limited(stream):
+        # The memory limit is checked as documents are written
+        return memory_limit.writer(stream) if memory_limit else stream
+
+    def start_jq():
+        try:
+            # Notes: universal_newlines is just a way to induce subprocess to make stdin a text buffer and encode it for
+            # us; close_fds must be false for command substitution to work (yq . t.yml --slurpfile t <(yq . t.yml))
+            with profiler.phase("jq_start"):
+                if jq_workers > 1:
+                    sharded_jq = ShardedJQ(jq_args, jq_workers, close_fds=False)
+                    for process in sharded_jq.processes:
+                        if memory_limit:
+                            memory_limit.limit_child(process.pid)
+                    return sharded_jq
+                process = subprocess.Popen(
+                    ["jq"] + list(jq_args),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE if converting_output or cache_writer else None,
+                    close_fds=False,
+                    universal_newlines=True,
                 )
-            elif output_format == "xml":
-                import xmltodict
-
-                for doc in decode_docs(jq_out, json_decoder):
-                    if xml_root:
-                        doc = {xml_root: doc}
-                    elif not isinstance(doc, dict):
-                        msg = (
-                            "{}: Error converting JSON to XML: cannot represent non-object types at top level. "
-                            "Use --xml-root=name to envelope your output with a root element."
-                        )
-                        exit_func(msg.format(program_name))
-                    full_document = True if xml_dtd else False
-                    try:
-                        xmltodict.unparse(
-                            doc,
-                            output=output_stream,
-                            full_document=full_document,
-                            pretty=True,
-                            indent="  ",
-                            short_empty_elements=xml_short_empty_elements,
-                        )
-                    except ValueError as e:
-                        if "Document must have exactly one root" in str(e):
-                            raise Exception(str(e) + " Use --xml-root=name to envelope your output with a root element")
-                        else:
-                            raise
-                    output_stream.write("\n")
-            elif output_format == "toml" or output_format == "annotated_toml":
-                import tomlkit
-
-                for doc in decode_docs(jq_out, json_decoder):
-                    if not isinstance(doc, dict):
-                        msg = "{}: Error converting JSON to TOML: cannot represent non-object types at top level."
-                        exit_func(msg.format(program_name))
-                    if output_format == "annotated_toml":
-                        doc = tomlkit_from_json(doc)
-                    tomlkit.dump(doc, output_stream)
+                if memory_limit:
+                    memory_limit.limit_child(process.pid)
+                return process
+        except OSError as e:
+            msg = "{}: Error starting jq: {}: {}. Is jq installed and available on PATH?"
+            exit_func(msg.format(program_name, type(e).__name__, e))
+
+    jq: Union[ShardedJQ, "subprocess.Popen[str]", None] = None if passthrough is not None else start_jq()
+
+    try:
+        if memory_limit:
+            memory_limit.apply()
+        if converting_output or jq_workers > 1:
+            # TODO: enable true streaming in this branch (see yq.aio for a variant that streams with asyncio)
+            json_buffer = io.StringIO()
+            jq_input = limited(json_buffer)
+            sink = DocumentSink(lambda: (None, jq_input)) if passthrough is not None else None
+            with profiler.phase("encode"):
+                encode_inputs(input_streams, sink or jq_input, **encode_args)
+            if sink and sink.jq_input is None:
+                docs, returncode = sink.docs, os.EX_OK
             else:
-                raise Exception("Unknown output format")
-        else:
-            if input_format == "yaml":
-                loader_class = get_loader(
-                    use_annotations=False, expand_aliases=expand_aliases, expand_merge_keys=expand_merge_keys
-                )
-                for input_stream in input_streams:
-                    load_yaml_docs(
-                        in_stream=input_stream,
-                        out_stream=jq.stdin,
-                        jq=jq,
-                        loader_class=loader_class,
-                        max_expansion_factor=max_expansion_factor,
+                if jq is None:
+                    profiler.note("passthrough", False)
+                    jq = start_jq()
+                jq_in = json_buffer.getvalue()
+                profiler.count("json_bytes_to_jq", encoded_size(jq_in))
+                with profiler.phase("jq"):
+                    if isinstance(jq, ShardedJQ) and not converting_output:
+                        # The output of each shard is written after its error output, as jq would interleave them
+                        jq_writer = profiler.writer(output_stream, "output_bytes")
+                        jq_out, jq_err = jq.communicate(
+                            jq_in, output_stream=profiler.writer(jq_writer, "json_bytes_from_jq")
+                        )
+                    else:
+                        jq_out, jq_err = jq.communicate(jq_in)
+                profiler.count("json_bytes_from_jq", encoded_size(jq_out))
+                docs, returncode = None, jq.returncode
+            if converting_output:
+                with profiler.phase("dump"):
+                    dump_docs(
+                        decode_docs(jq_out, json.JSONDecoder()) if docs is None else iter(docs),
+                        limited(profiler.writer(output_stream, "output_bytes")),
+                        output_format=output_format,
+                        program_name=program_name,
+                        width=width,
+                        indentless_lists=indentless_lists,
+                        xml_root=xml_root,
+                        xml_dtd=xml_dtd,
+                        xml_short_empty_elements=xml_short_empty_elements,
+                        explicit_start=explicit_start,
+                        explicit_end=explicit_end,
+                        yaml_output_grammar_version=yaml_output_grammar_version,
                         exit_func=exit_func,
-                        prog=program_name,
-                    )
-            elif input_format == "xml":
-                import xmltodict
-
-                def emit_entry(path, entry):
-                    assert jq.stdin is not None  # this is to keep mypy happy
-                    json.dump(entry, jq.stdin)
-                    jq.stdin.write("\n")
-                    return True
-
-                for input_stream in input_streams:
-                    xml_doc = xmltodict.parse(
-                        input_stream.buffer if isinstance(input_stream, io.TextIOWrapper) else input_stream.read(),
-                        disable_entities=True,
-                        force_list=xml_force_list,
-                        item_depth=xml_item_depth,
-                        item_callback=emit_entry,
+                        profiler=profiler,
+                        toml_sources=encode_args["toml_sources"],
                     )
-                    if xml_doc:
-                        emit_entry(None, xml_doc)
-            elif input_format == "toml":
-                toml_loader = get_toml_loader()
-                for input_stream in input_streams:
-                    toml_doc = toml_loader(input_stream.read())
-                    json.dump(toml_doc, jq.stdin, cls=JSONDateTimeEncoder)
-                    jq.stdin.write("\n")
             else:
-                raise Exception("Unknown input format")
+                with profiler.phase("write"):
+                    if docs is None:
+                        profiler.writer(output_stream, "output_bytes").write(jq_out)
+                    else:
+                        write_json(docs, limited(profiler.writer(output_stream, "output_bytes")), compact=compact)
+        else:
+            output_copier = None
 
-            try:
-                jq.stdin.close()
-            except Exception:
-                pass
-            jq.wait()
+            def open_jq():
+                nonlocal jq, output_copier
+                if jq is None:
+                    profiler.note("passthrough", False)
+                    # Documents written so far must reach the output before jq's
+                    output_stream.flush()
+                    jq = start_jq()
+                assert isinstance(jq, subprocess.Popen) and jq.stdin is not None  # this is to keep mypy happy
+                if cache_writer:
+                    # jq writes its output directly to our stdout unless it has to be copied to the cache as well
+                    output_copier = threading.Thread(target=shutil.copyfileobj, args=(jq.stdout, output_stream))
+                    output_copier.start()
+                return jq, limited(profiler.writer(jq.stdin, "json_bytes_to_jq"))
+
+            if passthrough is None:
+                jq, jq_input = open_jq()
+            else:
+                # Documents are written as they are parsed, as jq would, until one has to be sent to jq after all
+                output_writer = limited(profiler.writer(output_stream, "output_bytes"))
+                jq_input = DocumentSink(open_jq, lambda doc: write_json([doc], output_writer, compact=compact))
+            with profiler.phase("encode"):
+                encode_inputs(input_streams, jq_input, jq=jq or jq_input, **encode_args)
+            returncode = os.EX_OK
+            if jq:
+                assert isinstance(jq, subprocess.Popen) and jq.stdin is not None
+                with profiler.phase("jq_wait"):
+                    try:
+                        jq.stdin.close()
+                    except Exception:
+                        pass
+                    jq.wait()
+                    if output_copier:
+                        output_copier.join()
+                returncode = jq.returncode
         for input_stream in input_streams:
             input_stream.close()
-        exit_func(jq.returncode)
+        if memory_limit:
+            memory_limit.release()
+        if cache_writer and returncode == 0:
+            cache_writer.commit()
+        if jq:
+            profiler.note("jq_returncode", returncode)
+        profiler.report()
+        if memory_limit and returncode < 0:
+            msg = "{}: Error: jq was terminated by signal {}, likely after exceeding the memory limit of {} bytes"
+            exit_func(msg.format(program_name, -returncode, max_memory))
+        exit_func(returncode)
+    except MemoryError:
+        if memory_limit:
+            memory_limit.release()
+        if jq:
+            jq.kill()
+        exit_func(memory_limit_msg.format(program_name, max_memory))
+    except Exception as e:
+        exit_func("{}: Error running jq: {}: {}.".format(program_name, type(e).__name__, e))
+    finally:
+        if memory_limit:
+            memory_limit.release()
+        if cache_writer:
+            cache_writer.discard()
+
+
+def yq_multi(
+    input_streams=None,
+    outputs=(),
+    input_format="yaml",
+    program_name="yq",
+    xml_item_depth=0,
+    xml_force_list=frozenset(),
+    expand_merge_keys=True,
+    expand_aliases=True,
+    max_expansion_factor=1024,
+    yaml_stream=False,
+    yaml_item_depth=0,
+    yaml_input_format="auto",
+    include=(),
+    exclude=(),
+    with_filename=False,
+    exit_func=None,
+    **output_options,
+):
+    """
+    Parses and encodes the input once, then runs a separate jq process for each entry in outputs in parallel.
+
+    Each output is a dict with the jq_args and output_stream of one jq program. It can also set any of the output
+    options of :func:`yq` (output_format, width, indentless_lists, xml_root, xml_dtd, xml_short_empty_elements,
+    explicit_start, explicit_end, yaml_output_grammar_version), which otherwise default to output_options. The exit
+    code passed to exit_func is the largest of the jq exit codes.
+    """
+    if not input_streams:
+        input_streams = [sys.stdin]
+    if not exit_func:
+        exit_func = sys.exit
+    outputs = [dict(output_options, **output) for output in outputs]
+    for output in outputs:
+        output.setdefault("output_format", "json")
+        output.setdefault("output_stream", sys.stdout)
+
+    def encoding(output_format):
+        # The loaders used for -Y and -T keep annotations, and the TOML loader differs between JSON and converted output
+        if output_format in {"annotated_yaml", "annotated_toml"}:
+            return output_format
+        return "json" if output_format == "json" else "converted"
+
+    try:
+        input_data = {}
+        encodings = {encoding(output["output_format"]) for output in outputs}
+        if len(encodings) > 1:
+            # Directories are traversed again for each encoding
+            buffered_streams = [
+                input_stream if isinstance(input_stream, InputDirectory) else buffer_input(input_stream)[1]
+                for input_stream in input_streams
+            ]
+            for input_stream in input_streams:
+                input_stream.close()
+            input_streams = buffered_streams
+        for output_format in encodings:
+            json_buffer = io.StringIO()
+            for input_stream in input_streams if len(encodings) > 1 else []:
+                if not isinstance(input_stream, InputDirectory):
+                    input_stream.seek(0)
+            encode_inputs(
+                input_streams,
+                json_buffer,
+                include=include,
+                exclude=exclude,
+                with_filename=with_filename,
+                input_format=input_format,
+                output_format=output_format,
+                program_name=program_name,
+                xml_item_depth=xml_item_depth,
+                xml_force_list=xml_force_list,
+                expand_merge_keys=expand_merge_keys,
+                expand_aliases=expand_aliases,
+                max_expansion_factor=max_expansion_factor,
+                yaml_stream=yaml_stream,
+                yaml_item_depth=yaml_item_depth,
+                yaml_input_format=yaml_input_format,
+                exit_func=exit_func,
+            )
+            input_data[output_format] = json_buffer.getvalue()
+        for input_stream in input_streams:
+            input_stream.close()
+
+        def run_jq(output):
+            output_format, output_stream = output.pop("output_format"), output.pop("output_stream")
+            jq_args = output.pop("jq_args")
+            # jq writes JSON output for our stdout directly, so that it can still color it for a terminal
+            pipe_output = output_format != "json" or output_stream is not sys.stdout
+            jq = subprocess.Popen(
+                ["jq"] + list(jq_args),
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE if pipe_output else None,
+                close_fds=False,
+                universal_newlines=True,
+            )
+            jq_out, _ = jq.communicate(input_data[encoding(output_format)])
+            if output_format == "json":
+                if pipe_output:
+                    output_stream.write(jq_out)
+            else:
+                dump_docs(
+                    decode_docs(jq_out, json.JSONDecoder()),
+                    output_stream,
+                    output_format=output_format,
+                    program_name=program_name,
+                    exit_func=exit_func,
+                    **output,
+                )
+            return jq.returncode
+
+        with ThreadPoolExecutor(max_workers=len(outputs) or 1) as executor:
+            returncodes = list(executor.map(run_jq, outputs))
+        exit_func(max(returncodes, default=0))
     except Exception as e:
         exit_func("{}: Error running jq: {}: {}.".format(program_name, type(e).__name__, e))
@@ -0,0 +1,236 @@
+"""
+asyncio interface to yq.
+
+Runs jq through ``asyncio.create_subprocess_exec`` so that many transformations can share one event loop. Parsing and
+dumping are CPU-bound and run in the default executor; JSON produced by the parser is fed to jq through a bounded queue,
+so a slow jq applies backpressure all the way back to the parser thread.
+"""
+
+import asyncio
+import codecs
+import json
+import os
+import sys
+from typing import Any
+
+from . import decode_docs, dump_docs, encode_inputs
+
+chunk_size = 64 * 1024
+max_queued_chunks = 16
+
+
+class YqError(Exception):
+    pass
+
+
+def _raise_error(arg=None):
+    if arg:
+        raise YqError(arg)
+
+
+class _QueueWriter:
+    """
+    A write-only text stream that batches writes made from a worker thread into chunks and hands them to an event loop
+    through a bounded asyncio.Queue, blocking the writer while the queue is full.
+    """
+
+    def __init__(self, queue, loop):
+        self.queue = queue
+        self.loop = loop
+        self.buffer = []
+        self.buffered = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            data = "".join(self.buffer).encode()
+            self.buffer, self.buffered = [], 0
+            asyncio.run_coroutine_threadsafe(self.queue.put(data), self.loop).result()
+
+    def close(self):
+        self.flush()
+        asyncio.run_coroutine_threadsafe(self.queue.put(None), self.loop).result()
+
+
+async def _feed_jq(queue, stdin):
+    error = None
+    while True:
+        data = await queue.get()
+        if data is None:
+            break
+        if error is None:
+            try:
+                stdin.write(data)
+                await stdin.drain()
+            except (BrokenPipeError, ConnectionResetError) as e:
+                # Keep draining the queue so that the producer thread never blocks on a dead consumer
+                error = e
+    try:
+        stdin.close()
+    except Exception:
+        pass
+    if error is not None:
+        raise error
+
+
+async def _read_jq(stdout, output_stream, converting_output):
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = []
+    while True:
+        data = await stdout.read(chunk_size)
+        text = decoder.decode(data, final=not data)
+        if converting_output:
+            chunks.append(text)
+        elif text:
+            output_stream.write(text)
+        if not data:
+            break
+    return "".join(chunks)
+
+
+async def yq_async(
+    input_streams=None,
+    output_stream=None,
+    input_format="yaml",
+    output_format="json",
+    program_name="yq",
+    width=None,
+    indentless_lists=False,
+    xml_root=None,
+    xml_item_depth=0,
+    xml_dtd=False,
+    xml_force_list=frozenset(),
+    xml_short_empty_elements=False,
+    explicit_start=False,
+    explicit_end=False,
+    expand_merge_keys=True,
+    expand_aliases=True,
+    max_expansion_factor=1024,
+    yaml_stream=False,
+    yaml_item_depth=0,
+    yaml_input_format="auto",
+    yaml_output_grammar_version="1.1",
+    include=(),
+    exclude=(),
+    with_filename=False,
+    jq_args=frozenset(),
+    exit_func=None,
+):
+    """
+    Coroutine version of :func:`yq.yq`. Accepts the same arguments, except for the ones that configure the whole yq
+    process (``profile``, ``max_memory``, ``cache_dir``, ``cache_size`` and ``jq_workers``), and returns the jq exit
+    code instead of passing it to ``exit_func``. Errors raise :class:`YqError` unless a custom ``exit_func`` is given.
+    """
+    if not input_streams:
+        input_streams = [sys.stdin]
+    if not output_stream:
+        output_stream = sys.stdout
+    if not exit_func:
+        exit_func = _raise_error
+    converting_output = True if output_format != "json" else False
+    loop = asyncio.get_running_loop()
+
+    try:
+        jq = await asyncio.create_subprocess_exec(
+            "jq", *jq_args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        msg = "{}: Error starting jq: {}: {}. Is jq installed and available on PATH?"
+        exit_func(msg.format(program_name, type(e).__name__, e))
+        return None
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_queued_chunks)
+    writer = _QueueWriter(queue, loop)
+    toml_sources: Any = {} if output_format == "annotated_toml" else None
+
+    def encode():
+        try:
+            encode_inputs(
+                input_streams,
+                writer,
+                input_format=input_format,
+                output_format=output_format,
+                program_name=program_name,
+                xml_item_depth=xml_item_depth,
+                xml_force_list=xml_force_list,
+                expand_merge_keys=expand_merge_keys,
+                expand_aliases=expand_aliases,
+                max_expansion_factor=max_expansion_factor,
+                exit_func=exit_func,
+                yaml_stream=yaml_stream,
+                yaml_item_depth=yaml_item_depth,
+                yaml_input_format=yaml_input_format,
+                include=include,
+                exclude=exclude,
+                with_filename=with_filename,
+                toml_sources=toml_sources,
+            )
+        except BaseException:
+            loop.call_soon_threadsafe(jq.kill)
+            raise
+        finally:
+            writer.close()
+
+    try:
+        results = await asyncio.gather(
+            loop.run_in_executor(None, encode),
+            _feed_jq(queue, jq.stdin),
+            _read_jq(jq.stdout, output_stream, converting_output),
+            return_exceptions=True,
+        )
+        await jq.wait()
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        jq_out = results[-1]
+        if converting_output:
+
+            def dump():
+                dump_docs(
+                    decode_docs(jq_out, json.JSONDecoder()),
+                    output_stream,
+                    output_format=output_format,
+                    program_name=program_name,
+                    width=width,
+                    indentless_lists=indentless_lists,
+                    xml_root=xml_root,
+                    xml_dtd=xml_dtd,
+                    xml_short_empty_elements=xml_short_empty_elements,
+                    explicit_start=explicit_start,
+                    explicit_end=explicit_end,
+                    yaml_output_grammar_version=yaml_output_grammar_version,
+                    exit_func=exit_func,
+                    toml_sources=toml_sources,
+                )
+
+            await loop.run_in_executor(None, dump)
+        for input_stream in input_streams:
+            input_stream.close()
+    except Exception as e:
+        if jq.returncode is None:
+            jq.kill()
+            await jq.wait()
+        if isinstance(e, YqError):
+            raise
+        exit_func("{}: Error running jq: {}: {}.".format(program_name, type(e).__name__, e))
+    return jq.returncode
+
+
+async def yq_gather(jobs, concurrency=None):
+    """
+    Run several transformations concurrently, at most ``concurrency`` (default: the number of CPUs) at a time. Each job
+    is a dict of keyword arguments to :func:`yq_async`. Returns the list of jq exit codes, in job order.
+    """
+    semaphore = asyncio.Semaphore(concurrency or os.cpu_count() or 1)
+
+    async def run(job):
+        async with semaphore:
+            return await yq_async(**job)
+
+    return await asyncio.gather(*(run(job) for job in jobs))
@@ -0,0 +1,122 @@
+"""
+JSON encoding of documents with expanded aliases. The loaders return the same dict or list for every alias of an
+anchored collection, so a document can refer to one subtree many times. AliasEncoder encodes each such subtree once and
+reuses its text at every other reference, so the time spent encoding is proportional to the unique content of the
+document rather than to the size of its JSON.
+"""
+
+
+class ExpansionLimitError(Exception):
+    pass
+
+
+def find_shared(doc):
+    """
+    Returns the ids of the dicts and lists that occur more than once in doc.
+    """
+    seen, shared, stack = set(), set(), [doc]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            shared.add(id(value))
+            continue
+        seen.add(id(value))
+        values = value.values() if isinstance(value, dict) else value
+        stack.extend([item for item in values if isinstance(item, (dict, list, tuple))])
+    return shared
+
+
+def find_containing(doc, shared):
+    """
+    Returns the ids of the dicts and lists in doc that are shared or contain a shared one.
+    """
+    containing, visited, stack = set(), set(), [(doc, False)]
+    while stack:
+        value, children_visited = stack.pop()
+        values = value.values() if isinstance(value, dict) else value
+        if children_visited:
+            if id(value) in shared or any(id(item) in containing for item in values):
+                containing.add(id(value))
+            continue
+        if id(value) in visited:
+            continue
+        visited.add(id(value))
+        stack.append((value, True))
+        stack.extend((item, False) for item in values if isinstance(item, (dict, list, tuple)))
+    return containing
+
+
+class AliasEncoder:
+    """
+    Produces the same chunks of JSON as encoder.iterencode(), a JSONEncoder without indentation. The text of each shared
+    subtree is kept while the document is encoded; if it grows longer than max_chars, ExpansionLimitError is raised.
+    """
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def iterencode(self, doc, max_chars, has_aliases=True):
+        """
+        Yields the chunks of the JSON text of doc. Without has_aliases, doc is assumed not to contain shared subtrees.
+        """
+        shared = find_shared(doc) if has_aliases and isinstance(doc, (dict, list, tuple)) else None
+        if not shared:
+            return self.encoder.iterencode(doc)
+        self.shared, self.containing = shared, find_containing(doc, shared)
+        self.fragments, self.active, self.max_chars = {}, set(), max_chars
+        return self.encode(doc)
+
+    def encode(self, value):
+        if not isinstance(value, (dict, list, tuple)):
+            yield self.encoder.encode(value)
+        elif id(value) in self.fragments:
+            yield self.fragments[id(value)]
+        elif id(value) not in self.containing:
+            yield from self.encoder.iterencode(value)
+        elif id(value) in self.shared:
+            fragment = self.join(self.encode_collection(value))
+            self.fragments[id(value)] = fragment
+            yield fragment
+        else:
+            yield from self.encode_collection(value)
+
+    def encode_collection(self, value):
+        if id(value) in self.active:
+            raise ValueError("Circular reference detected")
+        self.active.add(id(value))
+        if isinstance(value, dict):
+            if not value:
+                yield "{}"
+            else:
+                separator = "{"
+                for key, item in value.items():
+                    yield separator + self.encode_key(key) + self.encoder.key_separator
+                    yield from self.encode(item)
+                    separator = self.encoder.item_separator
+                yield "}"
+        elif not value:
+            yield "[]"
+        else:
+            separator = "["
+            for item in value:
+                yield separator
+                yield from self.encode(item)
+                separator = self.encoder.item_separator
+            yield "]"
+        self.active.discard(id(value))
+
+    def encode_key(self, key):
+        if isinstance(key, str):
+            return self.encoder.encode(key)
+        if isinstance(key, (int, float)) or key is None:
+            return self.encoder.encode(self.encoder.encode(key))
+        raise TypeError(f"keys must be str, int, float, bool or None, not {key.__class__.__name__}")
+
+    def join(self, chunks):
+        parts, size = [], 0
+        for chunk in chunks:
+            size += len(chunk)
+            if size > self.max_chars:
+                raise ExpansionLimitError()
+            parts.append(chunk)
+        return "".join(parts)
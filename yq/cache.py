@@ -0,0 +1,221 @@
+import hashlib
+import io
+import json
+import os
+import re
+import stat
+import subprocess
+import tempfile
+import time
+from functools import lru_cache
+from typing import Any, Optional
+
+# jq builtins whose output depends on more than the input and the program (such as the time zone), or that write to
+# stderr, and directives that read modules whose contents would not be part of the key
+uncacheable_builtins_re = re.compile(
+    r"\$ENV\b|\b(?:env|now|input_filename|debug|stderr|get_search_list|get_prog_origin|get_jq_origin)\b"
+    r"|\b(?:localtime|gmtime|mktime|strflocaltime|strptime|fromdate|fromdateiso8601|dateadd|datesub)\b"
+    r"|\b(?:import|include)\s*\""
+)
+# jq options that read files whose contents would not be part of the key
+uncacheable_jq_options = {"-f", "--from-file", "--slurpfile", "--rawfile", "-L", "--library-path"}
+stale_temp_file_age = 24 * 60 * 60
+
+
+@lru_cache(maxsize=None)
+def get_jq_version():
+    return subprocess.run(["jq", "--version"], stdout=subprocess.PIPE, universal_newlines=True).stdout.strip()
+
+
+def get_jq_defs_digest():
+    """
+    Returns a hash of ~/.jq, whose definitions jq loads before every program, or None if it is not a file.
+    """
+    try:
+        with open(os.path.join(os.path.expanduser("~"), ".jq"), "rb") as fh:
+            return hashlib.sha256(fh.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def is_cacheable(jq_args):
+    for arg in jq_args:
+        if arg in uncacheable_jq_options or arg.startswith("-L") or uncacheable_builtins_re.search(arg):
+            return False
+    return True
+
+
+def input_file_stat(stream):
+    try:
+        return os.fstat(stream.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return getattr(stream, "file_stat", None)
+
+
+def buffer_input(stream):
+    """
+    Reads an input stream into memory. Returns its contents, for hashing, and a stream to parse them from instead.
+    """
+    file_stat = input_file_stat(stream)
+    if isinstance(stream, io.TextIOWrapper):
+        data = stream.buffer.read()
+        buffer = io.BytesIO(data)
+        buffer.name = stream.name  # type: ignore
+        replacement: Any = io.TextIOWrapper(buffer, encoding=stream.encoding, errors=stream.errors)
+    else:
+        data = stream.read()
+        replacement = io.StringIO(data)
+        if hasattr(stream, "name"):
+            replacement.name = stream.name
+    # Keep the stat result of the original file so that the document cache can still use the buffered stream
+    replacement.file_stat = file_stat
+    return data, replacement
+
+
+class DiskCache:
+    """
+    Base class for the caches stored under --cache-dir. Each cache keeps its entries in its own subdirectory, but
+    max_size applies to the cache directory as a whole.
+
+    Entries are written to a temporary file and atomically renamed into place, so concurrent yq processes sharing a
+    cache directory only ever see complete entries. Reading an entry updates its mtime; once the total size of the
+    cache directory exceeds max_size, the least recently used entries are removed.
+    """
+
+    namespace = ""
+
+    def __init__(self, cache_dir, max_size=256 * 2**20):
+        self.root_dir = cache_dir
+        self.cache_dir = os.path.join(cache_dir, self.namespace)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        path = os.path.join(self.cache_dir, key)
+        try:
+            entry = open(path, encoding="utf-8", newline="")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def writer(self, key):
+        return CacheWriter(self, key)
+
+    def evict(self):
+        entries = []
+        for namespace in os.scandir(self.root_dir):
+            if not namespace.is_dir():
+                continue
+            for entry in os.scandir(namespace.path):
+                try:
+                    entry_stat = entry.stat()
+                    # Temporary files are in use by a concurrent writer, unless a killed process left them behind
+                    if entry.name.startswith("."):
+                        if entry_stat.st_mtime < time.time() - stale_temp_file_age:
+                            os.remove(entry.path)
+                        continue
+                except FileNotFoundError:
+                    continue
+                entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+class ResultCache(DiskCache):
+    """
+    Content-addressed store of yq output, keyed by a hash of the input contents, the jq arguments, the yq options that
+    affect output, the yq and jq versions, and the definitions in ~/.jq.
+    """
+
+    namespace = "results"
+
+    def key(self, input_data, **options):
+        digest = hashlib.sha256()
+        digest.update(json.dumps(options, sort_keys=True, default=list).encode())
+        for data in input_data:
+            encoded = data.encode() if isinstance(data, str) else data
+            digest.update(b"\0%d\0" % len(encoded))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+
+class DocumentCache(DiskCache):
+    """
+    Store of the JSON document stream that an input file was converted to, keyed by the path, device, inode, size and
+    modification and change times of the file and by the loader options. Files changed within the last racy_interval
+    seconds are not cached, since a further change within the timestamp granularity might not alter their stat result.
+    """
+
+    namespace = "documents"
+    racy_interval = 2
+
+    def key(self, input_stream, **options):
+        file_stat = input_file_stat(input_stream)
+        if file_stat is None or not stat.S_ISREG(file_stat.st_mode):
+            return None
+        if max(file_stat.st_mtime, file_stat.st_ctime) > time.time() - self.racy_interval:
+            return None
+        file_id = dict(
+            path=os.path.realpath(input_stream.name),
+            device=file_stat.st_dev,
+            inode=file_stat.st_ino,
+            size=file_stat.st_size,
+            mtime=file_stat.st_mtime_ns,
+            ctime=file_stat.st_ctime_ns,
+        )
+        key_data = json.dumps(dict(options, file=file_id), sort_keys=True)
+        return hashlib.sha256(key_data.encode()).hexdigest()
+
+
+class CacheWriter:
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        fd, temp_path = tempfile.mkstemp(prefix=".", dir=cache.cache_dir)
+        self.temp_path: Optional[str] = temp_path
+        self.temp_file = open(fd, "w", encoding="utf-8", newline="")
+
+    def write(self, data):
+        return self.temp_file.write(data)
+
+    def commit(self):
+        self.temp_file.close()
+        assert self.temp_path is not None
+        os.replace(self.temp_path, os.path.join(self.cache.cache_dir, self.key))
+        self.temp_path = None
+        self.cache.evict()
+
+    def discard(self):
+        if self.temp_path is None:
+            return
+        self.temp_file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+        self.temp_path = None
+
+
+class TeeWriter:
+    def __init__(self, stream, *copies):
+        self.stream = stream
+        self.copies = copies
+
+    def write(self, data):
+        for copy in self.copies:
+            copy.write(data)
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
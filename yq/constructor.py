@@ -0,0 +1,282 @@
+"""
+Single-pass document construction for the loaders returned by ``get_loader(use_annotations=False)``: dicts and lists
+are built directly from parser events, without composing a node graph and walking it again in Python. Scalars are
+constructed with the loader's constructors as they are parsed. Anchors, aliases and merge keys are handled the same way
+as by the composer and SafeConstructor.
+
+Collections with an explicit tag that has a constructor of its own (``!!omap``, ``!!pairs``) are composed into nodes
+and passed to that constructor.
+"""
+
+import types
+
+import yaml
+from yaml.composer import ComposerError
+from yaml.constructor import ConstructorError, SafeConstructor
+
+from .stream import merge_tag
+
+seq_tag = yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG
+map_tag = yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG
+
+
+class Recursive:
+    """
+    Placeholder for the value of an anchored collection that is still being constructed.
+    """
+
+
+class MergeKey:
+    """
+    Placeholder for a merge key (``<<``) of the mapping being constructed.
+    """
+
+
+class Frame:
+    __slots__ = ("node_id", "anchor", "start_mark", "items", "merge", "key", "has_key")
+
+    def __init__(self, node_id, anchor, start_mark):
+        self.node_id = node_id
+        self.anchor = anchor
+        self.start_mark = start_mark
+        self.items = []
+        self.merge = None
+        self.key = None
+        self.has_key = False
+
+
+class NodeFrame:
+    __slots__ = ("node", "key")
+
+    def __init__(self, node):
+        self.node = node
+        self.key = None
+
+
+def node_id(value):
+    if isinstance(value, dict):
+        return "mapping"
+    return "sequence" if isinstance(value, list) else "scalar"
+
+
+class EventConstructor:
+    """
+    Constructs the documents parsed by loader. check_document() and get_document() take the place of the loader's
+    check_node() and construct_document(get_node()); get_document() also returns the end mark of the document.
+    has_aliases tells whether the last document contains aliases of collections, whose values are shared.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.anchors = {}
+        self.constructors = {}
+        self.has_aliases = False
+
+    def check_document(self):
+        loader = self.loader
+        if loader.check_event(yaml.StreamStartEvent):
+            loader.get_event()
+        return not loader.check_event(yaml.StreamEndEvent)
+
+    def get_document(self):
+        loader = self.loader
+        loader.get_event()
+        frames: list = []
+        self.has_aliases = False
+        while True:
+            event = loader.get_event()
+            if frames and isinstance(frames[-1], NodeFrame):
+                node = self.compose(event, frames)
+                if node is None:
+                    continue
+                if frames and isinstance(frames[-1], NodeFrame):
+                    self.add_node(frames[-1], node)
+                    continue
+                value, kind, start_mark = self.construct_node(node), node.id, node.start_mark
+            elif isinstance(event, yaml.CollectionEndEvent):
+                frame = frames.pop()
+                if frame.node_id == "mapping":
+                    value = dict(frame.merge + frame.items) if frame.merge else dict(frame.items)
+                else:
+                    value = frame.items
+                kind, start_mark = frame.node_id, frame.start_mark
+                if frame.anchor is not None:
+                    self.anchors[frame.anchor] = (value, kind, start_mark)
+            elif isinstance(event, yaml.AliasEvent):
+                value, kind, start_mark = self.get_anchor(event)
+            elif isinstance(event, yaml.ScalarEvent):
+                self.check_anchor(event)
+                tag = event.tag
+                if tag is None or tag == "!":
+                    tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+                if tag == merge_tag and frames and frames[-1].node_id == "mapping" and not frames[-1].has_key:
+                    value = MergeKey
+                else:
+                    value = self.construct_scalar(tag, event)
+                kind, start_mark = "scalar", event.start_mark
+                if event.anchor is not None:
+                    self.anchors[event.anchor] = (value, kind, start_mark)
+            else:
+                self.check_anchor(event)
+                node_class = yaml.MappingNode if isinstance(event, yaml.MappingStartEvent) else yaml.SequenceNode
+                tag = event.tag
+                if tag is None or tag == "!":
+                    tag = loader.resolve(node_class, None, event.implicit)
+                if tag in (map_tag, seq_tag) or tag not in loader.yaml_constructors:
+                    frames.append(Frame(node_class.id, event.anchor, event.start_mark))
+                    if event.anchor is not None:
+                        self.anchors[event.anchor] = (Recursive, node_class.id, event.start_mark)
+                else:
+                    self.compose(event, frames)
+                continue
+            if not frames:
+                loader.get_event()
+                self.anchors = {}
+                return value, event.end_mark
+            self.add_value(frames[-1], value, kind, start_mark)
+
+    def get_anchor(self, event):
+        if event.anchor not in self.anchors:
+            raise ComposerError(None, None, "found undefined alias %r" % event.anchor, event.start_mark)
+        value, kind, start_mark = self.anchors[event.anchor]
+        if value is Recursive:
+            raise ConstructorError(None, None, "found unconstructable recursive node", start_mark)
+        if kind != "scalar":
+            self.has_aliases = True
+        return value, kind, start_mark
+
+    def check_anchor(self, event):
+        if event.anchor is not None and event.anchor in self.anchors:
+            raise ComposerError(
+                "found duplicate anchor %r; first occurrence" % event.anchor,
+                self.anchors[event.anchor][2],
+                "second occurrence",
+                event.start_mark,
+            )
+
+    def add_value(self, frame, value, kind, start_mark):
+        if frame.node_id == "sequence":
+            frame.items.append(value)
+        elif not frame.has_key:
+            frame.key, frame.has_key = value, True
+        else:
+            if frame.key is MergeKey:
+                self.merge(frame, value, kind, start_mark)
+            else:
+                frame.items.append((frame.key, value))
+            frame.key, frame.has_key = None, False
+
+    def merge(self, frame, value, kind, start_mark):
+        # Same as SafeConstructor.flatten_mapping; the merged mappings are already flattened
+        if frame.merge is None:
+            frame.merge = []
+        if kind == "mapping" and isinstance(value, dict):
+            frame.merge.extend(value.items())
+        elif kind == "sequence":
+            submappings = []
+            for submapping in value:
+                if isinstance(submapping, tuple):
+                    # A pair of an !!omap or !!pairs, which was composed from a mapping with one key
+                    submapping = dict([submapping])
+                elif not isinstance(submapping, dict):
+                    raise ConstructorError(
+                        "while constructing a mapping",
+                        frame.start_mark,
+                        "expected a mapping for merging, but found %s" % node_id(submapping),
+                        start_mark,
+                    )
+                submappings.append(submapping)
+            for submapping in reversed(submappings):
+                frame.merge.extend(submapping.items())
+        else:
+            raise ConstructorError(
+                "while constructing a mapping",
+                frame.start_mark,
+                "expected a mapping or list of mappings for merging, but found %s" % kind,
+                start_mark,
+            )
+
+    def construct_scalar(self, tag, event):
+        constructor = self.constructors.get(tag)
+        if constructor is None:
+            constructor = self.constructors[tag] = self.get_constructor(tag)
+        if constructor is SafeConstructor.construct_yaml_str:
+            return event.value
+        data = constructor(yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style))
+        if isinstance(data, types.GeneratorType):
+            generator, data = data, next(data)
+            for _ in generator:
+                pass
+        return data
+
+    def get_constructor(self, tag):
+        loader = self.loader
+        if tag in loader.yaml_constructors:
+            constructor = loader.yaml_constructors[tag]
+            if constructor is SafeConstructor.construct_yaml_str:
+                return constructor
+            return lambda node: constructor(loader, node)
+        for tag_prefix, multi_constructor in loader.yaml_multi_constructors.items():
+            if tag_prefix is not None and tag.startswith(tag_prefix):
+                return lambda node: multi_constructor(loader, tag[len(tag_prefix) :], node)
+        return lambda node: loader.construct_object(node, deep=True)
+
+    def compose(self, event, frames):
+        """
+        Composes a node from event when inside a collection that is constructed from nodes. Returns the node if it is
+        complete, or None if a collection was started.
+        """
+        if isinstance(event, yaml.CollectionEndEvent):
+            node = frames.pop().node
+            node.end_mark = event.end_mark
+            return node
+        if isinstance(event, yaml.AliasEvent):
+            value, kind, start_mark = self.get_anchor(event)
+            if isinstance(value, yaml.Node):
+                return value
+            # An anchor outside of the collection: its value has already been constructed
+            node_class = {"mapping": yaml.MappingNode, "sequence": yaml.SequenceNode}.get(kind, yaml.ScalarNode)
+            node = node_class(None, "" if kind == "scalar" else [], start_mark, event.end_mark)
+            self.loader.constructed_objects[node] = value
+            return node
+        self.check_anchor(event)
+        tag = event.tag
+        if isinstance(event, yaml.ScalarEvent):
+            if tag is None or tag == "!":
+                tag = self.loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+            node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        else:
+            node_class = yaml.MappingNode if isinstance(event, yaml.MappingStartEvent) else yaml.SequenceNode
+            if tag is None or tag == "!":
+                tag = self.loader.resolve(node_class, None, event.implicit)
+            node = node_class(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        if event.anchor is not None:
+            self.anchors[event.anchor] = (node, node.id, event.start_mark)
+        if isinstance(node, yaml.ScalarNode):
+            return node
+        frames.append(NodeFrame(node))
+        return None
+
+    def add_node(self, frame, node):
+        if isinstance(frame.node, yaml.SequenceNode):
+            frame.node.value.append(node)
+        elif frame.key is None:
+            frame.key = node
+        else:
+            frame.node.value.append((frame.key, node))
+            frame.key = None
+
+    def construct_node(self, node):
+        loader = self.loader
+        data = loader.construct_object(node)
+        while loader.state_generators:
+            state_generators, loader.state_generators = loader.state_generators, []
+            for generator in state_generators:
+                for _ in generator:
+                    pass
+        # Anchors inside the collection refer to the constructed values from now on
+        for anchor, (value, kind, start_mark) in list(self.anchors.items()):
+            if isinstance(value, yaml.Node):
+                self.anchors[anchor] = (loader.construct_object(value, deep=True), kind, start_mark)
+        loader.constructed_objects, loader.recursive_objects, loader.deep_construct = {}, {}, False
+        return data
@@ -0,0 +1,205 @@
+"""
+Format conversion without jq. When the jq filter passes its input through unchanged (``.``, or ``--convert``), the
+parsed input documents are given to the output writers directly instead of being encoded as JSON, piped through jq and
+decoded again. This is only done for documents that jq would read and write back without changes; as soon as a document
+contains a float or an integer beyond 2**53 (whose formatting differs between jq versions), a string that is not valid
+Unicode or a value without a JSON form, the documents not yet written are sent to jq as usual.
+"""
+
+import json
+import re
+from datetime import date, datetime, time
+from typing import Any
+
+# Unpaired surrogates, which jq replaces with U+FFFD
+surrogate_re = re.compile("[\ud800-\udfff]")
+# Integers up to this size are written the same way by all versions of jq
+max_exact_int = 2**53
+
+
+class NotConvertible(Exception):
+    pass
+
+
+def passthrough_options(jq_args):
+    """
+    Returns the set of jq options used (a subset of "c" and "M") if jq_args make jq write its input documents unchanged,
+    that is, if the filter is ``.`` and the only other options are -c/--compact-output and -M/--monochrome-output.
+    Otherwise, returns None.
+    """
+    options, has_filter = set(), False
+    for arg in jq_args:
+        if arg == "--compact-output":
+            options.add("c")
+        elif arg == "--monochrome-output":
+            options.add("M")
+        elif len(arg) > 1 and arg.startswith("-") and not arg.startswith("--") and set(arg[1:]) <= {"c", "M"}:
+            options.update(arg[1:])
+        elif arg.strip() == "." and not has_filter:
+            has_filter = True
+        else:
+            return None
+    return options if has_filter else None
+
+
+def check_string(value):
+    if not value.isascii() and surrogate_re.search(value):
+        raise NotConvertible()
+    return value
+
+
+def convert_scalar(value):
+    """
+    Returns value as it would be decoded from jq's output.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return check_string(value)
+    if value is None or value_type is bool:
+        return value
+    if isinstance(value, int):
+        if -max_exact_int <= value <= max_exact_int:
+            return int(value)
+        raise NotConvertible()
+    if isinstance(value, str):
+        return check_string(str.__str__(value))
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    raise NotConvertible()
+
+
+def convert_key(key):
+    if type(key) is str:
+        return check_string(key)
+    if isinstance(key, str):
+        return check_string(str.__str__(key))
+    if key is None or isinstance(key, bool):
+        return json.dumps(key)
+    if isinstance(key, int) and -max_exact_int <= key <= max_exact_int:
+        return str(int(key))
+    raise NotConvertible()
+
+
+def convert_mapping(mapping):
+    """
+    Returns mapping, or a new dict if its keys had to be converted to strings.
+    """
+    if all(type(key) is str and (key.isascii() or not surrogate_re.search(key)) for key in mapping):
+        return mapping
+    converted = {}
+    for key, value in mapping.items():
+        key = convert_key(key)
+        if key in converted:
+            raise NotConvertible()
+        converted[key] = value
+    return converted
+
+
+def convert_document(doc):
+    """
+    Returns doc as jq would output it after reading its JSON encoding: dates and times become ISO format strings, tuples
+    become lists and subclasses of str and int become plain values. The dicts and lists of doc are updated in place.
+    Raises NotConvertible if jq could output doc differently.
+    """
+    if isinstance(doc, dict):
+        doc = convert_mapping(doc if type(doc) is dict else dict(doc))
+    elif isinstance(doc, (list, tuple)):
+        doc = list(doc)
+    else:
+        return convert_scalar(doc)
+    stack = [doc]
+    while stack:
+        collection = stack.pop()
+        items = collection.items() if isinstance(collection, dict) else enumerate(collection)
+        for key, value in items:
+            value_type = type(value)
+            if value_type is str:
+                if not value.isascii() and surrogate_re.search(value):
+                    raise NotConvertible()
+            elif value_type is dict:
+                converted = convert_mapping(value)
+                if converted is not value:
+                    collection[key] = converted
+                stack.append(converted)
+            elif value_type is list:
+                stack.append(value)
+            elif isinstance(value, dict):
+                collection[key] = converted = convert_mapping(dict(value))
+                stack.append(converted)
+            elif isinstance(value, (list, tuple)):
+                collection[key] = converted = list(value)
+                stack.append(converted)
+            else:
+                converted = convert_scalar(value)
+                if converted is not value:
+                    collection[key] = converted
+    return doc
+
+
+class DocumentSink:
+    """
+    Takes the place of the stream that jq reads the input documents from. Documents passed to add() are converted and
+    passed to write_doc, or kept in docs if write_doc is None. When a document cannot be converted, or JSON text is
+    written, open_jq() is called; it returns jq (or None if jq is started later) and the stream to write its input to.
+    The documents kept so far are written to that stream, and from then on add() returns False, so that the caller
+    writes the document as JSON.
+    """
+
+    def __init__(self, open_jq, write_doc=None):
+        self.open_jq = open_jq
+        self.write_doc = write_doc
+        self.docs = []
+        self.jq: Any = None
+        self.jq_input: Any = None
+
+    def add(self, doc):
+        if self.jq_input is not None:
+            return False
+        try:
+            doc = convert_document(doc)
+        except NotConvertible:
+            self.fall_back()
+            return False
+        if self.write_doc:
+            self.write_doc(doc)
+        else:
+            self.docs.append(doc)
+        return True
+
+    def write(self, text):
+        if self.jq_input is None:
+            self.fall_back()
+        self.jq_input.write(text)
+
+    def fall_back(self):
+        self.jq, self.jq_input = self.open_jq()
+        for doc in self.docs:
+            self.jq_input.write(json.dumps(doc) + "\n")
+        self.docs = []
+
+    def kill(self):
+        """
+        Kills jq if it has been started, so that the sink can be passed to the encoders in place of jq.
+        """
+        if self.jq:
+            self.jq.kill()
+
+
+def add_document(out_stream, doc):
+    """
+    Passes doc to out_stream if it is a DocumentSink that accepts it. Returns False if doc must be encoded as JSON.
+    """
+    return isinstance(out_stream, DocumentSink) and out_stream.add(doc)
+
+
+def write_json(docs, stream, compact=False):
+    """
+    Writes docs to stream as jq does without colors, with -c if compact is set.
+    """
+    for doc in docs:
+        if compact:
+            text = json.dumps(doc, ensure_ascii=False, separators=(",", ":"))
+        else:
+            text = json.dumps(doc, ensure_ascii=False, indent=2)
+        # jq escapes DEL, which json only escapes with ensure_ascii
+        stream.write(text.replace("\x7f", "\\u007f") + "\n")
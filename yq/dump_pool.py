@@ -0,0 +1,60 @@
+"""
+Parallel dumping: when jq produces many result documents, they are converted to YAML, XML or TOML in chunks by a pool
+of worker processes, and the chunks are written in order. The chunks of a YAML stream are dumped as parts of one
+stream, so document separators and explicit start and end markers are the same as when dumping in one process.
+"""
+
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Number of result documents each worker process dumps at a time
+docs_per_task = 64
+# Fewer result documents than this are dumped in the main process
+min_pool_docs = 512
+# Number of chunks submitted to each worker process ahead of the chunk being written
+tasks_per_worker = 2
+
+
+def dump_chunk(task):
+    from . import ConversionError, write_docs
+
+    docs, first_document, end_stream, dump_args = task
+    output = io.StringIO()
+    try:
+        write_docs(docs, output, first_document=first_document, end_stream=end_stream, **dump_args)
+    except ConversionError as e:
+        # The documents before the one that could not be converted are still written
+        return output.getvalue(), str(e)
+    return output.getvalue(), None
+
+
+def chunk_tasks(docs, dump_args):
+    chunk, first_document = list(islice(docs, docs_per_task)), True
+    while chunk:
+        next_chunk = list(islice(docs, docs_per_task))
+        yield chunk, first_document, not next_chunk, dump_args
+        chunk, first_document = next_chunk, False
+
+
+def dump_in_pool(docs, output_stream, dump_args):
+    """
+    Writes docs to output_stream like :func:`yq.write_docs`, dumping them in worker processes.
+    """
+    from . import ConversionError
+
+    with ProcessPoolExecutor() as executor:
+        # Chunks are submitted as earlier ones are written, so that only a bounded number of documents are in flight
+        tasks = chunk_tasks(docs, dump_args)
+        window = tasks_per_worker * (os.cpu_count() or 1)
+        pending = deque(executor.submit(dump_chunk, task) for task in islice(tasks, window))
+        while pending:
+            output, error = pending.popleft().result()
+            pending.extend(executor.submit(dump_chunk, task) for task in islice(tasks, 1))
+            output_stream.write(output)
+            if error:
+                for future in pending:
+                    future.cancel()
+                raise ConversionError(error)
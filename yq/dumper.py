@@ -1,9 +1,12 @@
 import re
+from functools import lru_cache
 from typing import Any, Dict, List
 
 import yaml
+from yaml.emitter import ScalarAnalysis
 
 from .loader import hash_key, set_yaml_grammar
+from .trampoline import run
 from .yaml_support import (
     CommentPreservingDumperMixin,
     decode_comment,
@@ -18,11 +21,96 @@ from .yaml_support import (
 #     from yaml import SafeDumper as default_dumper
 
 
-class OrderedIndentlessDumper(yaml.SafeDumper):
+breaks = "\n\x85\u2028\u2029"
+whitespace = "\0 \t\r" + breaks
+flow_indicator_re = re.compile(r"[,?\[\]{}:]")
+block_indicator_re = re.compile(r":(?=[{ws}]|\Z)|[{ws}]#".format(ws=whitespace))
+line_break_re = re.compile("[{}]".format(breaks))
+break_space_re = re.compile("[{}] ".format(breaks))
+space_break_re = re.compile(" [{}]".format(breaks))
+special_character_re = re.compile("[^\n\x20-\x7e]")
+special_unicode_character_re = re.compile(
+    "[^\n\x20-\x7e\x85\xa0-\ud7ff\ue000-\ufefe\uff00-\ufffd\U00010000-\U0010fffe]"
+)
+max_cached_scalar_length = 128
+
+
+def analyze_scalar(scalar, allow_unicode):
+    """
+    Computes the same result as yaml.emitter.Emitter.analyze_scalar, using regular expressions over the whole scalar
+    instead of a character-by-character loop.
+    """
+    if not scalar:
+        return ScalarAnalysis(
+            scalar=scalar,
+            empty=True,
+            multiline=False,
+            allow_flow_plain=False,
+            allow_block_plain=True,
+            allow_single_quoted=True,
+            allow_double_quoted=True,
+            allow_block=False,
+        )
+
+    flow_indicators = block_indicators = scalar.startswith("---") or scalar.startswith("...")
+    first, followed_by_whitespace = scalar[0], len(scalar) == 1 or scalar[1] in whitespace
+    if first in "#,[]{}&*!|>'\"%@`" or (first == "-" and followed_by_whitespace):
+        flow_indicators = block_indicators = True
+    elif first in "?:":
+        flow_indicators = True
+        block_indicators = block_indicators or followed_by_whitespace
+    if flow_indicator_re.search(scalar, 1):
+        flow_indicators = True
+    if block_indicator_re.search(scalar, 1):
+        flow_indicators = block_indicators = True
+
+    line_breaks = line_break_re.search(scalar) is not None
+    if allow_unicode:
+        special_characters = special_unicode_character_re.search(scalar) is not None
+    else:
+        special_characters = special_character_re.search(scalar) is not None
+    leading_space_or_break = first == " " or first in breaks
+    trailing_space = scalar[-1] == " "
+    break_space = break_space_re.search(scalar) is not None
+    space_break = space_break_re.search(scalar) is not None
+
+    allow_plain = not (leading_space_or_break or trailing_space or scalar[-1] in breaks)
+    allow_plain = allow_plain and not (break_space or space_break or special_characters or line_breaks)
+    allow_single_quoted = not (break_space or space_break or special_characters)
+    return ScalarAnalysis(
+        scalar=scalar,
+        empty=False,
+        multiline=line_breaks,
+        allow_flow_plain=allow_plain and not flow_indicators,
+        allow_block_plain=allow_plain and not block_indicators,
+        allow_single_quoted=allow_single_quoted,
+        allow_double_quoted=True,
+        allow_block=not (trailing_space or space_break or special_characters),
+    )
+
+
+analyze_scalar_cached = lru_cache(maxsize=2**12)(analyze_scalar)
+
+
+class ScalarAnalysisCacheMixin:
+    """
+    Replaces the emitter's per-character scalar analysis. The result only depends on the value and on allow_unicode,
+    so the analysis of short values, which tend to repeat (labels, image tags), is memoized.
+    """
+
+    allow_unicode: Any
+
+    def analyze_scalar(self, scalar):
+        if len(scalar) > max_cached_scalar_length:
+            return analyze_scalar(scalar, self.allow_unicode)
+        return analyze_scalar_cached(scalar, self.allow_unicode)
+
+
+class OrderedIndentlessDumper(ScalarAnalysisCacheMixin, yaml.SafeDumper):
     pass
 
 
-class OrderedDumper(yaml.SafeDumper):
+class OrderedDumper(ScalarAnalysisCacheMixin, yaml.SafeDumper):
     def increase_indent(self, flow=False, indentless=False):
         return super(OrderedDumper, self).increase_indent(flow, False)
 
@@ -42,33 +130,79 @@ yaml_value_annotation_re = re.compile(r"^__yq_(?P<type>tag|style)_(?P<key>.+)__$
 yaml_item_annotation_re = re.compile(r"^__yq_(?P<type>tag|style)_(?P<key>\d+)_(?P<value>.+)__$")
 
 
+def split_mapping_annotations(data, use_annotations):
+    """
+    Returns the key-value pairs of data without the yq annotation keys, and the styles, tags and comments that the
+    annotations assign to values, by hashed key.
+    """
+    pairs, custom_styles, custom_tags = [], {}, {}
+    custom_comments: Dict[str, Dict[str, List[str]]] = {}
+    for k, v in data.items():
+        if use_annotations and isinstance(k, str):
+            if k == "__yq_alias__":
+                continue
+            comment_annotation = yaml_value_comment_annotation_re.match(k)
+            if comment_annotation:
+                comment_key = comment_annotation.group("key")
+                placement = comment_annotation.group("placement")
+                custom_comments.setdefault(comment_key, {}).setdefault(placement, []).extend(
+                    normalize_comment_values(v)
+                )
+                continue
+            value_annotation = yaml_value_annotation_re.match(k)
+            if value_annotation and value_annotation.group("type") == "style":
+                custom_styles[value_annotation.group("key")] = v
+                continue
+            elif value_annotation and value_annotation.group("type") == "tag":
+                custom_tags[value_annotation.group("key")] = v
+                continue
+        pairs.append((k, v))
+    return pairs, custom_styles, custom_tags, custom_comments
+
+
+def split_sequence_annotations(data, use_annotations):
+    """
+    Returns the items of data without the yq annotation items, and the styles, tags and comments that the annotations
+    assign to items, by index.
+    """
+    raw_list, custom_styles, custom_tags = [], {}, {}
+    custom_comments: Dict[str, Dict[str, List[str]]] = {}
+    for v in data:
+        if use_annotations and isinstance(v, str):
+            comment_annotation = yaml_item_comment_annotation_re.match(v)
+            if comment_annotation:
+                comment_key = comment_annotation.group("key")
+                placement = comment_annotation.group("placement")
+                comment = decode_comment(comment_annotation.group("value"))
+                custom_comments.setdefault(comment_key, {}).setdefault(placement, []).append(comment)
+                continue
+            annotation = yaml_item_annotation_re.match(v)
+            if annotation and annotation.group("type") == "style":
+                custom_styles[annotation.group("key")] = annotation.group("value")
+                continue
+            elif annotation and annotation.group("type") == "tag":
+                custom_tags[annotation.group("key")] = annotation.group("value")
+                continue
+        raw_list.append(v)
+    return raw_list, custom_styles, custom_tags, custom_comments
+
+
+def apply_annotations(node, key, custom_styles, custom_tags):
+    if key in custom_styles:
+        if isinstance(node, yaml.nodes.ScalarNode):
+            node.style = custom_styles[key]
+        elif custom_styles[key] == "flow":
+            node.flow_style = True
+    if key in custom_tags:
+        node.tag = custom_tags[key]
+
+
 def get_dumper(use_annotations=False, indentless=False, grammar_version="1.1"):
     # if not (use_annotations or indentless):
     #     return default_dumper
 
     def represent_dict(dumper, data):
-        pairs, custom_styles, custom_tags = [], {}, {}
-        custom_comments: Dict[str, Dict[str, List[str]]] = {}
-        for k, v in data.items():
-            if use_annotations and isinstance(k, str):
-                if k == "__yq_alias__":
-                    continue
-                comment_annotation = yaml_value_comment_annotation_re.match(k)
-                if comment_annotation:
-                    comment_key = comment_annotation.group("key")
-                    placement = comment_annotation.group("placement")
-                    custom_comments.setdefault(comment_key, {}).setdefault(placement, []).extend(
-                        normalize_comment_values(v)
-                    )
-                    continue
-                value_annotation = yaml_value_annotation_re.match(k)
-                if value_annotation and value_annotation.group("type") == "style":
-                    custom_styles[value_annotation.group("key")] = v
-                    continue
-                elif value_annotation and value_annotation.group("type") == "tag":
-                    custom_tags[value_annotation.group("key")] = v
-                    continue
-            pairs.append((k, v))
+        pairs, custom_styles, custom_tags, custom_comments = split_mapping_annotations(data, use_annotations)
         mapping = dumper.represent_mapping("tag:yaml.org,2002:map", pairs)
         if use_annotations:
             for k, v in mapping.value:
@@ -78,35 +212,11 @@ def get_dumper(use_annotations=False, indentless=False, grammar_version="1.1"):
                     k.yaml_comment_before = comments["before"]
                 if "inline" in comments:
                     v.yaml_comment_inline = comments["inline"]
-                if hashed_key in custom_styles:
-                    if isinstance(v, yaml.nodes.ScalarNode):
-                        v.style = custom_styles[hashed_key]
-                    elif custom_styles[hashed_key] == "flow":
-                        v.flow_style = True
-                if hashed_key in custom_tags:
-                    v.tag = custom_tags[hashed_key]
+                apply_annotations(v, hashed_key, custom_styles, custom_tags)
         return mapping
 
     def represent_list(dumper, data):
-        raw_list, custom_styles, custom_tags = [], {}, {}
-        custom_comments: Dict[str, Dict[str, List[str]]] = {}
-        for v in data:
-            if use_annotations and isinstance(v, str):
-                comment_annotation = yaml_item_comment_annotation_re.match(v)
-                if comment_annotation:
-                    comment_key = comment_annotation.group("key")
-                    placement = comment_annotation.group("placement")
-                    comment = decode_comment(comment_annotation.group("value"))
-                    custom_comments.setdefault(comment_key, {}).setdefault(placement, []).append(comment)
-                    continue
-                annotation = yaml_item_annotation_re.match(v)
-                if annotation and annotation.group("type") == "style":
-                    custom_styles[annotation.group("key")] = annotation.group("value")
-                    continue
-                elif annotation and annotation.group("type") == "tag":
-                    custom_tags[annotation.group("key")] = annotation.group("value")
-                    continue
-            raw_list.append(v)
+        raw_list, custom_styles, custom_tags, custom_comments = split_sequence_annotations(data, use_annotations)
         sequence = dumper.represent_list(raw_list)
         if use_annotations:
             for i, v in enumerate(sequence.value):
@@ -116,13 +226,7 @@ def get_dumper(use_annotations=False, indentless=False, grammar_version="1.1"):
                     v.yaml_comment_before = comments["before"]
                 if "inline" in comments:
                     v.yaml_comment_inline = comments["inline"]
-                if item_key in custom_styles:
-                    if isinstance(v, yaml.nodes.ScalarNode):
-                        v.style = custom_styles[item_key]
-                    elif custom_styles[item_key] == "flow":
-                        v.flow_style = True
-                if item_key in custom_tags:
-                    v.tag = custom_tags[item_key]
+                apply_annotations(v, item_key, custom_styles, custom_tags)
         return sequence
 
     dumper: Any
@@ -134,3 +238,131 @@ def get_dumper(use_annotations=False, indentless=False, grammar_version="1.1"):
     dumper.add_representer(list, represent_list)
     set_yaml_grammar(dumper, grammar_version=grammar_version)
     return dumper
+
+
+def emit_value(dumper, data, use_annotations, style=None, tag=None, comments_before=None, comments_inline=None):
+    """
+    Emits the events for data, as dumper.serialize_node would for the node that dumper.represent_data builds for it.
+    Dicts and lists are walked directly, with run() so that documents of any nesting depth can be emitted; other values
+    are represented as a node and serialized one at a time. style, tag and the comments come from the annotations of
+    the enclosing collection, and are applied to the first event.
+    """
+    if isinstance(data, (dict, list)):
+        run(emit_collection(dumper, data, use_annotations, style, tag, comments_before, comments_inline))
+    else:
+        emit_represented(dumper, data, style, tag, comments_before, comments_inline)
+
+
+def emit_collection(dumper, data, use_annotations, style, tag, comments_before, comments_inline):
+    if isinstance(data, dict):
+        pairs, custom_styles, custom_tags, custom_comments = split_mapping_annotations(data, use_annotations)
+        tag = tag or "tag:yaml.org,2002:map"
+        implicit = tag == dumper.resolve(yaml.MappingNode, pairs, True)
+        flow_style = style == "flow" or collection_flow_style(dumper, (v for k, v in pairs))
+        event = yaml.MappingStartEvent(None, tag, implicit, flow_style=flow_style)
+        set_comments(event, comments_before, comments_inline)
+        dumper.emit(event)
+        for k, v in pairs:
+            key_node = dumper.represent_data(k)
+            hashed_key = hash_key(key_node.value) if use_annotations else None
+            comments = custom_comments.get(hashed_key, {}) if use_annotations else {}
+            emit_node(dumper, key_node, comments.get("before"), None)
+            value_style, value_tag = custom_styles.get(hashed_key), custom_tags.get(hashed_key)
+            if isinstance(v, (dict, list)):
+                yield emit_collection(dumper, v, use_annotations, value_style, value_tag, None, comments.get("inline"))
+            else:
+                emit_represented(dumper, v, value_style, value_tag, None, comments.get("inline"))
+        dumper.emit(yaml.MappingEndEvent())
+    else:
+        raw_list, custom_styles, custom_tags, custom_comments = split_sequence_annotations(data, use_annotations)
+        tag = tag or "tag:yaml.org,2002:seq"
+        implicit = tag == dumper.resolve(yaml.SequenceNode, raw_list, True)
+        flow_style = style == "flow" or collection_flow_style(dumper, raw_list)
+        event = yaml.SequenceStartEvent(None, tag, implicit, flow_style=flow_style)
+        set_comments(event, comments_before, comments_inline)
+        dumper.emit(event)
+        for i, v in enumerate(raw_list):
+            item_key = str(i)
+            comments = custom_comments.get(item_key, {})
+            item_style, item_tag = custom_styles.get(item_key), custom_tags.get(item_key)
+            if isinstance(v, (dict, list)):
+                yield emit_collection(
+                    dumper, v, use_annotations, item_style, item_tag, comments.get("before"), comments.get("inline")
+                )
+            else:
+                emit_represented(dumper, v, item_style, item_tag, comments.get("before"), comments.get("inline"))
+        dumper.emit(yaml.SequenceEndEvent())
+
+
+def emit_represented(dumper, data, style, tag, comments_before, comments_inline):
+    node = dumper.represent_data(data)
+    if isinstance(node, yaml.ScalarNode):
+        if style is not None:
+            node.style = style
+    elif style == "flow":
+        node.flow_style = True
+    if tag is not None:
+        node.tag = tag
+    emit_node(dumper, node, comments_before, comments_inline)
+
+
+def collection_flow_style(dumper, values):
+    # Mirrors the choice made by SafeRepresenter.represent_sequence and represent_mapping
+    if dumper.default_flow_style is not None:
+        return dumper.default_flow_style
+    return not any(isinstance(v, (dict, list)) for v in values)
+
+
+def set_comments(event, comments_before, comments_inline):
+    if comments_before:
+        event.yaml_comment_before = comments_before
+    if comments_inline:
+        event.yaml_comment_inline = comments_inline
+
+
+def emit_node(dumper, node, comments_before, comments_inline):
+    if isinstance(node, yaml.ScalarNode):
+        implicit = (
+            node.tag == dumper.resolve(yaml.ScalarNode, node.value, (True, False)),
+            node.tag == dumper.resolve(yaml.ScalarNode, node.value, (False, True)),
+        )
+        event = yaml.ScalarEvent(None, node.tag, implicit, node.value, style=node.style)
+        set_comments(event, comments_before, comments_inline)
+        dumper.emit(event)
+        return
+    # Nodes for other types (from custom representers) go through the regular serializer
+    node.yaml_comment_before, node.yaml_comment_inline = comments_before, comments_inline
+    dumper.serialized_nodes, dumper.anchors = {}, {}
+    dumper.anchor_node(node)
+    dumper.serialize_node(node, None, None)
+    dumper.represented_objects, dumper.object_keeper, dumper.alias_key = {}, [], None
+
+
+def dump_all(documents, stream, Dumper, use_annotations=False, first_document=True, end_stream=True, **kwds):
+    """
+    Writes documents to stream with the same output as ``yaml.dump_all(documents, stream, Dumper=Dumper, **kwds)``
+    for the dumpers returned by :func:`get_dumper`, but emits the events for each document while walking it, applying
+    annotations on the fly, instead of representing the whole document as a node graph first. Memory use is
+    proportional to the nesting depth of the documents rather than to their size.
+
+    With first_document=False, the output continues a stream that already has documents, and with end_stream=False, the
+    stream is left open for more documents, so that a stream can be written in separately dumped parts.
+    """
+    dumper = Dumper(stream, **kwds)
+    try:
+        dumper.open()
+        if not first_document:
+            # Start the next document with "---", as the emitter does after the first one
+            dumper.state = dumper.expect_document_start
+        for document in documents:
+            dumper.emit(
+                yaml.DocumentStartEvent(
+                    explicit=dumper.use_explicit_start, version=dumper.use_version, tags=dumper.use_tags
+                )
+            )
+            emit_value(dumper, document, use_annotations)
+            dumper.emit(yaml.DocumentEndEvent(explicit=dumper.use_explicit_end))
+        if end_stream:
+            dumper.close()
+    finally:
+        dumper.dispose()
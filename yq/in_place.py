@@ -0,0 +1,48 @@
+import filecmp
+import os
+import tempfile
+from typing import Optional
+
+
+class InPlaceWriter:
+    """
+    Collects the new contents of a file edited with -i/--in-place in a temporary file in the same directory. commit()
+    atomically renames it over the original, keeping the original's permissions, unless the contents are unchanged, in
+    which case the original is left untouched.
+    """
+
+    def __init__(self, path):
+        # Replace the target of a symlink, not the symlink itself
+        self.path = os.path.realpath(path)
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".yq", dir=os.path.dirname(self.path))
+        self.temp_path: Optional[str] = temp_path
+        self.temp_file = open(fd, "w")
+
+    def commit(self):
+        """
+        Returns True if the file was replaced, and False if its contents were unchanged.
+        """
+        self.temp_file.close()
+        assert self.temp_path is not None
+        if filecmp.cmp(self.temp_path, self.path, shallow=False):
+            self.discard()
+            return False
+        file_stat = os.stat(self.path)
+        os.chmod(self.temp_path, file_stat.st_mode)
+        try:
+            os.chown(self.temp_path, file_stat.st_uid, file_stat.st_gid)
+        except OSError:
+            pass
+        os.replace(self.temp_path, self.path)
+        self.temp_path = None
+        return True
+
+    def discard(self):
+        if self.temp_path is None:
+            return
+        self.temp_file.close()
+        try:
+            os.remove(self.temp_path)
+        except FileNotFoundError:
+            pass
+        self.temp_path = None
@@ -0,0 +1,136 @@
+"""
+Directory inputs: yq, xq and tomlq accept directories, which are searched recursively for input files. Each file is
+parsed according to its extension, in a pool of worker processes, and the results are sent to a single jq process in
+traversal order.
+"""
+
+import fnmatch
+import io
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+extension_formats = {".yaml": "yaml", ".yml": "yaml", ".json": "yaml", ".toml": "toml", ".xml": "xml"}
+# Number of files each worker process parses at a time
+files_per_task = 16
+# Number of tasks submitted to each worker process ahead of the files being yielded
+tasks_per_worker = 2
+
+
+class InputFileError(Exception):
+    pass
+
+
+class InputDirectory:
+    """
+    A directory given as an input. It takes the place of a stream in the input_streams of :func:`yq.yq`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def close(self):
+        pass
+
+    def files(self, input_format, include=(), exclude=()):
+        """
+        Yields the path and input format of each file in the directory and its subdirectories, in sorted order. Files
+        and directories matching an exclude pattern are skipped. If include patterns are given, the files matching
+        one of them are selected, and their format is chosen by extension (falling back to input_format); otherwise,
+        the files whose extension is one of input_format's are selected.
+        """
+        for dir_path, dir_names, file_names in os.walk(self.name):
+            dir_names[:] = sorted(name for name in dir_names if not matches(os.path.join(dir_path, name), exclude))
+            for file_name in sorted(file_names):
+                path = os.path.join(dir_path, file_name)
+                if matches(path, exclude):
+                    continue
+                file_format = extension_formats.get(os.path.splitext(file_name)[1].lower())
+                if include:
+                    if matches(path, include):
+                        yield path, file_format or input_format
+                elif file_format == input_format:
+                    yield path, file_format
+
+
+def matches(path, patterns):
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+
+def raise_input_file_error(arg=None):
+    if arg:
+        raise InputFileError(arg)
+
+
+def encode_input_file(task):
+    from . import encode_docs
+
+    path, input_format, encode_args = task
+    json_buffer = io.StringIO()
+    try:
+        with open(path) as input_stream:
+            encode_docs(
+                [input_stream], json_buffer, input_format=input_format, exit_func=raise_input_file_error, **encode_args
+            )
+    except InputFileError:
+        raise
+    except Exception as e:
+        msg = "{}: Error parsing {}: {}: {}"
+        raise InputFileError(msg.format(encode_args.get("program_name", "yq"), path, type(e).__name__, e))
+    return path, json_buffer.getvalue()
+
+
+def encode_input_files(tasks):
+    return [encode_input_file(task) for task in tasks]
+
+
+def encode_directory(directory, input_format, include, exclude, encode_args):
+    """
+    Yields the path of each input file in the directory, and its documents encoded as JSON lines.
+    """
+    files = directory.files(input_format, include, exclude)
+    tasks = ((path, file_format, encode_args) for path, file_format in files)
+    chunks = iter(lambda: list(islice(tasks, files_per_task)), [])
+    with ProcessPoolExecutor() as executor:
+        # Files are submitted as they are found, so workers start parsing while the traversal continues, but only a
+        # bounded number of tasks are submitted ahead of the files being yielded
+        window = tasks_per_worker * (os.cpu_count() or 1)
+        pending = deque(executor.submit(encode_input_files, chunk) for chunk in islice(chunks, window))
+        try:
+            while pending:
+                results = pending.popleft().result()
+                pending.extend(executor.submit(encode_input_files, chunk) for chunk in islice(chunks, 1))
+                yield from results
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class FilenameTagger:
+    """
+    Wraps each line written to it (one JSON document) as ``{"filename": name, "document": ...}``.
+    """
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.prefix = '{{"filename":{},"document":'.format(json.dumps(name))
+        self.at_line_start = True
+
+    def write(self, data):
+        lines = data.split("\n")
+        for i, line in enumerate(lines):
+            if i > 0:
+                self.stream.write("}\n")
+                self.at_line_start = True
+            if line:
+                if self.at_line_start:
+                    self.stream.write(self.prefix)
+                    self.at_line_start = False
+                self.stream.write(line)
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
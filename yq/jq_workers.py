@@ -0,0 +1,144 @@
+"""
+Sharded jq execution for --jq-workers: the documents sent to jq are split into contiguous shards of about the same
+size, each shard is filtered by its own jq process, and the outputs of the shards are joined in order. For filters that
+handle each input document on its own, this gives the same output as a single jq process.
+"""
+
+import os
+import re
+import stat
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+from .prune import find_filter, safe_options_with_values, unsafe_builtins_re
+
+# Builtins that stop jq, which would only stop the jq process of one shard
+halt_builtins_re = re.compile(r"\b(?:halt|halt_error)\b")
+# The input line given in jq's error messages, which counts from the start of the shard
+error_line_re = re.compile(r"^(jq: error \(at <stdin>:)(\d+)\)", re.MULTILINE)
+
+
+def sharding_error(jq_args):
+    """
+    Returns the reason why jq_args cannot be applied to shards of the input separately, or None if they can.
+    """
+    filter_index = find_filter(jq_args)
+    if filter_index is None:
+        return "jq options that change how inputs are read (such as -s, -n or -f)"
+    i = 0
+    while i < len(jq_args):
+        arg = jq_args[i]
+        if i == filter_index:
+            pass
+        elif arg == "--exit-status" or (arg.startswith("-") and not arg.startswith("--") and "e" in arg):
+            # The exit status depends on the last output, which only the last shard with output knows
+            return "-e/--exit-status"
+        elif arg in ("--slurpfile", "--rawfile") and not is_rereadable(jq_args[i + 2]):
+            # Only one of the jq processes would read the contents of a pipe
+            return "--slurpfile or --rawfile reading from a pipe or process substitution"
+        i += safe_options_with_values.get(arg, 0) + 1
+    jq_filter = jq_args[filter_index]
+    if unsafe_builtins_re.search(jq_filter) or halt_builtins_re.search(jq_filter):
+        return "filters that use input, inputs, input_line_number, $__loc__, halt or halt_error"
+    return None
+
+
+def is_rereadable(path):
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except OSError:
+        # Every jq process reports the same error
+        return True
+
+
+def color_jq_args(jq_args, output_stream):
+    """
+    Returns jq_args with -C added if jq would color its output when writing to output_stream directly, since jq
+    processes whose output is collected by yq do not write to a terminal.
+    """
+    for arg in jq_args:
+        if arg in ("--color-output", "--monochrome-output") or (
+            arg.startswith("-") and not arg.startswith("--") and ("C" in arg or "M" in arg)
+        ):
+            return jq_args
+    if os.environ.get("NO_COLOR") or not output_stream.isatty():
+        return jq_args
+    return ["-C"] + list(jq_args)
+
+
+def offset_error_lines(jq_err, lines):
+    """
+    Adds lines to the input line numbers in the error messages of a shard, so that they count from the start of the
+    whole input.
+    """
+    if not lines:
+        return jq_err
+    return error_line_re.sub(lambda match: "{}{})".format(match.group(1), int(match.group(2)) + lines), jq_err)
+
+
+def split_shards(text, count):
+    """
+    Splits text, one JSON document per line, into count parts of about the same size that end at line boundaries.
+    """
+    shards, start = [], 0
+    for i in range(1, count):
+        end = text.find("\n", max(start, len(text) * i // count - 1)) + 1 or len(text)
+        shards.append(text[start:end])
+        start = end
+    shards.append(text[start:])
+    return shards
+
+
+class ShardedJQ:
+    """
+    Runs jq with jq_args in workers processes. Like subprocess.Popen, it has communicate(), kill() and returncode.
+    communicate() returns the output of the shards joined in order, and writes their error output to stderr in the
+    same order, with input line numbers counted from the start of the whole input. If output_stream is given, the
+    output of each shard is written to it after the error output of the shard instead, so that the two are interleaved
+    in shard order like the output of a single jq process (though within a shard, all errors come first).
+    """
+
+    def __init__(self, jq_args, workers, **popen_args):
+        self.processes: List[subprocess.Popen] = []
+        self.returncode: Any = None
+        try:
+            for _ in range(workers):
+                self.processes.append(
+                    subprocess.Popen(
+                        ["jq"] + list(jq_args),
+                        stdin=subprocess.PIPE,
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        universal_newlines=True,
+                        **popen_args,
+                    )
+                )
+        except OSError:
+            self.kill()
+            raise
+
+    def communicate(self, jq_in, output_stream=None):
+        shards = split_shards(jq_in, len(self.processes))
+        with ThreadPoolExecutor(len(self.processes)) as executor:
+            results = list(executor.map(lambda process, shard: process.communicate(shard), self.processes, shards))
+        lines = 0
+        for shard, (jq_out, jq_err) in zip(shards, results):
+            if jq_err:
+                if output_stream:
+                    output_stream.flush()
+                sys.stderr.write(offset_error_lines(jq_err, lines))
+                sys.stderr.flush()
+            if output_stream:
+                output_stream.write(jq_out)
+            lines += shard.count("\n")
+        # Like a single jq process, exit with the status of the last input (5 if it raised an error), unless a shard
+        # failed for another reason
+        returncodes = [process.returncode for process, shard in zip(self.processes, shards) if shard] or [0]
+        self.returncode = next((code for code in returncodes if code not in (0, 5)), returncodes[-1])
+        return "" if output_stream else "".join(jq_out for jq_out, _ in results), None
+
+    def kill(self):
+        for process in self.processes:
+            process.kill()
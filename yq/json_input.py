@@ -0,0 +1,204 @@
+"""
+JSON fast path: YAML inputs that are really JSON are decoded with the json module's C decoder instead of the YAML
+scanner. This gives the same documents, since JSON strings are always quoted and so never resolve to timestamps or
+other YAML types, and JSON has no aliases or merge keys.
+
+The input is read a line at a time, and each document is passed on as soon as it is decoded, so that a stream of JSON
+documents is converted as it arrives, like a YAML stream. Documents must be separated by whitespace.
+"""
+
+import json
+import re
+
+from .convert import surrogate_re
+
+json_whitespace = " \t\n\r"
+json_non_whitespace_re = re.compile(r"[^ \t\n\r]")
+# Escapes of UTF-16 surrogates, which the json module decodes whether or not they are paired
+surrogate_escape_re = re.compile(r"\\u[dD][89abcdefABCDEF]")
+# A YAML document start or end marker, which must follow a document in a YAML stream before the next one
+document_marker_re = re.compile(r"[ \t\r\n]*\n(?:---|\.\.\.)(?:[ \t\r\n]|$)")
+# Number of characters read at a time while looking for the first non-whitespace character
+sniff_chunk_size = 4096
+# Documents longer than this are read in chunks rather than a line at a time
+large_document_size = 65536
+# A line that may end a pretty-printed document: an unindented closing bracket not followed by a comma, searched
+# for from the preceding line break
+closing_line_re = re.compile(r"\n[\]}](?:[^\n]*[^,\s])?[ \t\r]*(?:\n|$)")
+
+
+class PrefixedStream:
+    """
+    A read-only text stream that returns prefix before the rest of stream.
+    """
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.stream.read(), ""
+        else:
+            data, self.prefix = self.prefix[:size], self.prefix[size:]
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def read_json_input(stream, sniff=True):
+    """
+    Returns the stream to read YAML from, and the input read from it so far if it may be JSON (or None). With sniff,
+    only inputs whose first non-whitespace character starts a JSON object or array may be JSON.
+    """
+    if not sniff:
+        return stream, ""
+    prefix = ""
+    while True:
+        chunk = stream.read(sniff_chunk_size)
+        prefix += chunk
+        content = prefix.lstrip(json_whitespace)
+        if content or not chunk:
+            break
+    if content[:1] in ("{", "["):
+        return stream, prefix
+    return PrefixedStream(prefix, stream), None
+
+
+def reject_constant(name):
+    raise ValueError("{} is not valid JSON".format(name))
+
+
+# The json module accepts NaN, Infinity and -Infinity as numbers, which the YAML loader reads as strings
+strict_json_decoder = json.JSONDecoder(parse_constant=reject_constant)
+
+
+def has_unpaired_surrogate(doc):
+    stack = [doc]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            if surrogate_re.search(value):
+                return True
+        elif isinstance(value, dict):
+            stack.extend(value)
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return False
+
+
+class JSONDocumentReader:
+    """
+    Iterates over the documents of a sequence of JSON values separated by whitespace, read from stream after prefix.
+    Raises json.JSONDecodeError (a ValueError), giving the position in the whole input, or RecursionError if a
+    document cannot be decoded; rest() then returns the input from the end of the last decoded document, and
+    continues_as_yaml() tells whether it could be parsed as YAML.
+
+    Since a JSON document cannot have a line break within a string or number, the input is only decoded up to the end
+    of a line, and a decoding error before the last non-whitespace character read means that the input is not JSON.
+    """
+
+    def __init__(self, stream, prefix="", json_decoder=strict_json_decoder):
+        self.stream = stream
+        self.decoder = json_decoder
+        # The sniffed prefix is completed to the end of its line
+        self.buffer = prefix + stream.readline() if prefix and not prefix.endswith("\n") else prefix
+        self.pos = 0
+        self.eof = False
+        # Number of characters and line breaks dropped from the start of the buffer, and position of the last line
+        self.offset, self.lines, self.line_start = 0, 0, 0
+
+    def __iter__(self):
+        while True:
+            match = json_non_whitespace_re.search(self.buffer, self.pos)
+            if match is None:
+                if self.eof:
+                    return
+                self.read_lines()
+                continue
+            doc, self.pos = self.decode(match.start())
+            yield doc
+
+    def consumed(self):
+        """
+        Returns the number of characters of input up to the end of the last decoded document.
+        """
+        return self.offset + self.pos
+
+    def rest(self):
+        return PrefixedStream(self.buffer[self.pos :], self.stream)
+
+    def continues_as_yaml(self):
+        """
+        Returns True if no document was decoded, or if the rest of the input starts with a YAML document marker (as
+        in JSON documents separated by ``---``). Otherwise, the input is neither JSON nor YAML.
+        """
+        return self.consumed() == 0 or document_marker_re.match(self.buffer, self.pos) is not None
+
+    def read_lines(self, min_size=0):
+        """
+        Drops the decoded documents from the buffer, and appends lines of input until min_size characters or a line
+        that may end a pretty-printed document have been read.
+        """
+        dropped = self.buffer[: self.pos]
+        last_break = dropped.rfind("\n")
+        if last_break >= 0:
+            self.lines += dropped.count("\n")
+            self.line_start = self.offset + last_break + 1
+        self.offset += self.pos
+        lines, size = [self.buffer[self.pos :]], 0
+        if len(lines[0]) < large_document_size:
+            while True:
+                line = self.stream.readline()
+                if not line:
+                    self.eof = True
+                    break
+                lines.append(line)
+                size += len(line)
+                if size >= min_size or (line[0] in "]}" and closing_line_re.match("\n" + line)):
+                    break
+        else:
+            # The rest of a large document is read in chunks, each completed to the end of its line
+            while not self.eof and size < min_size:
+                chunk = self.stream.read(large_document_size)
+                if not chunk.endswith("\n"):
+                    chunk += self.stream.readline()
+                    self.eof = not chunk.endswith("\n")
+                lines.append(chunk)
+                size += len(chunk)
+                if closing_line_re.search("\n" + chunk):
+                    break
+        self.buffer, self.pos = "".join(lines), 0
+
+    def decode(self, start):
+        while True:
+            try:
+                doc, end = self.decoder.raw_decode(self.buffer, start)
+            except json.JSONDecodeError as e:
+                if self.eof or json_non_whitespace_re.search(self.buffer, e.pos):
+                    raise self.error(e.msg, e.pos)
+            else:
+                if end < len(self.buffer) and self.buffer[end] not in json_whitespace:
+                    raise self.error("Extra data", end)
+                if surrogate_escape_re.search(self.buffer, start, end) and has_unpaired_surrogate(doc):
+                    # The YAML loader rejects these, and jq cannot read them back
+                    raise self.error("Unpaired surrogate escape", start)
+                return doc, end
+            # The document continues on later lines; read up to its end if it is pretty-printed, or three times as much
+            # again, so that a long document is decoded a number of times logarithmic in its size
+            start -= self.pos
+            self.read_lines(min_size=max(3 * (len(self.buffer) - self.pos), large_document_size))
+
+    def error(self, msg, pos):
+        # json.JSONDecodeError computes the line and column from the whole input, which is no longer in the buffer
+        last_break = self.buffer.rfind("\n", 0, pos)
+        line_start = self.offset + last_break + 1 if last_break >= 0 else self.line_start
+        lineno = self.lines + self.buffer.count("\n", 0, pos) + 1
+        error = json.JSONDecodeError(msg, "", 0)
+        error.pos, error.lineno, error.colno = self.offset + pos, lineno, self.offset + pos - line_start + 1
+        error.args = ("{}: line {} column {} (char {})".format(msg, error.lineno, error.colno, error.pos),)
+        return error
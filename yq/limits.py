@@ -0,0 +1,100 @@
+import re
+import sys
+import threading
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+size_suffixes = {"": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+
+# tracemalloc is process-wide; it is started by the first memory limit applied and stopped by the last one released
+tracing_lock = threading.Lock()
+tracing_limits = 0
+started_tracing = False
+
+
+def parse_size(value):
+    match = re.match(r"^\s*(\d+)\s*([kmgt]?)i?b?\s*$", value, re.IGNORECASE)
+    if not match:
+        raise ValueError("invalid size: {!r} (use a number of bytes with an optional K/M/G/T suffix)".format(value))
+    return int(match.group(1)) * size_suffixes[match.group(2).lower()]
+
+
+def peak_rss(who="self"):
+    """
+    Returns the peak resident set size of this process (who="self") or of its waited-for children (who="children") in
+    bytes, or None if it cannot be determined.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class MemoryLimit:
+    """
+    Limits the memory used by a yq call to max_memory bytes on each side of the pipe. In this process, the Python
+    allocations made while the limit is applied are traced with tracemalloc, and check() (called by the streams returned
+    by writer() on each write) raises MemoryError once they exceed max_memory; allocations made by other threads at the
+    same time count too, but unlike a lower RLIMIT_AS, the limit does not make them fail. Each jq process started is
+    capped at max_memory of address space with prlimit, so that no preexec_fn has to run in the forked child.
+    """
+
+    def __init__(self, max_memory):
+        if resource is None or not hasattr(resource, "prlimit") or not hasattr(resource, "RLIMIT_AS"):
+            raise Exception("--max-memory is not supported on this platform")
+        self.max_memory = max_memory
+        self.baseline = None
+
+    def apply(self):
+        global tracing_limits, started_tracing
+        with tracing_lock:
+            if not tracing_limits and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                started_tracing = True
+            tracing_limits += 1
+        self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def release(self):
+        global tracing_limits, started_tracing
+        if self.baseline is None:
+            return
+        self.baseline = None
+        with tracing_lock:
+            tracing_limits -= 1
+            if not tracing_limits and started_tracing:
+                tracemalloc.stop()
+                started_tracing = False
+
+    def check(self):
+        if self.baseline is not None and tracemalloc.get_traced_memory()[0] - self.baseline > self.max_memory:
+            raise MemoryError()
+
+    def writer(self, stream):
+        return LimitedWriter(stream, self)
+
+    def limit_child(self, pid):
+        try:
+            soft, hard = resource.prlimit(pid, resource.RLIMIT_AS)
+            limit = self.max_memory if hard == resource.RLIM_INFINITY else min(self.max_memory, hard)
+            resource.prlimit(pid, resource.RLIMIT_AS, (limit, hard))
+        except ProcessLookupError:
+            # The process already exited
+            pass
+
+
+class LimitedWriter:
+    def __init__(self, stream, memory_limit):
+        self.stream = stream
+        self.memory_limit = memory_limit
+
+    def write(self, data):
+        self.memory_limit.check()
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
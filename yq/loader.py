@@ -1,7 +1,9 @@
 import re
+import weakref
 from base64 import b64encode
+from functools import lru_cache
 from hashlib import sha224
-from typing import Any, Dict, List, Pattern, TypedDict
+from typing import Any, Dict, List, Optional, Pattern, TypedDict
 
 import yaml
 from yaml.tokens import (
@@ -14,16 +16,81 @@ from yaml.tokens import (
     ValueToken,
 )
 
+from .stream import merge_tag
+from .trampoline import run
 from .yaml_support import (
     COMMENT_PLACEMENT_BEFORE,
     COMMENT_PLACEMENT_INLINE,
     CommentPreservingLoader,
+    IterativeComposerMixin,
     consume_comments_for_node,
     make_mapping_comment_key,
     make_sequence_comment_annotation,
+    yaml_value_comment_annotation_re,
 )
 
 default_loader: Any = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+value_tag = "tag:yaml.org,2002:value"
+str_tag = "tag:yaml.org,2002:str"
+collection_tags = (yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG, yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG)
+# Pairs of merged mappings without their comment annotations, by node
+merged_items_cache: "weakref.WeakKeyDictionary[yaml.Node, list]" = weakref.WeakKeyDictionary()
+
+
+def merged_pairs(loader, node, use_annotations):
+    """
+    Returns the key-value pairs merged into a mapping node by its merge keys (``<<``), in the order used by
+    SafeConstructor.flatten_mapping, so that explicit keys override merged ones and earlier mappings in a list override
+    later ones. The pairs are taken from the constructed dict of each merged mapping, which the loader caches per node,
+    so a mapping merged into many others is flattened and annotated only once.
+    """
+    pairs = []
+    for key_node, value_node in node.value:
+        if key_node.tag != merge_tag:
+            continue
+        if isinstance(value_node, yaml.MappingNode):
+            submappings = [value_node]
+        elif isinstance(value_node, yaml.SequenceNode):
+            for subnode in value_node.value:
+                if not isinstance(subnode, yaml.MappingNode):
+                    raise yaml.constructor.ConstructorError(
+                        "while constructing a mapping",
+                        node.start_mark,
+                        "expected a mapping for merging, but found %s" % subnode.id,
+                        subnode.start_mark,
+                    )
+            submappings = list(reversed(value_node.value))
+        else:
+            raise yaml.constructor.ConstructorError(
+                "while constructing a mapping",
+                node.start_mark,
+                "expected a mapping or list of mappings for merging, but found %s" % value_node.id,
+                value_node.start_mark,
+            )
+        for subnode in submappings:
+            if subnode not in loader.constructed_objects:
+                pairs.extend(loader.construct_object(subnode).items())
+                continue
+            loader.has_aliases = True
+            if not use_annotations:
+                pairs.extend(loader.construct_object(subnode).items())
+                continue
+            # Comments stay where they were first consumed, not on every mapping the pairs are merged into
+            if subnode not in merged_items_cache:
+                merged_items_cache[subnode] = [
+                    (key, value)
+                    for key, value in loader.construct_object(subnode).items()
+                    if not (isinstance(key, str) and yaml_value_comment_annotation_re.match(key))
+                ]
+            pairs.extend(merged_items_cache[subnode])
+    return pairs
+
+
+def is_alias(loader, node):
+    """
+    Returns True if node is a collection that has already been constructed, so that its value is shared.
+    """
+    return node in loader.constructed_objects and not isinstance(node, yaml.ScalarNode)
 
 
 class ResolverSpec(TypedDict):
@@ -130,6 +197,47 @@ merge_resolver: ResolverSpec = {
 }
 
 
+class ScalarClassifier:
+    """
+    Resolves the implicit tag of plain scalars with one combined regular expression per start character, trying the
+    resolvers in the same order as PyYAML would. classify_cached() memoizes the result; use it for short values, which
+    tend to repeat.
+    """
+
+    def __init__(self, resolvers: List[ResolverSpec], cache_size: int = 2**12):
+        by_start_char: Dict[str, List[ResolverSpec]] = {}
+        for r in resolvers:
+            for start_char in r["start_chars"]:
+                by_start_char.setdefault(start_char, []).append(r)
+        self.tags: Dict[Optional[str], str] = {}
+        self.patterns: Dict[str, Pattern[str]] = {}
+        for start_char, char_resolvers in by_start_char.items():
+            alternatives = []
+            for r in char_resolvers:
+                group = "r{}".format(len(self.tags))
+                self.tags[group] = r["tag"]
+                # Scope each resolver's verbose flag to its own alternative
+                flags = "x" if r["regexp"].flags & re.X else ""
+                alternatives.append("(?P<{}>(?{}:{}))".format(group, flags, r["regexp"].pattern))
+            self.patterns[start_char] = re.compile("|".join(alternatives))
+        self.classify_cached = lru_cache(maxsize=cache_size)(self.classify)
+
+    def classify(self, value):
+        pattern = self.patterns.get(value[0] if value else "")
+        if pattern is None:
+            return None
+        match = pattern.match(value)
+        return self.tags[match.lastgroup] if match else None
+
+
+@lru_cache(maxsize=None)
+def get_scalar_classifier(grammar_version="1.2", expand_merge_keys=True):
+    resolvers = list(core_resolvers[grammar_version])
+    if expand_merge_keys:
+        resolvers.append(merge_resolver)
+    return ScalarClassifier(resolvers)
+
+
 def set_yaml_grammar(resolver, grammar_version="1.2", expand_merge_keys=True):
     if grammar_version not in core_resolvers:
         raise Exception(f"Unknown grammar version {grammar_version}")
@@ -142,6 +250,19 @@ def set_yaml_grammar(resolver, grammar_version="1.2", expand_merge_keys=True):
             resolver.yaml_implicit_resolvers.setdefault(start_char, [])
             resolver.yaml_implicit_resolvers[start_char].append((r["tag"], r["regexp"]))
 
+    # Equivalent to BaseResolver.resolve with the implicit resolvers above, but with a single regexp match per value
+    classifier = get_scalar_classifier(grammar_version, expand_merge_keys)
+    classify, classify_cached, max_cached_length = classifier.classify, classifier.classify_cached, 128
+    scalar_node, base_resolve = yaml.nodes.ScalarNode, yaml.resolver.BaseResolver.resolve
+
+    def resolve(self, kind, value, implicit):
+        if kind is scalar_node and implicit[0] and not self.yaml_path_resolvers:
+            tag = classify_cached(value) if len(value) <= max_cached_length else classify(value)
+            return tag or self.DEFAULT_SCALAR_TAG
+        return base_resolve(self, kind, value, implicit)
+
+    resolver.resolve = resolve
+
 
 def construct_yaml_1_2_int(loader, node):
     value = loader.construct_scalar(node).replace("_", "")
@@ -161,7 +282,7 @@ def hash_key(key):
     return b64encode(sha224(key.encode() if isinstance(key, str) else key).digest()).decode()
 
 
-class CustomLoader(yaml.SafeLoader):
+class CustomLoader(IterativeComposerMixin, yaml.SafeLoader):
     expand_aliases = False
 
     def emit_yq_kv(self, key, value, original_token):
@@ -220,7 +341,34 @@ class CommentPreservingCustomLoader(CommentPreservingLoader):
 
 
 def get_loader(use_annotations=False, expand_aliases=True, expand_merge_keys=True):
+    # The constructors run the steps below with run(): nested collections are constructed by yielding their steps
+    # instead of calling loader.construct_object, so documents of any nesting depth can be loaded
     def construct_sequence(loader, node):
+        return run(sequence_steps(loader, node))
+
+    def construct_mapping(loader, node):
+        return run(mapping_steps(loader, node))
+
+    def is_nested(loader, node):
+        # True for the collection nodes that construct_object would pass to construct_sequence or construct_mapping
+        return (
+            isinstance(node, (yaml.nodes.SequenceNode, yaml.nodes.MappingNode))
+            and node not in loader.constructed_objects
+            and (node.tag in collection_tags or node.tag not in loader.yaml_constructors)
+        )
+
+    def construct_nested(loader, node):
+        # Same as loader.construct_object(node) for the nodes accepted by is_nested
+        if node in loader.recursive_objects:
+            raise yaml.constructor.ConstructorError(None, None, "found unconstructable recursive node", node.start_mark)
+        loader.recursive_objects[node] = None
+        steps = mapping_steps if isinstance(node, yaml.nodes.MappingNode) else sequence_steps
+        data = yield steps(loader, node)
+        loader.constructed_objects[node] = data
+        del loader.recursive_objects[node]
+        return data
+
+    def sequence_steps(loader, node):
         annotations = []
         for i, v_node in enumerate(node.value):
             if not use_annotations:
@@ -236,14 +384,32 @@ def get_loader(use_annotations=False, expand_aliases=True, expand_merge_keys=Tru
                 annotations.append("__yq_style_{}_{}__".format(i, v_node.style))
             elif isinstance(v_node, (yaml.nodes.SequenceNode, yaml.nodes.MappingNode)) and v_node.flow_style is True:
                 annotations.append("__yq_style_{}_{}__".format(i, "flow"))
-        return [loader.construct_object(i) for i in node.value] + annotations
+        data = []
+        for v_node in node.value:
+            if is_nested(loader, v_node):
+                data.append((yield construct_nested(loader, v_node)))
+                continue
+            if not loader.has_aliases and is_alias(loader, v_node):
+                loader.has_aliases = True
+            data.append(loader.construct_object(v_node))
+        return data + annotations
 
-    def construct_mapping(loader, node):
-        loader.flatten_mapping(node)  # TODO: is this needed?
-        pairs = []
+    def mapping_steps(loader, node):
+        pairs, own_pairs = merged_pairs(loader, node, use_annotations), []
         for k_node, v_node in node.value:
+            if k_node.tag == merge_tag:
+                continue
+            if k_node.tag == value_tag:
+                k_node.tag = str_tag
+            own_pairs.append((k_node, v_node))
+        for k_node, v_node in own_pairs:
             key = loader.construct_object(k_node)
-            value = loader.construct_object(v_node)
+            if is_nested(loader, v_node):
+                value = yield construct_nested(loader, v_node)
+            else:
+                if not loader.has_aliases and is_alias(loader, v_node):
+                    loader.has_aliases = True
+                value = loader.construct_object(v_node)
             pairs.append((key, value))
             if not use_annotations:
                 continue
@@ -275,6 +441,8 @@ def get_loader(use_annotations=False, expand_aliases=True, expand_merge_keys=Tru
         loader_class = CommentPreservingLoader if expand_aliases else CommentPreservingCustomLoader
     else:
         loader_class = default_loader if expand_aliases else CustomLoader
+    # Set when a document refers to a collection more than once; see AliasEncoder
+    loader_class.has_aliases = False
     loader_class.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, construct_mapping)
     loader_class.add_constructor(yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG, construct_sequence)
     loader_class.add_constructor("tag:yaml.org,2002:int", construct_yaml_1_2_int)
@@ -1,8 +1,13 @@
 import argparse
+import os
 import subprocess
 import sys
 from typing import Dict, Union
 
+from .inputs import InputDirectory
+from .limits import parse_size
+from .profile import profiling_requested
+
 try:
     from .version import version as __version__
 except ImportError:
@@ -24,6 +29,12 @@ jq_arg_spec: Dict[str, Union[int, str]] = {
 }
 
 
+def input_file_or_directory(path):
+    if path != "-" and os.path.isdir(path):
+        return InputDirectory(path)
+    return argparse.FileType()(path)
+
+
 class Parser(argparse.ArgumentParser):
     def print_help(self, *args, **kwargs):
         yq_help = argparse.ArgumentParser.format_help(self).splitlines()
@@ -49,7 +60,8 @@ class VersionAction(argparse.Action):
 def get_parser(program_name, description):
     # By default suppress these help strings and only enable them in the specific programs.
     yaml_output_help, yaml_roundtrip_help, width_help, indentless_help, grammar_help = [argparse.SUPPRESS] * 5
-    explicit_start_help, explicit_end_help = [argparse.SUPPRESS] * 2
+    explicit_start_help, explicit_end_help, yaml_stream_help, yaml_item_depth_help = [argparse.SUPPRESS] * 4
+    yaml_input_format_help = argparse.SUPPRESS
     xml_output_help, xml_item_depth_help, xml_dtd_help, xml_root_help, xml_force_list_help = [argparse.SUPPRESS] * 5
     xml_short_empty_elements_help = argparse.SUPPRESS
     toml_output_help = toml_roundtrip_help = argparse.SUPPRESS
@@ -72,6 +84,18 @@ def get_parser(program_name, description):
         )
         explicit_start_help = 'When using --yaml-output, always emit explicit document start ("---")'
         explicit_end_help = 'When using --yaml-output, always emit explicit document end ("...")'
+        yaml_stream_help = (
+            "Send each document to jq as the [path, leaf] events of jq --stream, without loading it into memory "
+            "(use fromstream(., inputs) to reassemble values)"
+        )
+        yaml_item_depth_help = (
+            "Send each node at this depth to jq as a separate document as soon as it is parsed "
+            "(default 0; use a positive integer to stream large docs)"
+        )
+        yaml_input_format_help = (
+            "Parse input as YAML, or as JSON with the faster JSON parser (the default, auto, uses the JSON parser for "
+            "input that starts with { or [ and is valid JSON)"
+        )
     elif program_name == "xq":
         current_language = "XML"
         xml_output_help = "Transcode jq JSON output back into XML and emit it"
@@ -121,6 +145,15 @@ def get_parser(program_name, description):
     parser.add_argument("--indentless-lists", "--indentless", action="store_true", help=indentless_help)
     parser.add_argument("--explicit-start", action="store_true", help=explicit_start_help)
     parser.add_argument("--explicit-end", action="store_true", help=explicit_end_help)
+    parser.add_argument("--yaml-stream", "--yml-stream", action="store_true", help=yaml_stream_help)
+    parser.add_argument("--yaml-item-depth", type=int, default=0, help=yaml_item_depth_help, metavar="123")
+    parser.add_argument(
+        "--input-format",
+        dest="yaml_input_format",
+        choices=["auto", "yaml", "json"],
+        default="auto",
+        help=yaml_input_format_help,
+    )
     parser.add_argument("--no-expand-aliases", action="store_false", dest="expand_aliases", help=argparse.SUPPRESS)
     parser.add_argument("--max-expansion-factor", type=int, default=1024, help=argparse.SUPPRESS)
     parser.add_argument(
@@ -142,7 +175,89 @@ def get_parser(program_name, description):
         const="annotated_toml",
         help=toml_roundtrip_help,
     )
-    parser.add_argument("--in-place", "-i", action="store_true", help="Edit files in place (no backup - use caution)")
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help="Convert the input to the output format without a jq filter (the same as the filter ., which may still be "
+        "given, and which does not start jq for documents that it would pass through unchanged)",
+    )
+    parser.add_argument(
+        "--in-place",
+        "-i",
+        action="store_true",
+        help="Edit files in place (no backup - use caution). Files are replaced atomically, and only if changed",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=profiling_requested(),
+        help="Print a JSON report of time spent in each processing phase to stderr (or set YQ_PROFILE=1)",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        dest="profile",
+        action="store_const",
+        const="memory",
+        help="Like --profile, but also report the peak Python allocations of each phase (or set YQ_PROFILE=memory)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=parse_size,
+        metavar="SIZE",
+        help="Abort if yq or jq allocate more than this much memory (e.g. 512M or 2G)",
+    )
+    parser.add_argument(
+        "--jq-workers",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Split the input documents between N jq processes and join their output in input order (only for "
+        "filters that handle each document on its own)",
+    )
+    parser.add_argument(
+        "--filter-to",
+        nargs=2,
+        action="append",
+        metavar=("FILTER", "FILE"),
+        help="Also apply FILTER to the same parsed input and write its output to FILE (can be repeated)",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        default=os.environ.get("YQ_CACHE_DIR"),
+        help="Reuse the output of previous runs on identical input, filter and options, stored in this directory "
+        "(or set YQ_CACHE_DIR)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=parse_size,
+        metavar="SIZE",
+        default="256M",
+        help="Remove the least recently used entries when the --cache-dir cache grows beyond this size",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="When searching directories given as inputs, only read files matching this pattern, choosing the input "
+        "format by extension (option can repeat; by default, files with {} extensions are read)".format(
+            {"yq": ".yaml/.yml/.json", "xq": ".xml", "tomlq": ".toml"}[program_name]
+        ),
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="GLOB",
+        help="When searching directories given as inputs, skip files and directories matching this pattern "
+        "(option can repeat)",
+    )
+    parser.add_argument(
+        "--with-filename",
+        action="store_true",
+        help='Send each document to jq as {"filename": <input file name>, "document": <document>}',
+    )
     parser.add_argument(
         "--version",
         action=VersionAction,
@@ -155,5 +270,5 @@ def get_parser(program_name, description):
         parser.add_argument(arg, nargs=nargs, dest=arg, action="append", help=argparse.SUPPRESS)
 
     parser.add_argument("jq_filter", nargs="?")
-    parser.add_argument("input_streams", nargs="*", type=argparse.FileType(), metavar="files", default=[])
+    parser.add_argument("input_streams", nargs="*", type=input_file_or_directory, metavar="files", default=[])
     return parser
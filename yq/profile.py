@@ -0,0 +1,208 @@
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+from .limits import peak_rss
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+
+def encoded_size(data, encoding=None):
+    """
+    Returns the number of bytes that data (text or bytes) takes up when encoded (as UTF-8, unless encoding is given).
+    """
+    if isinstance(data, bytes) or data.isascii():
+        return len(data)
+    return len(data.encode(encoding or "utf-8", "replace"))
+
+
+def profiling_requested():
+    value = os.environ.get("YQ_PROFILE", "")
+    if value == "memory":
+        return value
+    return value not in {"", "0"}
+
+
+class Profiler:
+    """
+    Collects wall and CPU time per named phase, counters, and notes for the --profile report.
+
+    Phases can nest; each phase is charged only its self time, so the time spent decoding jq output while the dumper
+    pulls documents is reported under the decoding phase and not also under the dumping phase.
+
+    With trace_memory, tracemalloc also records the peak of traced Python allocations reached while each phase was
+    running, so that the phase responsible for the overall memory peak can be identified.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.phases = {}
+        self.counters = {}
+        self.notes = {}
+        self.stack = []
+        # tracemalloc.reset_peak() is only available on Python 3.9+
+        self.trace_memory = trace_memory and hasattr(tracemalloc, "reset_peak")
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start = (time.perf_counter(), time.process_time())
+        self.jq_cpu_start = self.children_cpu_time()
+
+    @staticmethod
+    def children_cpu_time():
+        if resource is None:
+            return None
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+
+    def _charge(self, name, wall, cpu):
+        phase = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        phase["wall"] += wall
+        phase["cpu"] += cpu
+        if self.trace_memory:
+            phase["peak_alloc"] = max(phase.get("peak_alloc", 0), tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def phase(self, name):
+        now = (time.perf_counter(), time.process_time())
+        if self.stack:
+            parent, resumed = self.stack[-1]
+            self._charge(parent, now[0] - resumed[0], now[1] - resumed[1])
+        self.stack.append((name, now))
+        self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})["calls"] += 1
+        try:
+            yield
+        finally:
+            now = (time.perf_counter(), time.process_time())
+            _, resumed = self.stack.pop()
+            self._charge(name, now[0] - resumed[0], now[1] - resumed[1])
+            if self.stack:
+                self.stack[-1] = (self.stack[-1][0], now)
+
+    def iterate(self, name, iterable, counter=None):
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            if counter:
+                self.count(counter)
+            yield item
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def note(self, name, value):
+        self.notes[name] = value
+
+    def writer(self, stream, counter):
+        return CountingWriter(stream, self, counter)
+
+    def reader(self, stream, counter):
+        return CountingReader(stream, self, counter)
+
+    def report(self, stream=None):
+        wall, cpu = time.perf_counter() - self.start[0], time.process_time() - self.start[1]
+        jq_cpu = self.children_cpu_time()
+        result = dict(
+            wall=round(wall, 6),
+            cpu=round(cpu, 6),
+            phases={name: dict(p, wall=round(p["wall"], 6), cpu=round(p["cpu"], 6)) for name, p in self.phases.items()},
+            counters=self.counters,
+            **self.notes,
+        )
+        if jq_cpu is not None and self.jq_cpu_start is not None:
+            result["jq_cpu"] = round(jq_cpu - self.jq_cpu_start, 6)
+        memory = dict(peak_rss=peak_rss("self"), jq_peak_rss=peak_rss("children"))
+        if self.trace_memory:
+            memory["traced_peak"] = max([p["peak_alloc"] for p in self.phases.values()] + [0])
+            memory["largest_allocation_phase"] = max(
+                self.phases, key=lambda name: self.phases[name]["peak_alloc"], default=None
+            )
+            tracemalloc.stop()
+        result["memory"] = memory
+        stream = stream or sys.stderr
+        json.dump(result, stream, indent=2)
+        stream.write("\n")
+        stream.flush()
+
+
+class NullProfiler:
+    """
+    Stand-in used when profiling is off, so that instrumented code paths cost next to nothing.
+    """
+
+    _null_context = nullcontext()
+
+    def phase(self, name):
+        return self._null_context
+
+    def iterate(self, name, iterable, counter=None):
+        return iterable
+
+    def count(self, name, value=1):
+        pass
+
+    def note(self, name, value):
+        pass
+
+    def writer(self, stream, counter):
+        return stream
+
+    def reader(self, stream, counter):
+        return stream
+
+    def report(self, stream=None):
+        pass
+
+
+null_profiler = NullProfiler()
+
+
+class CountingWriter:
+    """
+    Counts the bytes written to a text stream, in the encoding of the stream.
+    """
+
+    def __init__(self, stream, profiler, counter):
+        self.stream = stream
+        self.profiler = profiler
+        self.counter = counter
+
+    def write(self, data):
+        self.profiler.count(self.counter, encoded_size(data, getattr(self.stream, "encoding", None)))
+        return self.stream.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class CountingReader:
+    """
+    Counts the bytes read from a text stream, in the encoding of the stream.
+    """
+
+    def __init__(self, stream, profiler, counter):
+        self.stream = stream
+        self.profiler = profiler
+        self.counter = counter
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.profiler.count(self.counter, encoded_size(data, getattr(self.stream, "encoding", None)))
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self.profiler.count(self.counter, encoded_size(data, getattr(self.stream, "encoding", None)))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
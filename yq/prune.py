@@ -0,0 +1,172 @@
+"""
+Path pruning: when the jq filter starts with a simple path like ``.spec.template`` or ``.items[3]``, only the subtree
+at that path is constructed and sent to jq, and the filter is rewritten to expect it.
+
+Each document is sent to jq wrapped in an envelope: ``{"yq_pruned": subtree}`` when the path could be followed in the
+composed node graph, or ``{"yq_full": document}`` when it could not (for example, when it crosses a merge key, a
+non-string key or a node of the wrong type). In the latter case jq applies the path itself, so errors and edge cases
+behave exactly as without pruning.
+"""
+
+import json
+import re
+from typing import List, Union
+
+import yaml
+
+path_component_re = re.compile(
+    r"""(?:
+    \.(?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    |\.?\[\s*"(?P<quoted>[^"\\]*)"\s*\]
+    |\."(?P<string>[^"\\]*)"
+    |\.?\[\s*(?P<index>[0-9]+)\s*\]
+    )""",
+    re.X,
+)
+# Builtins that read other inputs or depend on the position in the input, so cannot be applied to pruned documents
+unsafe_builtins_re = re.compile(r"\b(?:input|inputs|input_line_number)\b|\$__loc__")
+# jq options that do not change how inputs are read
+safe_short_options = set("crjaSCMe")
+safe_long_options = {
+    "--compact-output",
+    "--raw-output",
+    "--join-output",
+    "--ascii-output",
+    "--sort-keys",
+    "--color-output",
+    "--monochrome-output",
+    "--exit-status",
+    "--tab",
+}
+safe_options_with_values = {"--indent": 1, "--arg": 2, "--argjson": 2, "--slurpfile": 2, "--rawfile": 2}
+
+str_tag = "tag:yaml.org,2002:str"
+null_tag = "tag:yaml.org,2002:null"
+
+
+def find_filter(jq_args):
+    """
+    Returns the index of the filter in jq_args, or None if jq_args contain options that change how jq reads its input
+    or more than one positional argument.
+    """
+    filter_index, i = None, 0
+    while i < len(jq_args):
+        arg = jq_args[i]
+        if arg in ("--args", "--jsonargs"):
+            if filter_index is None and i + 1 < len(jq_args):
+                filter_index = i + 1
+            break
+        elif arg in safe_options_with_values:
+            i += safe_options_with_values[arg]
+        elif arg.startswith("--"):
+            if arg not in safe_long_options:
+                return None
+        elif arg.startswith("-") and len(arg) > 1:
+            if not set(arg[1:]) <= safe_short_options:
+                return None
+        elif filter_index is None:
+            filter_index = i
+        else:
+            return None
+        i += 1
+    return filter_index
+
+
+def parse_path_prefix(jq_filter):
+    """
+    Splits a filter of the form ``PATH`` or ``PATH | REST`` into the list of path components (strings and array
+    indices) and the remainder of the filter (or None). Returns None if the filter does not have that form.
+    """
+    jq_filter = jq_filter.strip()
+    path: List[Union[str, int]] = []
+    pos = 0
+    # The first component must start with a dot: [0] on its own is an array literal, not an index
+    while pos < len(jq_filter) and (pos > 0 or jq_filter.startswith(".")):
+        match = path_component_re.match(jq_filter, pos)
+        if not match:
+            break
+        if match.group("index") is not None:
+            path.append(int(match.group("index")))
+        else:
+            path.append(next(group for group in match.group("name", "quoted", "string") if group is not None))
+        pos = match.end()
+    rest = jq_filter[pos:].strip()
+    if not path:
+        return None
+    if not rest:
+        return path, None
+    if rest.startswith("|") and not rest.startswith("|=") and not unsafe_builtins_re.search(rest):
+        return path, rest[1:]
+    return None
+
+
+def format_path(path):
+    return "." + "".join("[{}]".format(json.dumps(component)) for component in path)
+
+
+def prune_jq_args(jq_args):
+    """
+    Returns the path to prune documents to and the rewritten jq_args, or None if the filter cannot be proven safe to
+    rewrite.
+    """
+    filter_index = find_filter(jq_args)
+    if filter_index is None:
+        return None
+    parsed = parse_path_prefix(jq_args[filter_index])
+    if parsed is None:
+        return None
+    path, rest = parsed
+    jq_filter = 'if has("yq_pruned") then .yq_pruned else .yq_full | {} end'.format(format_path(path))
+    if rest is not None:
+        jq_filter = "({}) | {}".format(jq_filter, rest)
+    return path, jq_args[:filter_index] + [jq_filter] + jq_args[filter_index + 1 :]
+
+
+def select_path(node, path):
+    """
+    Follows path in a composed node graph. Returns (True, node) with the node at path, or None if the path leads
+    through a null or missing value, and (False, None) if the path cannot be followed without constructing the
+    document.
+    """
+    for component in path:
+        if node is None or (isinstance(node, yaml.ScalarNode) and node.tag == null_tag):
+            return True, None
+        if isinstance(component, str):
+            if not isinstance(node, yaml.MappingNode) or node.tag != yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG:
+                return False, None
+            found = None
+            for key_node, value_node in node.value:
+                if not isinstance(key_node, yaml.ScalarNode) or key_node.tag != str_tag:
+                    return False, None
+                if key_node.value == component:
+                    found = value_node
+            node = found
+        else:
+            if not isinstance(node, yaml.SequenceNode) or node.tag != yaml.resolver.BaseResolver.DEFAULT_SEQUENCE_TAG:
+                return False, None
+            node = node.value[component] if component < len(node.value) else None
+    return True, node
+
+
+def construct_pruned_document(loader, node, path):
+    found, subtree = select_path(node, path)
+    if not found:
+        return {"yq_full": loader.construct_document(node)}
+    return {"yq_pruned": loader.construct_document(subtree) if subtree is not None else None}
+
+
+def prune_document(doc, path):
+    """
+    Like construct_pruned_document, for a document that is already constructed (for example, decoded from JSON).
+    """
+    subtree = doc
+    for component in path:
+        if subtree is None:
+            break
+        if isinstance(component, str) and isinstance(subtree, dict):
+            subtree = subtree.get(component)
+        elif isinstance(component, int) and isinstance(subtree, list):
+            subtree = subtree[component] if component < len(subtree) else None
+        else:
+            return {"yq_full": doc}
+    return {"yq_pruned": subtree}
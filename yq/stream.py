@@ -0,0 +1,245 @@
+"""
+Event streaming for --yaml-stream: converts PyYAML parser events directly into the ``[path, leaf]`` and ``[path]``
+events that ``jq --stream`` produces for JSON, without constructing documents. Each event is sent to jq as a separate
+input, so filters can use jq's streaming builtins (``fromstream``, ``truncate_stream``) on them.
+
+Only scalars are constructed. Anchored nodes are recorded as events so that aliases to them can be replayed; merge keys
+cannot be applied without holding the whole mapping and are rejected.
+
+ItemComposer implements --yaml-item-depth the same way, but composes and constructs whole nodes at a given depth. Merge
+keys are supported inside those nodes, but rejected above them.
+"""
+
+import json
+
+import yaml
+
+merge_tag = "tag:yaml.org,2002:merge"
+
+
+class YAMLStreamError(Exception):
+    pass
+
+
+def stream_key(key):
+    # Mirrors the conversion of mapping keys done by json.dumps
+    if isinstance(key, str):
+        return key
+    if key is None or isinstance(key, (bool, int, float)):
+        return json.dumps(key)
+    raise YAMLStreamError("keys must be str, int, float, bool or None, not {}".format(type(key).__name__))
+
+
+def raise_merge_key_error():
+    raise YAMLStreamError("merge keys above the item depth are not supported with --yaml-item-depth")
+
+
+class Frame:
+    __slots__ = ("is_mapping", "key", "expecting_key", "length")
+
+    def __init__(self, is_mapping):
+        self.is_mapping = is_mapping
+        self.key = None if is_mapping else -1
+        self.expecting_key = is_mapping
+        self.length = 0
+
+
+class Recording:
+    __slots__ = ("anchor", "events", "depth")
+
+    def __init__(self, event):
+        self.anchor = event.anchor
+        self.events = [event]
+        self.depth = 1 if isinstance(event, yaml.CollectionStartEvent) else 0
+
+
+class EventStreamer:
+    """
+    Turns the parser events passed to feed() into jq stream events, passing each one to emit as a ``[path, leaf]`` or
+    ``[path]`` list. The path list is reused, so emit must serialize the event before returning.
+    """
+
+    def __init__(self, loader, emit):
+        self.loader = loader
+        self.emit = emit
+        self.path = []
+        self.frames = []
+        self.anchors = {}
+        self.recordings = []
+
+    def feed(self, event):
+        for recording in self.recordings:
+            recording.events.append(event)
+            if isinstance(event, yaml.CollectionStartEvent):
+                recording.depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                recording.depth -= 1
+        if isinstance(event, (yaml.ScalarEvent, yaml.CollectionStartEvent)) and event.anchor is not None:
+            self.recordings.append(Recording(event))
+        elif isinstance(event, yaml.DocumentStartEvent):
+            self.anchors = {}
+        self.dispatch(event)
+        if self.recordings and self.recordings[-1].depth == 0:
+            for recording in self.recordings:
+                if recording.depth == 0:
+                    self.anchors[recording.anchor] = recording.events
+            self.recordings = [recording for recording in self.recordings if recording.depth > 0]
+
+    def dispatch(self, event):
+        if isinstance(event, yaml.AliasEvent):
+            if event.anchor not in self.anchors:
+                raise YAMLStreamError("found undefined alias {}".format(event.anchor))
+            for recorded_event in self.anchors[event.anchor]:
+                self.dispatch(recorded_event)
+        elif isinstance(event, yaml.ScalarEvent):
+            self.scalar(event)
+        elif isinstance(event, yaml.CollectionStartEvent):
+            self.start_value()
+            self.frames.append(Frame(isinstance(event, yaml.MappingStartEvent)))
+        elif isinstance(event, yaml.CollectionEndEvent):
+            frame = self.frames.pop()
+            if frame.length == 0:
+                self.emit([self.path, {} if frame.is_mapping else []])
+            else:
+                # jq closes a collection with the path of its last item
+                self.path.append(frame.key)
+                self.emit([self.path])
+                self.path.pop()
+            self.end_value()
+
+    def scalar(self, event):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = self.loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        frame = self.frames[-1] if self.frames else None
+        if frame is not None and frame.expecting_key and tag == merge_tag:
+            raise YAMLStreamError("merge keys are not supported with --yaml-stream")
+        node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        value = self.loader.construct_document(node)
+        if frame is not None and frame.expecting_key:
+            frame.key = stream_key(value)
+            frame.expecting_key = False
+            return
+        self.start_value()
+        self.emit([self.path, value])
+        self.end_value()
+
+    def start_value(self):
+        if self.frames:
+            frame = self.frames[-1]
+            if frame.expecting_key:
+                raise YAMLStreamError("complex mapping keys are not supported with --yaml-stream")
+            if not frame.is_mapping:
+                frame.key += 1
+            self.path.append(frame.key)
+
+    def end_value(self):
+        if self.frames:
+            frame = self.frames[-1]
+            self.path.pop()
+            frame.length += 1
+            frame.expecting_key = frame.is_mapping
+
+
+class ItemComposer:
+    """
+    Composes each node found at item_depth (1 for the items of a top-level sequence or the values of a top-level
+    mapping) from the parser events passed to feed(), and passes it to emit constructed as a separate document. Keys,
+    scalars and empty collections above item_depth are skipped. Anchored nodes above item_depth are composed whole, so
+    that aliases to them can be resolved, and their items are emitted from the composed node. Merge keys above
+    item_depth raise YAMLStreamError, since the merged items could only be emitted once the whole mapping is read.
+    """
+
+    def __init__(self, loader, item_depth, emit):
+        self.loader = loader
+        self.item_depth = item_depth
+        self.emit = emit
+        self.frames = []
+        self.nodes = []
+        self.anchors = {}
+        self.skipped_depth = 0
+
+    def feed(self, event):
+        if self.nodes:
+            self.compose(event)
+        elif self.skipped_depth:
+            # Skipping a complex key
+            if isinstance(event, yaml.CollectionStartEvent):
+                self.skipped_depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                self.skipped_depth -= 1
+        elif isinstance(event, yaml.DocumentStartEvent):
+            self.anchors = {}
+        elif isinstance(event, yaml.CollectionEndEvent):
+            self.frames.pop()
+            self.end_value()
+        elif isinstance(event, yaml.NodeEvent):
+            frame = self.frames[-1] if self.frames else None
+            if frame is not None and frame.expecting_key:
+                frame.expecting_key = False
+                if isinstance(event, yaml.ScalarEvent) and self.resolve(yaml.ScalarNode, event) == merge_tag:
+                    raise_merge_key_error()
+                if isinstance(event, yaml.CollectionStartEvent):
+                    self.skipped_depth = 1
+            elif len(self.frames) == self.item_depth or event.anchor is not None:
+                self.compose(event)
+            elif isinstance(event, yaml.CollectionStartEvent):
+                self.frames.append(Frame(isinstance(event, yaml.MappingStartEvent)))
+            else:
+                self.end_value()
+
+    def end_value(self):
+        if self.frames:
+            self.frames[-1].expecting_key = self.frames[-1].is_mapping
+
+    def resolve(self, node_class, event):
+        if event.tag is None or event.tag == "!":
+            return self.loader.resolve(node_class, getattr(event, "value", None), event.implicit)
+        return event.tag
+
+    def compose(self, event):
+        if isinstance(event, yaml.AliasEvent):
+            if event.anchor not in self.anchors:
+                raise YAMLStreamError("found undefined alias {}".format(event.anchor))
+            node = self.anchors[event.anchor]
+        elif isinstance(event, yaml.ScalarEvent):
+            tag = self.resolve(yaml.ScalarNode, event)
+            node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+        elif isinstance(event, yaml.CollectionStartEvent):
+            node_class = yaml.MappingNode if isinstance(event, yaml.MappingStartEvent) else yaml.SequenceNode
+            node = node_class(self.resolve(node_class, event), [], event.start_mark, None, flow_style=event.flow_style)
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+            self.nodes.append([node, None])
+            return
+        elif isinstance(event, yaml.CollectionEndEvent):
+            node = self.nodes.pop()[0]
+            node.end_mark = event.end_mark
+        else:
+            return
+        if not self.nodes:
+            self.emit_items(node, len(self.frames))
+            self.end_value()
+            return
+        parent = self.nodes[-1]
+        if isinstance(parent[0], yaml.SequenceNode):
+            parent[0].value.append(node)
+        elif parent[1] is None:
+            parent[1] = node
+        else:
+            parent[0].value.append((parent[1], node))
+            parent[1] = None
+
+    def emit_items(self, node, depth):
+        if depth == self.item_depth:
+            self.emit(self.loader.construct_document(node))
+        elif isinstance(node, yaml.SequenceNode):
+            for value_node in node.value:
+                self.emit_items(value_node, depth + 1)
+        elif isinstance(node, yaml.MappingNode):
+            for key_node, value_node in node.value:
+                if key_node.tag == merge_tag:
+                    raise_merge_key_error()
+                self.emit_items(value_node, depth + 1)
@@ -1,33 +1,60 @@
 from datetime import date, datetime, time
+from typing import Any
 
 import tomlkit
 from tomlkit.items import AoT, Array, Bool, Float, InlineTable, Integer, Item, String, Table
+from tomlkit.parser import Parser
 from tomlkit.toml_document import TOMLDocument
 
+from .trampoline import run
+
 TOML_META_KEY = "__tomlq_meta__"
+_toml_containers = (TOMLDocument, Table, InlineTable, AoT, Array)
 
 
 def tomlkit_to_json(value, use_annotations=False):
-    if isinstance(value, (TOMLDocument, Table, InlineTable)):
-        result = {}
-        for key, item in value.items():
-            result[key] = tomlkit_to_json(item, use_annotations=use_annotations)
-        if use_annotations:
-            result[TOML_META_KEY] = {"source": _toml_fragment(value), "type": type(value).__name__}
-        return result
-    if isinstance(value, AoT):
-        return [tomlkit_to_json(item, use_annotations=use_annotations) for item in value]
-    if isinstance(value, Array):
-        return [tomlkit_to_json(item, use_annotations=use_annotations) for item in value]
-    if hasattr(value, "unwrap"):
-        return value.unwrap()
-    return value
+    """
+    Converts a tomlkit document or item to plain values. Tables and arrays are walked with an explicit stack, so that
+    documents of any nesting depth can be converted.
+    """
+    root = [value]
+    stack: list = [(root, 0)]
+    while stack:
+        target, key = stack.pop()
+        value = target[key]
+        result: Any
+        if isinstance(value, (TOMLDocument, Table, InlineTable)):
+            result = {}
+            for item_key, item in value.items():
+                result[item_key] = item
+                if isinstance(item, _toml_containers):
+                    stack.append((result, item_key))
+                elif hasattr(item, "unwrap"):
+                    result[item_key] = item.unwrap()
+            if use_annotations:
+                result[TOML_META_KEY] = {"source": _toml_fragment(value), "type": type(value).__name__}
+        elif isinstance(value, (AoT, Array)):
+            result = list(value)
+            for index, item in enumerate(result):
+                if isinstance(item, _toml_containers):
+                    stack.append((result, index))
+                elif hasattr(item, "unwrap"):
+                    result[index] = item.unwrap()
+        elif hasattr(value, "unwrap"):
+            result = value.unwrap()
+        else:
+            result = value
+        target[key] = result
+    return root[0]
 
 
 def tomlkit_from_json(value):
     if not isinstance(value, dict):
         return value
+    return run(_from_json(value))
+
 
+def _from_json(value):
     meta = value.get(TOML_META_KEY)
     if isinstance(meta, dict) and isinstance(meta.get("source"), str):
         try:
@@ -37,10 +64,112 @@ def tomlkit_from_json(value):
     else:
         doc = tomlkit.document()
 
-    _apply_mapping(doc, value)
+    yield _apply_mapping(doc, value)
     return doc
 
 
+class SpanParser(Parser):
+    """
+    tomlkit's parser, recording the span of text that each value item was parsed from in spans, by id of the item.
+    This relies on internals of tomlkit's parser (_parse_value and _idx); if they change, spans stays empty or parsing
+    raises AttributeError or TypeError, and TomlSource does without spans.
+    """
+
+    def __init__(self, string):
+        super().__init__(string)
+        self.spans = {}
+
+    def _parse_value(self):
+        start = self._idx
+        item = super()._parse_value()
+        # The item is kept with its span, so that its id is not reused for another object
+        self.spans[id(item)] = (item, start, self._idx)
+        return item
+
+
+class TomlSource:
+    """
+    A TOML document read for tomlq -T: its text, the tomlkit document parsed from it with the spans of its values, and
+    data, the annotated data sent to jq (see tomlkit_to_json). splice_toml() edits the text of a TomlSource. key is the
+    source recorded in the annotations of data, which differs from text when tables are out of order.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            parser = SpanParser(text)
+            self.doc = parser.parse()
+            self.spans = parser.spans
+        except (AttributeError, TypeError):
+            # Without spans, splice_toml() leaves documents to be rebuilt by tomlkit_from_json()
+            self.doc, self.spans = tomlkit.parse(text), {}
+        self.data = tomlkit_to_json(self.doc, use_annotations=True)
+        self.key = self.data[TOML_META_KEY]["source"]
+
+
+def splice_toml(value, sources):
+    """
+    Returns the text of the TomlSource that value was converted from, found in sources by its key, with the values
+    that differ in value replaced in place. Replaced values are written as tomlkit_from_json(value) would write them,
+    and the rest of the text is kept verbatim, so the time taken depends on the size of the changes rather than on the
+    size of the document. Returns None if value does not come from one of sources, or if the changes are not confined
+    to values that can be replaced in place (for example, when keys are added or removed, or a table is replaced).
+    """
+    meta = value.get(TOML_META_KEY)
+    if not isinstance(meta, dict) or not isinstance(meta.get("source"), str) or meta["source"] not in sources:
+        return None
+    source = sources[meta["source"]]
+    edits = []
+    stack = [(source.doc, source.data, value)]
+    while stack:
+        container, data, new_data = stack.pop()
+        new_items = _plain_items(new_data)
+        if {key for key, _ in new_items} != set(container.keys()):
+            return None
+        for key, new_value in new_items:
+            if data[key] == new_value:
+                continue
+            current = container[key]
+            if isinstance(new_value, dict) and isinstance(current, Table):
+                stack.append((current, data[key], new_value))
+            elif isinstance(new_value, list) and isinstance(current, AoT):
+                if len(new_value) != len(current) or not all(isinstance(item, dict) for item in new_value):
+                    return None
+                stack.extend(zip(current, data[key], new_value))
+            else:
+                edit = _value_edit(source, current, new_value)
+                if edit is None:
+                    return None
+                edits.append(edit)
+    edits.sort()
+    parts, position = [], 0
+    for start, end, text in edits:
+        parts.append(source.text[position:start])
+        parts.append(text)
+        position = end
+    parts.append(source.text[position:])
+    return "".join(parts)
+
+
+def _value_edit(source, current, value):
+    # Returns (start, end, text) to replace the text of the value item current with value, as _apply_mapping would
+    span = source.spans.get(id(current))
+    if span is None or span[0] is not current:
+        return None
+    _, start, end = span
+    if source.text[start:end] != current.as_string():
+        return None
+    if isinstance(value, (dict, list)):
+        replacement = run(_overlay_item(current, value))
+    else:
+        replacement = _overlay_scalar(current, value)
+    if not isinstance(replacement, Item):
+        replacement = tomlkit.item(replacement)
+    if isinstance(replacement, (Table, AoT)):
+        return None
+    return start, end, replacement.as_string()
+
+
 def _toml_fragment(value):
     if isinstance(value, InlineTable):
         return tomlkit.dumps(value.unwrap())
@@ -51,6 +180,7 @@ def _plain_items(mapping):
     return [(key, value) for key, value in mapping.items() if key != TOML_META_KEY]
 
 
+# The steps below are run with run(): nested tables and arrays are yielded instead of being applied recursively
 def _apply_mapping(container, data):
     desired = {key for key, _ in _plain_items(data)}
     for key in list(container.keys()):
@@ -60,11 +190,16 @@ def _apply_mapping(container, data):
     for key, value in _plain_items(data):
         if key in container:
             current = container[key]
-            replacement = _overlay_item(current, value)
+            if isinstance(value, (dict, list)):
+                replacement = yield _overlay_item(current, value)
+            else:
+                replacement = _overlay_scalar(current, value)
             if replacement is not current:
                 container[key] = replacement
+        elif isinstance(value, dict):
+            container[key] = yield _new_table(value)
         else:
-            container[key] = _new_item(value)
+            container[key] = _new_plain_value(value)
 
     return container
 
@@ -72,18 +207,19 @@ def _apply_mapping(container, data):
 def _overlay_item(current, value):
     if isinstance(value, dict):
         if isinstance(current, (Table, InlineTable, TOMLDocument)):
-            return _apply_mapping(current, value)
-        return tomlkit_from_json(value)
-
-    if isinstance(value, list):
-        if isinstance(current, AoT) and all(isinstance(item, dict) for item in value):
-            _apply_aot(current, value)
-            return current
-        if isinstance(current, Array):
-            _apply_array(current, value)
-            return current
-        return [_new_plain_value(item) for item in value]
+            return (yield _apply_mapping(current, value))
+        return (yield _from_json(value))
 
+    if isinstance(current, AoT) and all(isinstance(item, dict) for item in value):
+        yield _apply_aot(current, value)
+        return current
+    if isinstance(current, Array):
+        yield _apply_array(current, value)
+        return current
+    return _new_plain_value(value)
+
+
+def _overlay_scalar(current, value):
     if _json_value(current) == value:
         return current
 
@@ -93,7 +229,10 @@ def _overlay_item(current, value):
 def _apply_array(array, values):
     common_len = min(len(array), len(values))
     for index in range(common_len):
-        replacement = _overlay_item(array[index], values[index])
+        if isinstance(values[index], (dict, list)):
+            replacement = yield _overlay_item(array[index], values[index])
+        else:
+            replacement = _overlay_scalar(array[index], values[index])
         if replacement is not array[index]:
             array[index] = replacement
 
@@ -107,15 +246,19 @@ def _apply_array(array, values):
 def _apply_aot(aot, values):
     common_len = min(len(aot), len(values))
     for index in range(common_len):
-        _apply_mapping(aot[index], values[index])
+        yield _apply_mapping(aot[index], values[index])
 
     while len(aot) > len(values):
         del aot[-1]
 
     for value in values[common_len:]:
-        table = tomlkit.table()
-        _apply_mapping(table, value)
-        aot.append(table)
+        aot.append((yield _new_table(value)))
+
+
+def _new_table(value):
+    table = tomlkit.table()
+    yield _apply_mapping(table, value)
+    return table
 
 
 def _replacement_item(current, value):
@@ -146,23 +289,28 @@ def _copy_trivia(source, target):
         target.trivia.trail = source.trivia.trail
 
 
-def _new_item(value):
-    value = _new_plain_value(value)
-    if isinstance(value, dict):
-        table = tomlkit.table()
-        _apply_mapping(table, value)
-        return table
-    if isinstance(value, list):
-        return [_new_plain_value(item) for item in value]
-    return value
-
-
 def _new_plain_value(value):
-    if isinstance(value, dict):
-        return {key: _new_plain_value(item) for key, item in _plain_items(value)}
-    if isinstance(value, list):
-        return [_new_plain_value(item) for item in value]
-    return value
+    """
+    Returns a copy of value without the TOML metadata of its tables.
+    """
+    if not isinstance(value, (dict, list)):
+        return value
+    root = [value]
+    stack: list = [(root, 0)]
+    while stack:
+        target, key = stack.pop()
+        value = target[key]
+        result: Any
+        items: Any
+        if isinstance(value, dict):
+            result = dict(_plain_items(value))
+            items = result.items()
+        else:
+            result = list(value)
+            items = enumerate(result)
+        stack.extend((result, item_key) for item_key, item in items if isinstance(item, (dict, list)))
+        target[key] = result
+    return root[0]
 
 
 def _json_value(item):
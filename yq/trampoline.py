@@ -0,0 +1,32 @@
+"""
+Explicit-stack evaluation of the recursive converters. A step is written as a generator that yields the generator of
+each nested step instead of calling it, and is sent back the nested step's return value. run() keeps the suspended
+generators on a list, so nesting depth is limited by memory rather than by the interpreter's recursion limit, while the
+steps still run in the same order as the recursive calls would.
+"""
+
+
+def run(steps):
+    """
+    Runs the generator steps and the nested steps it yields, and returns the value it returns. An exception raised by a
+    nested step is raised in the step that yielded it.
+    """
+    stack, value, error = [steps], None, None
+    while stack:
+        try:
+            if error is None:
+                nested = stack[-1].send(value)
+            else:
+                nested, error = stack[-1].throw(error), None
+        except StopIteration as stop:
+            stack.pop()
+            value, error = stop.value, None
+        except Exception as e:
+            stack.pop()
+            if not stack:
+                raise
+            value, error = None, e
+        else:
+            stack.append(nested)
+            value = None
+    return value
@@ -0,0 +1,187 @@
+"""
+Incremental XML output for xq -x: writes the same pretty-printed XML as ``xmltodict.unparse(doc, pretty=True,
+indent="  ")``, but walks the document with an explicit stack and writes the output in chunks as it goes, so neither
+the nesting depth nor the size of the output is limited by the recursion limit or held in memory.
+"""
+
+from xml.sax.saxutils import escape, quoteattr
+
+attr_prefix = "@"
+cdata_key = "#text"
+comment_key = "#comment"
+indent = "  "
+# Number of characters collected before they are written to the output stream
+chunk_size = 2**16
+
+
+def to_string(value):
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def validate_name(name, kind):
+    if not isinstance(name, str):
+        raise ValueError(f"{kind} name must be a string")
+    if name.startswith("?") or name.startswith("!"):
+        raise ValueError(f'Invalid {kind} name: cannot start with "?" or "!"')
+    if "<" in name or ">" in name:
+        raise ValueError(f'Invalid {kind} name: "<" or ">" not allowed')
+    if "/" in name:
+        raise ValueError(f'Invalid {kind} name: "/" not allowed')
+    if '"' in name or "'" in name:
+        raise ValueError(f"Invalid {kind} name: quotes not allowed")
+    if "=" in name:
+        raise ValueError(f'Invalid {kind} name: "=" not allowed')
+    if any(ch.isspace() for ch in name):
+        raise ValueError(f"Invalid {kind} name: whitespace not allowed")
+
+
+def validate_comment(text):
+    if "--" in text:
+        raise ValueError("Comment text cannot contain '--'")
+    if text.endswith("-"):
+        raise ValueError("Comment text cannot end with '-'")
+    return text
+
+
+class XMLWriter:
+    """
+    Writes the documents passed to write() to stream. With short_empty_elements, elements without content are written
+    as ``<name/>``.
+    """
+
+    def __init__(self, stream, short_empty_elements=False):
+        self.stream = stream
+        self.short_empty_elements = short_empty_elements
+        self.parts = []
+        self.size = 0
+        self.pending_start = False
+
+    def write(self, doc, full_document=False):
+        """
+        Writes doc, a dict with the root element(s) of the document. With full_document, an XML declaration is written
+        first, and doc must have exactly one root element.
+        """
+        if full_document:
+            self.out('<?xml version="1.0" encoding="utf-8"?>\n')
+        seen_root = False
+        for key, value in doc.items():
+            if key != comment_key and full_document and seen_root:
+                raise ValueError("Document must have exactly one root.")
+            self.write_element(key, value, full_document)
+            if key != comment_key:
+                seen_root = True
+        if full_document and not seen_root:
+            raise ValueError("Document must have exactly one root.")
+        self.flush()
+
+    def write_element(self, key, value, full_document):
+        # The stack holds iterators over entries, which are ("key", ...) for a key and its value (a comment or one or
+        # more elements), ("element", ...) for one element, and ("end", ...) for the content and end tag of an element
+        # whose children have been written. Items of lists are only visited as they are reached.
+        stack = [iter([("key", key, value, 0)])]
+        while stack:
+            entry = next(stack[-1], None)
+            if entry is None:
+                stack.pop()
+                continue
+            kind, key, value, depth = entry
+            if kind == "end":
+                self.end_element(key, depth, *value)
+            elif kind == "element":
+                stack.append(iter(self.start_element(key, value, depth)))
+            elif key == comment_key:
+                self.comments(value, depth)
+            else:
+                validate_name(key, "element")
+                items = value if isinstance(value, list) else [value]
+                if full_document and depth == 0 and len(items) > 1:
+                    raise ValueError("document with multiple roots")
+                stack.append(("element", key, item, depth) for item in items)
+
+    def start_element(self, key, value, depth):
+        """
+        Writes the start tag of an element, and returns the stack entries for its children and its end, in order.
+        """
+        if value is None:
+            value = {}
+        elif not isinstance(value, (dict, str)):
+            value = to_string(value)
+        if isinstance(value, str):
+            value = {cdata_key: value}
+        cdata, attrs, children = None, [], []
+        for child_key, child_value in value.items():
+            if child_key == cdata_key:
+                cdata = None if child_value is None else to_string(child_value)
+            elif isinstance(child_key, str) and child_key.startswith(attr_prefix):
+                if child_key == "@xmlns" and isinstance(child_value, dict):
+                    for prefix, uri in child_value.items():
+                        validate_name(prefix, "attribute")
+                        attrs.append(("xmlns:" + prefix if prefix else "xmlns", "" if uri is None else to_string(uri)))
+                    continue
+                attr_name = child_key[len(attr_prefix) :]
+                validate_name(attr_name, "attribute")
+                attrs.append((attr_name, "" if child_value is None else to_string(child_value)))
+            elif not (isinstance(child_value, list) and not child_value):
+                children.append(("key", child_key, child_value, depth + 1))
+        self.whitespace(depth * indent)
+        self.finish_start()
+        self.out("<" + key)
+        for attr_name, attr_value in attrs:
+            self.out(" {}={}".format(attr_name, quoteattr(attr_value)))
+        if self.short_empty_elements:
+            self.pending_start = True
+        else:
+            self.out(">")
+        if children:
+            self.whitespace("\n")
+        return children + [("end", key, (cdata, bool(children)), depth)]
+
+    def end_element(self, key, depth, cdata, has_children):
+        if cdata:
+            self.finish_start()
+            self.out(escape(cdata))
+        if has_children:
+            self.whitespace(depth * indent)
+        if self.pending_start:
+            self.out("/>")
+            self.pending_start = False
+        else:
+            self.out("</{}>".format(key))
+        if depth:
+            self.whitespace("\n")
+
+    def comments(self, value, depth):
+        for text in value if isinstance(value, list) else [value]:
+            if text is None:
+                continue
+            text = to_string(text)
+            if not text:
+                continue
+            self.whitespace(depth * indent)
+            self.out("<!--{}-->".format(escape(validate_comment(text))))
+            self.whitespace("\n")
+
+    def whitespace(self, text):
+        if text:
+            self.finish_start()
+            self.out(text)
+
+    def finish_start(self):
+        if self.pending_start:
+            self.out(">")
+            self.pending_start = False
+
+    def out(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+        if self.size >= chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.parts:
+            self.stream.write("".join(self.parts))
+            self.parts, self.size = [], 0
@@ -1,13 +1,22 @@
 import base64
 import re
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, cast
+from typing import Any, Dict, Generator, List, Optional, cast
 
 import yaml
 from yaml.emitter import Emitter
-from yaml.events import AliasEvent, CollectionStartEvent, MappingEndEvent, ScalarEvent, SequenceEndEvent
+from yaml.events import (
+    AliasEvent,
+    CollectionStartEvent,
+    MappingEndEvent,
+    ScalarEvent,
+    SequenceEndEvent,
+    SequenceStartEvent,
+)
 from yaml.serializer import Serializer
 
+from .trampoline import run
+
 COMMENT_PLACEMENT_BEFORE = "before"
 COMMENT_PLACEMENT_INLINE = "inline"
 
@@ -72,7 +81,61 @@ def consume_comments_for_node(loader: Any, anchor_node: Any, value_node: Optiona
     return result
 
 
-class CommentPreservingLoader(yaml.SafeLoader):
+class IterativeComposerMixin:
+    """
+    Composes collections with run() instead of recursive compose_node calls, so that documents of any nesting depth
+    can be composed. The nodes are the same as those composed by yaml.composer.Composer.
+    """
+
+    def compose_node(self, parent: Any, index: Any) -> Any:
+        loader = cast(Any, self)
+        if not loader.check_event(CollectionStartEvent):
+            return yaml.composer.Composer.compose_node(loader, parent, index)
+        return run(self.compose_collection_steps(parent, index))
+
+    def compose_collection_steps(self, parent: Any, index: Any) -> Generator[Any, Any, Any]:
+        loader = cast(Any, self)
+        anchor = loader.peek_event().anchor
+        if anchor is not None and anchor in loader.anchors:
+            raise yaml.composer.ComposerError(
+                f"found duplicate anchor {anchor!r}; first occurrence",
+                loader.anchors[anchor].start_mark,
+                "second occurrence",
+                loader.peek_event().start_mark,
+            )
+        loader.descend_resolver(parent, index)
+        start_event = loader.get_event()
+        node_class = yaml.SequenceNode if isinstance(start_event, SequenceStartEvent) else yaml.MappingNode
+        tag = start_event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(node_class, None, start_event.implicit)
+        node = node_class(tag, [], start_event.start_mark, None, flow_style=start_event.flow_style)
+        if anchor is not None:
+            loader.anchors[anchor] = node
+        if node_class is yaml.SequenceNode:
+            while not loader.check_event(SequenceEndEvent):
+                item_index = len(node.value)
+                if loader.check_event(CollectionStartEvent):
+                    node.value.append((yield self.compose_collection_steps(node, item_index)))
+                else:
+                    node.value.append(yaml.composer.Composer.compose_node(loader, node, item_index))
+        else:
+            while not loader.check_event(MappingEndEvent):
+                if loader.check_event(CollectionStartEvent):
+                    item_key = yield self.compose_collection_steps(node, None)
+                else:
+                    item_key = yaml.composer.Composer.compose_node(loader, node, None)
+                if loader.check_event(CollectionStartEvent):
+                    item_value = yield self.compose_collection_steps(node, item_key)
+                else:
+                    item_value = yaml.composer.Composer.compose_node(loader, node, item_key)
+                node.value.append((item_key, item_value))
+        node.end_mark = loader.get_event().end_mark
+        loader.ascend_resolver()
+        return node
+
+
+class CommentPreservingLoader(IterativeComposerMixin, yaml.SafeLoader):
     def __init__(self, stream: Any) -> None:
         self.yaml_comments: List[YamlComment] = []
         super().__init__(stream)